@@ -0,0 +1 @@
+# Benchmarks of the service, run them from the flask directory: python -m benchmarks.<name>
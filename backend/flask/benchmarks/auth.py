@@ -0,0 +1,73 @@
+"""
+Benchmark of the per-request overhead of the token authentication.
+
+The same API request (GET /api/v1/metrics, which doesn't query the database, with a bearer token) is sent through
+the test client without authentication, with authentication and the cache of verified tokens (--clients distinct
+tokens), and with authentication but without cache (every request checks the signature and decodes the claims).
+The benchmark reports the median and p99 latency of each setup and the overhead compared with no authentication,
+then the cost of the verification alone.
+
+Usage: python -m benchmarks.auth [--requests 20000] [--clients 100]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+# The benchmark runs on its own database unless TEST_DATABASE_URI is given (ie. a local PostgreSQL server)
+os.environ.setdefault('TEST_DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+from myapp import create_app
+from myapp.auth import TokenVerifier
+from myapp.database import db
+from myapp.extensions import auth
+
+URL = '/api/v1/metrics'
+
+
+def latencies(fn, count):
+  samples = []
+  for _ in range(count):
+    start = time.perf_counter()
+    fn()
+    samples.append(time.perf_counter() - start)
+  samples.sort()
+  return statistics.median(samples) * 1e6, samples[int(len(samples) * 0.99) - 1] * 1e6
+
+def run(label, requests, clients, baseline=None, **config):
+  app = create_app('test')
+  app.logger.disabled = True
+  app.config.update(AUTH_SECRET_KEY='benchmark', **config)
+  # The extensions read their configuration when they are initialized
+  auth.init_app(app)
+  with app.app_context():
+    db.create_all()
+  verifier = app.extensions['auth']
+  # The requests carry the same tokens in every setup, so only the verification differs
+  issuer = verifier or TokenVerifier(app, db)
+  headers = [{ 'Authorization': 'Bearer ' + issuer.issue('client{}'.format(i), 'default') } for i in range(clients)]
+  client = app.test_client()
+  latencies(lambda: client.get(URL, headers=random.choice(headers)), requests // 10)
+  median, p99 = latencies(lambda: client.get(URL, headers=random.choice(headers)), requests)
+  overhead = '' if baseline is None else '  overhead {:>+7.1f}us'.format(median - baseline)
+  print('{:<24} median={:>7.1f}us p99={:>7.1f}us{}'.format(label, median, p99, overhead))
+  return median, verifier, [header['Authorization'][7:] for header in headers]
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark of the per-request overhead of the token authentication')
+  parser.add_argument('--requests', type=int, default=20000)
+  parser.add_argument('--clients', type=int, default=100)
+  args = parser.parse_args()
+  baseline, _, _ = run('no authentication', args.requests, args.clients, AUTH_ENABLED=False)
+  _, verifier, tokens = run('tokens, cached', args.requests, args.clients, baseline, AUTH_ENABLED=True)
+  run('tokens, not cached', args.requests, args.clients, baseline, AUTH_ENABLED=True, AUTH_CACHE_SIZE=0)
+
+  cached, _ = latencies(lambda: verifier.verify(random.choice(tokens)), args.requests)
+  verifier.cache_size = 0
+  verifier._cache.clear()
+  uncached, _ = latencies(lambda: verifier.verify(random.choice(tokens)), args.requests)
+  print('verify: cached {:.1f}us, signature check {:.1f}us'.format(cached, uncached))
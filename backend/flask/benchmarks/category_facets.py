@@ -0,0 +1,114 @@
+"""
+Benchmark of the facets of the categories: counter table against counting the products.
+
+The products (--products, spread over --categories categories, 1 in 10 in the shopping cart) are generated server
+side with their counters. The benchmark reports the latency of the facets read from the counters
+(Category.find_facets) and computed with a GROUP BY over the products, the latency of the products of a category
+(/products?category=, composite index), and the throughput of the cart updates of categorized and uncategorized
+products, to show the cost of maintaining the counters in the transaction of the products.
+
+Usage: python -m benchmarks.category_facets [--products 200000] [--categories 50] [--queries 200] [--updates 2000]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+# The benchmark runs on its own database unless TEST_DATABASE_URI is given (ie. a local PostgreSQL server)
+os.environ.setdefault('TEST_DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+from sqlalchemy import text
+from myapp import create_app
+from myapp.database import db
+from myapp.blueprints.product.models import Category, Product
+
+TENANT = 'default'
+
+PRODUCTS = {
+  'sqlite': """
+    WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i < :products - 1)
+    INSERT INTO products (tenant_id, name, shopping_cart, version, category_id)
+    SELECT :tenant, 'product' || i, i % 10 = 0, 1, CASE WHEN i % 2 = 0 THEN 1 + (i / 2) % :categories END
+    FROM seq
+  """,
+  'postgresql': """
+    INSERT INTO products (tenant_id, name, shopping_cart, version, category_id)
+    SELECT :tenant, 'product' || i, i % 10 = 0, 1, CASE WHEN i % 2 = 0 THEN 1 + (i / 2) % :categories END
+    FROM generate_series(0, :products - 1) AS i
+  """
+}
+
+COUNTERS = """
+  INSERT INTO category_counts (tenant_id, category_id, products, in_cart)
+  SELECT c.tenant_id, c.id, count(p.name), count(CASE WHEN p.shopping_cart THEN 1 END)
+  FROM categories c LEFT JOIN products p ON p.tenant_id = c.tenant_id AND p.category_id = c.id
+  GROUP BY c.tenant_id, c.id
+"""
+
+GROUP_BY = """
+  SELECT c.id, c.name, c.aisle, count(p.name), count(CASE WHEN p.shopping_cart THEN 1 END)
+  FROM categories c LEFT JOIN products p ON p.tenant_id = c.tenant_id AND p.category_id = c.id
+  WHERE c.tenant_id = :tenant GROUP BY c.id, c.name, c.aisle ORDER BY c.aisle, c.name
+"""
+
+
+def latency(fn, queries):
+  samples = []
+  for _ in range(queries):
+    start = time.perf_counter()
+    fn()
+    samples.append(time.perf_counter() - start)
+  samples.sort()
+  return statistics.median(samples) * 1000, samples[int(len(samples) * 0.99) - 1] * 1000
+
+def update_rate(names, updates):
+  start = time.perf_counter()
+  for i in range(updates):
+    Product.update_one({ 'name': random.choice(names) }, { 'shopping_cart': i % 2 == 0 })
+  return updates / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark of the facets of the categories')
+  parser.add_argument('--products', type=int, default=200000)
+  parser.add_argument('--categories', type=int, default=50)
+  parser.add_argument('--queries', type=int, default=200)
+  parser.add_argument('--updates', type=int, default=2000)
+  args = parser.parse_args()
+  app = create_app('test')
+  app.logger.disabled = True
+  with app.test_request_context():
+    db.drop_all()
+    db.create_all()
+    dialect = db.engine.dialect.name
+    started = time.perf_counter()
+    db.session.add_all([Category(id=i, tenant_id=TENANT, name='category{}'.format(i), aisle='aisle {}'.format(i % 10))
+                        for i in range(1, args.categories + 1)])
+    db.session.flush()
+    db.session.execute(text(PRODUCTS[dialect]), { 'products': args.products, 'categories': args.categories,
+                                                  'tenant': TENANT })
+    db.session.execute(text(COUNTERS))
+    db.session.commit()
+    print('{} products in {} categories generated in {:.1f}s'.format(args.products, args.categories,
+                                                                    time.perf_counter() - started))
+
+    group_by = text(GROUP_BY)
+    assert [tuple(facet.values()) for facet in Category.find_facets()] == \
+      [tuple(row) for row in db.session.execute(group_by, { 'tenant': TENANT })]
+    counters_median, counters_p99 = latency(Category.find_facets, args.queries)
+    scan_median, scan_p99 = latency(lambda: db.session.execute(group_by, { 'tenant': TENANT }).fetchall(),
+                                    args.queries)
+    print('facets: counters median={:.3f}ms p99={:.3f}ms  GROUP BY median={:.3f}ms p99={:.3f}ms'.format(
+      counters_median, counters_p99, scan_median, scan_p99))
+    median, p99 = latency(lambda: Product.find_all({ 'category_id': random.randint(1, args.categories) }),
+                          args.queries)
+    print('products of a category ({} products): median={:.3f}ms p99={:.3f}ms'.format(
+      args.products // 2 // args.categories, median, p99))
+
+    categorized = ['product{}'.format(i) for i in range(0, args.products, 2)]
+    uncategorized = ['product{}'.format(i) for i in range(1, args.products, 2)]
+    print('cart updates: {:.0f}/s with category counters, {:.0f}/s without category'.format(
+      update_rate(categorized, args.updates), update_rate(uncategorized, args.updates)))
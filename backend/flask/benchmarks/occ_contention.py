@@ -0,0 +1,78 @@
+
+"""
+Contention benchmark of the optimistic concurrency control on product updates.
+
+Several threads update the same products at the same time with read-modify-write cycles: read the product with
+its version, then update it with the version in the If-Match header. Conflicting updates get 412 and are retried.
+The benchmark reports the updates committed per second and the conflicts for each level of contention.
+
+Usage: python -m benchmarks.occ_contention [--threads 8] [--products 1] [--seconds 5]
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+# The benchmark runs on its own database unless TEST_DATABASE_URI is given (ie. a local PostgreSQL server)
+os.environ.setdefault('TEST_DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+from myapp import create_app
+from myapp.database import db
+
+
+def worker(app, names, deadline, counters, lock):
+  client = app.test_client()
+  updates = conflicts = 0
+  i = 0
+  while time.perf_counter() < deadline:
+    name = names[i % len(names)]
+    i += 1
+    # Read-modify-write cycle, retried until the update is not in conflict
+    while True:
+      resp = client.get('/api/v1/products/{}'.format(name))
+      product = resp.get_json()
+      resp = client.put('/api/v1/products/{}'.format(name), json={ 'shopping_cart': not product['shopping_cart'] },
+                        headers={ 'If-Match': resp.headers['ETag'] })
+      if resp.status_code != 412:
+        break
+      conflicts += 1
+    updates += 1
+  with lock:
+    counters['updates'] += updates
+    counters['conflicts'] += conflicts
+
+
+def run(app, threads, products, seconds):
+  names = ['product{}'.format(i) for i in range(products)]
+  with app.app_context():
+    db.drop_all()
+    db.create_all()
+  client = app.test_client()
+  for name in names:
+    client.post('/api/v1/products', json={ 'name': name })
+  counters = { 'updates': 0, 'conflicts': 0 }
+  lock = threading.Lock()
+  deadline = time.perf_counter() + seconds
+  workers = [threading.Thread(target=worker, args=(app, names, deadline, counters, lock)) for _ in range(threads)]
+  for thread in workers:
+    thread.start()
+  for thread in workers:
+    thread.join()
+  print('threads={:<3} products={:<5} updates/s={:>8.1f} conflicts/s={:>8.1f} conflict rate={:.1%}'.format(
+    threads, products, counters['updates'] / seconds, counters['conflicts'] / seconds,
+    counters['conflicts'] / max(counters['updates'] + counters['conflicts'], 1)))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Contention benchmark of optimistic concurrency control')
+  parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+  parser.add_argument('--products', type=int, nargs='+', default=[1, 10, 100])
+  parser.add_argument('--seconds', type=float, default=3)
+  args = parser.parse_args()
+  app = create_app('test')
+  app.logger.disabled = True
+  for products in args.products:
+    for threads in args.threads:
+      run(app, threads, products, args.seconds)
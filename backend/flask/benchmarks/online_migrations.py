@@ -0,0 +1,98 @@
+"""
+Benchmark of the writes blocked by migrations on a large table (PostgreSQL): plain operations in a transaction
+against the online migration helpers.
+
+A writer thread updates random products during each migration and the benchmark reports the duration of the
+migration, the slowest write and the total time the writes spent waiting longer than --blocked milliseconds:
+- CREATE INDEX in a transaction against create_index_concurrently
+- a single UPDATE of every row against a batched backfill
+
+Usage: TEST_DATABASE_URI=postgresql://... python -m benchmarks.online_migrations [--rows 1000000]
+"""
+
+import argparse
+import os
+import random
+import threading
+import time
+from alembic.operations import Operations
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy import create_engine, text
+from myapp.online_migrations import backfill, create_index_concurrently
+
+
+TABLE = """
+  CREATE TABLE bench_products (
+    tenant_id VARCHAR(50) NOT NULL,
+    name VARCHAR(50) NOT NULL,
+    shopping_cart BOOLEAN NOT NULL,
+    category_id INTEGER,
+    PRIMARY KEY (tenant_id, name)
+  )
+"""
+
+FILL = """
+  INSERT INTO bench_products (tenant_id, name, shopping_cart)
+  SELECT 'tenant' || (i % 100), 'product' || i, i % 7 = 0 FROM generate_series(0, :rows - 1) AS i
+"""
+
+
+def online(engine, operation):
+  with engine.connect() as connection:
+    with Operations.context(MigrationContext.configure(connection)):
+      operation()
+
+def plain(engine, statement):
+  with engine.begin() as connection:
+    connection.execute(text(statement))
+
+
+def measure(engine, label, rows, migration, blocked):
+  latencies = []
+  done = threading.Event()
+  def write():
+    with engine.connect() as connection:
+      while not done.is_set():
+        i = random.randrange(rows)
+        start = time.perf_counter()
+        connection.execute(text('UPDATE bench_products SET shopping_cart = NOT shopping_cart '
+                                'WHERE tenant_id = :tenant_id AND name = :name'),
+                           { 'tenant_id': 'tenant{}'.format(i % 100), 'name': 'product{}'.format(i) })
+        latencies.append(time.perf_counter() - start)
+  writer = threading.Thread(target=write)
+  writer.start()
+  time.sleep(0.5)
+  start = time.perf_counter()
+  migration()
+  duration = time.perf_counter() - start
+  done.set()
+  writer.join()
+  print('{:<28} migration={:>8.2f}s slowest write={:>8.3f}s blocked={:>8.3f}s writes={}'.format(
+    label, duration, max(latencies), sum(l for l in latencies if l > blocked), len(latencies)))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Writes blocked by migrations')
+  parser.add_argument('--rows', type=int, default=1000000)
+  parser.add_argument('--batch-size', type=int, default=5000)
+  parser.add_argument('--blocked', type=float, default=50, help='milliseconds above which a write counts as blocked')
+  args = parser.parse_args()
+  engine = create_engine(os.environ['TEST_DATABASE_URI'])
+  with engine.begin() as connection:
+    connection.execute(text('DROP TABLE IF EXISTS bench_products'))
+    connection.execute(text(TABLE))
+    connection.execute(text(FILL), { 'rows': args.rows })
+    connection.execute(text('ANALYZE bench_products'))
+  blocked = args.blocked / 1000
+  measure(engine, 'CREATE INDEX', args.rows,
+          lambda: plain(engine, 'CREATE INDEX ix_bench_plain ON bench_products (shopping_cart)'), blocked)
+  measure(engine, 'create_index_concurrently', args.rows,
+          lambda: online(engine, lambda: create_index_concurrently('ix_bench_online', 'bench_products',
+                                                                   ['tenant_id', 'shopping_cart'])), blocked)
+  measure(engine, 'UPDATE', args.rows,
+          lambda: plain(engine, 'UPDATE bench_products SET category_id = 1'), blocked)
+  measure(engine, 'backfill', args.rows,
+          lambda: online(engine, lambda: backfill('bench_products', { 'category_id': 2 },
+                                                  batch_size=args.batch_size, pause=0)), blocked)
+  with engine.begin() as connection:
+    connection.execute(text('DROP TABLE bench_products'))
@@ -0,0 +1,103 @@
+
+"""
+Benchmark of the products table hash partitioned by tenant against the same table without partitions (PostgreSQL).
+
+Both tables are filled server side with generate_series, then the benchmark reports the size of their indexes (the
+whole index and the largest single B-tree) and the latency of the queries of the Product DAO for random tenants:
+find_one (tenant + name) and find_all of the shopping cart (tenant + shopping_cart).
+
+Usage: TEST_DATABASE_URI=postgresql://... python -m benchmarks.partitioning [--rows 100000000] [--tenants 10000]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import time
+from sqlalchemy import create_engine, text
+
+
+TABLE = """
+  CREATE TABLE {name} (
+    tenant_id VARCHAR(50) NOT NULL,
+    name VARCHAR(50) NOT NULL,
+    shopping_cart BOOLEAN NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (tenant_id, name)
+  ) {partitioning}
+"""
+
+FILL = """
+  INSERT INTO {name} (tenant_id, name, shopping_cart)
+  SELECT 'tenant' || (i % :tenants), 'product' || (i / :tenants), i % 7 = 0
+  FROM generate_series(0, :rows - 1) AS i
+"""
+
+QUERIES = {
+  'find_one': 'SELECT * FROM {name} WHERE tenant_id = :tenant AND name = :product',
+  'find_all_cart': 'SELECT * FROM {name} WHERE tenant_id = :tenant AND shopping_cart',
+}
+
+
+def create(conn, name, partitions):
+  conn.execute(text('DROP TABLE IF EXISTS {} CASCADE'.format(name)))
+  if partitions:
+    conn.execute(text(TABLE.format(name=name, partitioning='PARTITION BY HASH (tenant_id)')))
+    for remainder in range(partitions):
+      conn.execute(text('CREATE TABLE {0}_p{1} PARTITION OF {0} FOR VALUES WITH (MODULUS {2}, REMAINDER {1})'
+                        .format(name, remainder, partitions)))
+  else:
+    conn.execute(text(TABLE.format(name=name, partitioning='')))
+
+
+def index_sizes(conn, name):
+  ''' Return the total size of the indexes of the table and the size of its largest index (bytes) '''
+  sizes = conn.execute(text("""
+    SELECT pg_relation_size(i.indexrelid) FROM pg_index i
+    WHERE i.indrelid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = CAST(:name AS regclass))
+       OR i.indrelid = CAST(:name AS regclass)
+  """), { 'name': name }).fetchall()
+  sizes = [row[0] for row in sizes]
+  return sum(sizes), max(sizes)
+
+
+def latency(conn, name, query, tenants, products, samples):
+  ''' Return the median and 99th percentile latency of the query (milliseconds) '''
+  timings = []
+  statement = text(QUERIES[query].format(name=name))
+  for _ in range(samples):
+    params = { 'tenant': 'tenant{}'.format(random.randrange(tenants)),
+               'product': 'product{}'.format(random.randrange(products)) }
+    start = time.perf_counter()
+    conn.execute(statement, params).fetchall()
+    timings.append((time.perf_counter() - start) * 1000)
+  timings.sort()
+  return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Partitioned products table benchmark (PostgreSQL)')
+  parser.add_argument('--rows', type=int, default=1000000)
+  parser.add_argument('--tenants', type=int, default=1000)
+  parser.add_argument('--partitions', type=int, default=16)
+  parser.add_argument('--samples', type=int, default=2000)
+  args = parser.parse_args()
+  engine = create_engine(os.environ['TEST_DATABASE_URI'])
+  tables = { 'products_bench_flat': 0, 'products_bench_partitioned': args.partitions }
+  with engine.begin() as conn:
+    for name, partitions in tables.items():
+      start = time.perf_counter()
+      create(conn, name, partitions)
+      conn.execute(text(FILL.format(name=name)), { 'rows': args.rows, 'tenants': args.tenants })
+      conn.execute(text('ANALYZE {}'.format(name)))
+      print('{:<28} filled {} rows in {:.1f}s'.format(name, args.rows, time.perf_counter() - start))
+  with engine.connect() as conn:
+    for name in tables:
+      total, largest = index_sizes(conn, name)
+      print('{:<28} index size total={:.1f}MB largest B-tree={:.1f}MB'.format(name, total / 2**20, largest / 2**20))
+      for query in QUERIES:
+        median, p99 = latency(conn, name, query, args.tenants, args.rows // args.tenants, args.samples)
+        print('{:<28} {:<14} median={:.3f}ms p99={:.3f}ms'.format(name, query, median, p99))
+  with engine.begin() as conn:
+    for name in tables:
+      conn.execute(text('DROP TABLE {} CASCADE'.format(name)))
@@ -0,0 +1,119 @@
+"""
+Benchmark of the purchase statistics: rollups against scanning the raw purchase events.
+
+The purchase events (10M by default, spread over two years and --products products) are generated server side and
+the daily and weekly rollups are built from them. The benchmark reports the latency of the statistics of a product
+for the last 4 weeks and 30 days, read from the rollups (purchase_stats) and computed from the raw events, and the
+number of purchases recorded per second (event + rollups).
+
+Usage: python -m benchmarks.purchase_stats [--events 10000000] [--products 1000] [--queries 200]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+# The benchmark runs on its own database unless TEST_DATABASE_URI is given (ie. a local PostgreSQL server)
+os.environ.setdefault('TEST_DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+from sqlalchemy import text
+from myapp import create_app
+from myapp.database import db
+from myapp.blueprints.product.purchases import bucket_start, purchase_stats, record_purchase
+
+TODAY = date(2026, 10, 14)
+DAYS = 730
+TENANT = 'default'
+
+EVENTS = {
+  'sqlite': """
+    WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i < :events - 1)
+    INSERT INTO purchase_events (tenant_id, name, purchased_at)
+    SELECT :tenant, 'product' || (abs(random()) % :products),
+           datetime(:start, '+' || (i * :seconds / :events) || ' seconds')
+    FROM seq
+  """,
+  'postgresql': """
+    INSERT INTO purchase_events (tenant_id, name, purchased_at)
+    SELECT :tenant, 'product' || floor(random() * :products)::int,
+           CAST(:start AS timestamp) + make_interval(secs => i::float * :seconds / :events)
+    FROM generate_series(0, :events - 1) AS i
+  """
+}
+
+BUCKETS = {
+  'sqlite': {
+    'purchases_daily': "date(purchased_at)",
+    # Monday of the week (%w is 0 on Sunday)
+    'purchases_weekly': "date(purchased_at, '-' || ((CAST(strftime('%w', purchased_at) AS INTEGER) + 6) % 7) "
+                        "|| ' days')"
+  },
+  'postgresql': {
+    'purchases_daily': "CAST(date_trunc('day', purchased_at) AS date)",
+    'purchases_weekly': "CAST(date_trunc('week', purchased_at) AS date)"
+  }
+}
+
+ROLLUP = """
+  INSERT INTO {table} (tenant_id, name, bucket, purchases)
+  SELECT tenant_id, name, {bucket}, count(*) FROM purchase_events GROUP BY tenant_id, name, {bucket}
+"""
+
+SCAN = """
+  SELECT {bucket} AS bucket, count(*) FROM purchase_events
+  WHERE tenant_id = :tenant AND name = :name AND purchased_at >= :start GROUP BY {bucket}
+"""
+
+
+def latency(fn, queries, products):
+  samples = []
+  for _ in range(queries):
+    name = 'product{}'.format(random.randrange(products))
+    start = time.perf_counter()
+    fn(name)
+    samples.append(time.perf_counter() - start)
+  samples.sort()
+  return statistics.mean(samples) * 1000, samples[int(len(samples) * 0.99) - 1] * 1000
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark of the purchase statistics')
+  parser.add_argument('--events', type=int, default=10000000)
+  parser.add_argument('--products', type=int, default=1000)
+  parser.add_argument('--queries', type=int, default=200)
+  args = parser.parse_args()
+  app = create_app('test')
+  app.logger.disabled = True
+  with app.test_request_context():
+    db.drop_all()
+    db.create_all()
+    dialect = db.engine.dialect.name
+    start = datetime(TODAY.year, TODAY.month, TODAY.day) - timedelta(days=DAYS)
+    started = time.perf_counter()
+    db.session.execute(text(EVENTS[dialect]), { 'events': args.events, 'products': args.products, 'tenant': TENANT,
+                                                'start': start.isoformat(' '), 'seconds': DAYS * 86400 })
+    for table, bucket in BUCKETS[dialect].items():
+      db.session.execute(text(ROLLUP.format(table=table, bucket=bucket)))
+    db.session.commit()
+    print('{} events generated and rolled up in {:.1f}s'.format(args.events, time.perf_counter() - started))
+
+    for period, buckets, table in (('week', 4, 'purchases_weekly'), ('day', 30, 'purchases_daily')):
+      first = bucket_start(period, TODAY) - timedelta(days=(1 if period == 'day' else 7) * (buckets - 1))
+      scan = text(SCAN.format(bucket=BUCKETS[dialect][table]))
+      rollup_mean, rollup_p99 = latency(lambda name: purchase_stats(name, period, buckets, today=TODAY),
+                                        args.queries, args.products)
+      scan_mean, scan_p99 = latency(lambda name: db.session.execute(scan, {
+        'tenant': TENANT, 'name': name, 'start': datetime(first.year, first.month, first.day) }).fetchall(),
+        args.queries, args.products)
+      print('{:<5} x{:<3} rollups mean={:>8.3f}ms p99={:>8.3f}ms  raw events mean={:>9.3f}ms p99={:>9.3f}ms'.format(
+        period, buckets, rollup_mean, rollup_p99, scan_mean, scan_p99))
+
+    count = 1000
+    started = time.perf_counter()
+    for i in range(count):
+      record_purchase('product{}'.format(random.randrange(args.products)))
+    print('record_purchase: {:.0f} purchases/s'.format(count / (time.perf_counter() - started)))
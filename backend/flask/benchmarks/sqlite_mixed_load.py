@@ -0,0 +1,76 @@
+"""
+Mixed load benchmark of SQLite: default settings against the production profile (SQLiteConfig: WAL, mmap, page
+cache, busy timeout and serialized writers).
+
+Reader threads get products by name while writer threads update them, for a fixed time. The benchmark reports the
+reads and writes per second, and the requests that failed (ie. "database is locked").
+
+Usage: python -m benchmarks.sqlite_mixed_load [--readers 8] [--writers 2] [--products 1000] [--seconds 5]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+# Each profile runs on its own database file
+bench_dir = tempfile.mkdtemp()
+os.environ['TEST_DATABASE_URI'] = 'sqlite:///' + os.path.join(bench_dir, 'default.db')
+os.environ['SQLITE_DATABASE_URI'] = 'sqlite:///' + os.path.join(bench_dir, 'tuned.db')
+os.environ['CART_SNAPSHOT_ENABLED'] = 'false'
+
+from myapp import create_app
+from myapp.database import db
+
+
+def reader(app, names, deadline, counters):
+  client = app.test_client()
+  while time.perf_counter() < deadline:
+    resp = client.get('/api/v1/products/{}'.format(random.choice(names)))
+    counters['reads' if resp.status_code == 200 else 'errors'] += 1
+
+def writer(app, names, deadline, counters):
+  client = app.test_client()
+  while time.perf_counter() < deadline:
+    resp = client.put('/api/v1/products/{}'.format(random.choice(names)),
+                      json={ 'shopping_cart': random.random() < 0.5 })
+    counters['writes' if resp.status_code == 200 else 'errors'] += 1
+
+
+def run(env, readers, writers, products, seconds):
+  app = create_app(env)
+  app.logger.disabled = True
+  with app.app_context():
+    db.drop_all()
+    db.create_all()
+  client = app.test_client()
+  names = ['product{}'.format(i) for i in range(products)]
+  for name in names:
+    client.post('/api/v1/products', json={ 'name': name })
+  # One counter dict per thread, summed at the end
+  counters = [{ 'reads': 0, 'writes': 0, 'errors': 0 } for _ in range(readers + writers)]
+  deadline = time.perf_counter() + seconds
+  threads = [threading.Thread(target=reader, args=(app, names, deadline, counters[i])) for i in range(readers)]
+  threads += [threading.Thread(target=writer, args=(app, names, deadline, counters[readers + i]))
+              for i in range(writers)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  total = { key: sum(c[key] for c in counters) for key in ('reads', 'writes', 'errors') }
+  print('{:<7} readers={:<3} writers={:<3} reads/s={:>8.1f} writes/s={:>8.1f} errors={}'.format(
+    env, readers, writers, total['reads'] / seconds, total['writes'] / seconds, total['errors']))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Mixed load benchmark of SQLite')
+  parser.add_argument('--readers', type=int, default=8)
+  parser.add_argument('--writers', type=int, nargs='+', default=[1, 2, 4])
+  parser.add_argument('--products', type=int, default=1000)
+  parser.add_argument('--seconds', type=float, default=3)
+  args = parser.parse_args()
+  for writers in args.writers:
+    for env in ('test', 'sqlite'):
+      run(env, args.readers, writers, args.products, args.seconds)
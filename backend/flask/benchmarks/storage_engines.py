@@ -0,0 +1,61 @@
+
+"""
+Benchmark of the storage engines behind the DAO of the products.
+
+Every engine runs the same mix of operations through the API (create, read by name, list the shopping cart, update
+and delete) and the benchmark reports the operations per second for each engine. The memory engine is measured with
+its log on disk, with and without fsync.
+
+Usage: python -m benchmarks.storage_engines [--products 1000] [--reads 10]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+# The benchmark runs on its own database unless TEST_DATABASE_URI is given (ie. a local PostgreSQL server)
+os.environ.setdefault('TEST_DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+from myapp import create_app
+from myapp.database import db
+
+
+def timed(label, operations, fn):
+  start = time.perf_counter()
+  fn()
+  elapsed = time.perf_counter() - start
+  print('  {:<8} {:>8} ops {:>10.1f} ops/s'.format(label, operations, operations / elapsed))
+
+
+def run(engine, products, reads, **config):
+  app = create_app('test')
+  app.logger.disabled = True
+  app.config['STORAGE_ENGINE'] = engine
+  app.config.update(config)
+  with app.app_context():
+    db.drop_all()
+    db.create_all()
+  client = app.test_client()
+  names = ['product{}'.format(i) for i in range(products)]
+  print('{} {}'.format(engine, ' '.join('{}={}'.format(k, v) for k, v in config.items())))
+  timed('create', products, lambda: [client.post('/api/v1/products', json={ 'name': name }) for name in names])
+  timed('read', products * reads,
+        lambda: [client.get('/api/v1/products/{}'.format(name)) for _ in range(reads) for name in names])
+  timed('update', products,
+        lambda: [client.put('/api/v1/products/{}'.format(name), json={ 'shopping_cart': True }) for name in names])
+  timed('cart', reads, lambda: [client.get('/api/v1/products?shop=true') for _ in range(reads)])
+  timed('delete', products, lambda: [client.delete('/api/v1/products/{}'.format(name)) for name in names])
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark of the storage engines')
+  parser.add_argument('--products', type=int, default=1000)
+  parser.add_argument('--reads', type=int, default=10)
+  args = parser.parse_args()
+  log_dir = tempfile.mkdtemp()
+  run('sql', args.products, args.reads)
+  run('memory', args.products, args.reads)
+  run('memory', args.products, args.reads, MEMORY_ENGINE_LOG_PATH=os.path.join(log_dir, 'log'))
+  run('memory', args.products, args.reads, MEMORY_ENGINE_LOG_PATH=os.path.join(log_dir, 'fsync.log'),
+      MEMORY_ENGINE_FSYNC=True)
@@ -0,0 +1,74 @@
+"""
+Benchmark of the suggestions of products frequently bought together.
+
+The purchases (--trips shopping trips of 2 to 20 products, among --products products with a skewed popularity) are
+generated in memory and the co-occurrence matrix is built from them. The benchmark reports the build time and the
+memory of the matrix, the latency of the suggestions for carts of 1, 5 and 20 products, and the number of purchases
+counted incrementally per second.
+
+Usage: python -m benchmarks.suggestions [--products 100000] [--trips 200000] [--max-pairs 2000000] [--queries 1000]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+import numpy as np
+
+# The app is imported with the models, it needs a database unless TEST_DATABASE_URI is given
+os.environ.setdefault('TEST_DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+from myapp.blueprints.product.suggestions import CoOccurrence
+
+TODAY = date(2026, 10, 14)
+
+
+def generate(products, trips):
+  ''' Return the purchases of the trips, the popular products are bought more often (Zipf like) '''
+  rng = np.random.default_rng(42)
+  sizes = rng.integers(2, 21, trips)
+  bought = np.minimum(rng.zipf(1.3, sizes.sum()) - 1, products - 1)
+  days = np.repeat(np.arange(trips), sizes)
+  return [('product{}'.format(product), TODAY - timedelta(days=int(day))) for product, day in zip(bought, days)]
+
+def latency(fn, queries):
+  samples = []
+  for _ in range(queries):
+    start = time.perf_counter()
+    fn()
+    samples.append(time.perf_counter() - start)
+  samples.sort()
+  return statistics.median(samples) * 1000, samples[int(len(samples) * 0.99) - 1] * 1000
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark of the suggestions of products frequently bought together')
+  parser.add_argument('--products', type=int, default=100000)
+  parser.add_argument('--trips', type=int, default=200000)
+  parser.add_argument('--max-pairs', type=int, default=2000000)
+  parser.add_argument('--queries', type=int, default=1000)
+  args = parser.parse_args()
+  purchases = generate(args.products, args.trips)
+  model = CoOccurrence(args.products, args.max_pairs)
+  started = time.perf_counter()
+  model.build(purchases)
+  print('{} purchases of {} products: built in {:.2f}s, {} pairs, {:.1f} MB'.format(
+    len(purchases), len(model.names), time.perf_counter() - started, model.matrix.nnz, model.memory() / 2 ** 20))
+
+  for size in (1, 5, 20):
+    median, p99 = latency(lambda: model.suggest(random.sample(model.names, size), 10), args.queries)
+    print('cart of {:>2} products: median={:>7.3f}ms p99={:>7.3f}ms'.format(size, median, p99))
+
+  count = 100000
+  day = TODAY + timedelta(days=1)
+  started = time.perf_counter()
+  for i in range(count):
+    if i % 10 == 0:
+      day += timedelta(days=1)
+    model.add_purchase(random.choice(model.names), day)
+  model.merge()
+  print('add_purchase: {:.0f} purchases/s, {} pairs, {:.1f} MB'.format(
+    count / (time.perf_counter() - started), model.matrix.nnz, model.memory() / 2 ** 20))
@@ -0,0 +1,59 @@
+
+"""
+Microbenchmark of the per-request validation cost: reqparse parsers against the validators compiled from the API
+description, for the three validated operations (list, create and update products).
+
+Usage: python -m benchmarks.validation [--iterations 20000]
+"""
+
+import argparse
+import os
+import timeit
+
+os.environ.setdefault('TEST_DATABASE_URI', 'sqlite://')
+
+from flask import request
+from flask_restful import reqparse, inputs
+from myapp import create_app
+from myapp.blueprints.product.resources import (
+  product_list_validator,
+  create_product_validator,
+  update_product_validator
+)
+
+
+# The parsers the service used before the compiled validators
+product_list_parser = reqparse.RequestParser()
+product_list_parser.add_argument('shop', type=inputs.boolean, help='This value must be boolean',
+                                 location='args', default=False)
+create_product_parser = reqparse.RequestParser(bundle_errors=True)
+create_product_parser.add_argument('name', required=True, help="Field 'name' is required")
+create_product_parser.add_argument('shopping_cart', type=inputs.boolean, help='This value must be boolean',
+                                   default=False)
+update_product_parser = reqparse.RequestParser(bundle_errors=True)
+update_product_parser.add_argument('shopping_cart', type=inputs.boolean, help='This value must be boolean',
+                                   store_missing=False)
+
+CASES = [
+  ('list', { 'path': '/api/v1/products', 'query_string': { 'shop': 'true' } },
+   product_list_parser, product_list_validator),
+  ('create', { 'path': '/api/v1/products', 'method': 'POST', 'json': { 'name': 'bread', 'shopping_cart': True } },
+   create_product_parser, create_product_validator),
+  ('update', { 'path': '/api/v1/products/bread', 'method': 'PUT', 'json': { 'shopping_cart': False } },
+   update_product_parser, update_product_validator),
+]
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Request validation microbenchmark')
+  parser.add_argument('--iterations', type=int, default=20000)
+  args = parser.parse_args()
+  app = create_app('test')
+  for name, environ, reqparser, validator in CASES:
+    with app.test_request_context(**environ):
+      # Both must agree on the arguments of the request
+      assert dict(reqparser.parse_args()) == validator(request)
+      reqparse_time = timeit.timeit(reqparser.parse_args, number=args.iterations) / args.iterations
+      compiled_time = timeit.timeit(lambda: validator(request), number=args.iterations) / args.iterations
+    print('{:<8} reqparse={:>7.2f}us compiled={:>7.2f}us speedup={:.1f}x'.format(
+      name, reqparse_time * 1e6, compiled_time * 1e6, reqparse_time / compiled_time))
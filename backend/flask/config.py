@@ -1,4 +1,6 @@
 import os
+import tempfile
+from sqlalchemy.pool import QueuePool
 # environs is a Python library for parsing environment variables. It allows you to store configuration
 # separate from your code. Read .env files into os.environ (useful for local development)
 from environs import Env
@@ -11,6 +13,14 @@ env.read_env()
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+# API description (Swagger) of the service, shared by the backends at the root of the repository. The request
+# validators are compiled from it when the app is imported: the app loads the copy packaged in myapp when there is one
+# (copied by start.sh, so the app also starts where it's deployed without the repository), the shared file otherwise
+PACKAGED_API_DESCRIPTION_PATH = os.path.join(basedir, 'myapp', 'api_description.yml')
+API_DESCRIPTION_PATH = env.str('API_DESCRIPTION_PATH', PACKAGED_API_DESCRIPTION_PATH
+                               if os.path.exists(PACKAGED_API_DESCRIPTION_PATH)
+                               else os.path.join(basedir, '..', '..', 'api_description.yml'))
+
 
 class Config:
   # API service setting
@@ -31,6 +41,105 @@ class Config:
   # and selectively call protect() only when you need
   # WTF_CSRF_CHECK_DEFAULT = False
 
+  # Storage engine behind the DAO of the models: 'sql' (Flask-SQLAlchemy) or 'memory' (single node deployments).
+  # The memory engine persists its records in an append-only log (MEMORY_ENGINE_LOG_PATH, in memory only if not
+  # set) compacted into a snapshot every MEMORY_ENGINE_SNAPSHOT_EVERY operations
+  STORAGE_ENGINE = env.str('STORAGE_ENGINE', 'sql')
+  MEMORY_ENGINE_LOG_PATH = env.str('MEMORY_ENGINE_LOG_PATH', None)
+  MEMORY_ENGINE_SNAPSHOT_EVERY = env.int('MEMORY_ENGINE_SNAPSHOT_EVERY', 10000)
+  MEMORY_ENGINE_FSYNC = env.bool('MEMORY_ENGINE_FSYNC', False)
+
+  # Online migrations (migrations/env.py, myapp/online_migrations.py)
+  # One transaction per migration, required by the migrations running statements outside of a transaction
+  # (CREATE INDEX CONCURRENTLY, batched backfills). DDL statements give up on a lock after MIGRATIONS_LOCK_TIMEOUT
+  # milliseconds (PostgreSQL), the helpers retry them MIGRATIONS_LOCK_ATTEMPTS times with an exponential backoff.
+  # Backfills update MIGRATIONS_BACKFILL_BATCH_SIZE rows per transaction and sleep MIGRATIONS_BACKFILL_PAUSE
+  # seconds between two batches. The statements run while the writes of a table are blocked (ie. the swap of a
+  # table rebuilt online) are cancelled after MIGRATIONS_SWAP_TIMEOUT milliseconds
+  MIGRATIONS_TRANSACTION_PER_MIGRATION = env.bool('MIGRATIONS_TRANSACTION_PER_MIGRATION', True)
+  MIGRATIONS_LOCK_TIMEOUT = env.int('MIGRATIONS_LOCK_TIMEOUT', 2000)
+  MIGRATIONS_LOCK_ATTEMPTS = env.int('MIGRATIONS_LOCK_ATTEMPTS', 5)
+  MIGRATIONS_LOCK_BACKOFF = 1
+  MIGRATIONS_BACKFILL_BATCH_SIZE = env.int('MIGRATIONS_BACKFILL_BATCH_SIZE', 1000)
+  MIGRATIONS_BACKFILL_PAUSE = env.float('MIGRATIONS_BACKFILL_PAUSE', 0.1)
+  MIGRATIONS_SWAP_TIMEOUT = env.int('MIGRATIONS_SWAP_TIMEOUT', 5000)
+
+  # Multi-tenancy
+  # The tenant of a request is given in the TENANT_HEADER header. The products of each tenant are stored in the
+  # same table, which is hash partitioned by tenant in PostgreSQL (TENANT_PARTITIONS partitions)
+  # The header is accepted on the requests authenticated with a token of its tenant (AUTH_ENABLED), or on any
+  # request when TENANT_HEADER_TRUSTED is set: only set it behind a proxy that authenticates the clients and sets
+  # the header itself (see myapp/tenancy.py)
+  TENANT_HEADER = 'X-Tenant'
+  TENANT_HEADER_TRUSTED = env.bool('TENANT_HEADER_TRUSTED', False)
+  DEFAULT_TENANT = 'default'
+  TENANT_PARTITIONS = env.int('TENANT_PARTITIONS', 16)
+
+  # Purchase history: the purchase events older than PURCHASE_EVENTS_RETENTION_DAYS are deleted by
+  # "flask compact-purchases", their purchases remain counted in the daily and weekly rollups
+  PURCHASE_EVENTS_RETENTION_DAYS = env.int('PURCHASE_EVENTS_RETENTION_DAYS', 365)
+
+  # Suggestions of products frequently bought together, from the purchases of the last SUGGESTIONS_HISTORY_DAYS
+  # days. The co-occurrence matrix of a tenant is rebuilt every SUGGESTIONS_REFRESH seconds, and each worker keeps
+  # at most SUGGESTIONS_MAX_TENANTS matrices of SUGGESTIONS_MAX_PRODUCTS products and SUGGESTIONS_MAX_PAIRS
+  # non-zero counts (8 bytes each). The products of a tenant beyond SUGGESTIONS_MAX_PRODUCTS (the least bought) are
+  # not suggested
+  SUGGESTIONS_HISTORY_DAYS = env.int('SUGGESTIONS_HISTORY_DAYS', 90)
+  SUGGESTIONS_REFRESH = env.int('SUGGESTIONS_REFRESH', 600)
+  SUGGESTIONS_MAX_PRODUCTS = env.int('SUGGESTIONS_MAX_PRODUCTS', 100000)
+  SUGGESTIONS_MAX_PAIRS = env.int('SUGGESTIONS_MAX_PAIRS', 2000000)
+  SUGGESTIONS_MAX_TENANTS = env.int('SUGGESTIONS_MAX_TENANTS', 16)
+
+  # Maximum number of products retrieved by name in one request (multi-get)
+  MULTI_GET_MAX_NAMES = 1000
+
+  # Single flight
+  # Identical reads running at the same time within a worker (ie. threads of a threaded server) share one DB
+  # query and one encoded response. Followers wait up to SINGLE_FLIGHT_TIMEOUT seconds for the leading request
+  # before running the query by themselves (None waits forever)
+  SINGLE_FLIGHT_ENABLED = env.bool('SINGLE_FLIGHT_ENABLED', True)
+  SINGLE_FLIGHT_TIMEOUT = 5
+
+  # Profiling
+  # When enabled, 1 in PROFILING_SAMPLE_RATE requests (0 = none) and the requests with a signed token in the
+  # PROFILING_HEADER header are profiled by sampling their call stack every PROFILING_INTERVAL seconds. The
+  # collapsed stacks are served on <URL_PREFIX_API>admin/profile (same token required). Tokens are generated with
+  # "flask profiling-token" and signed with PROFILING_SECRET_KEY (required when the profiler is enabled)
+  PROFILING_ENABLED = env.bool('PROFILING_ENABLED', False)
+  PROFILING_SAMPLE_RATE = env.int('PROFILING_SAMPLE_RATE', 0)
+  PROFILING_INTERVAL = env.float('PROFILING_INTERVAL', 0.001)
+  PROFILING_MAX_STACKS = 10000
+  PROFILING_HEADER = 'X-Profile'
+  PROFILING_SECRET_KEY = env.str('PROFILING_SECRET_KEY', None)
+  PROFILING_TOKEN_MAX_AGE = 24 * 3600
+
+  # Bearer token authentication of the API (myapp/auth.py). The tokens are issued with "flask auth-token", signed
+  # with AUTH_SECRET_KEY (required, shared by all the workers) and valid for AUTH_TOKEN_MAX_AGE seconds. Each
+  # worker caches up to AUTH_CACHE_SIZE verified tokens and reloads the revoked tokens every AUTH_REVOCATION_REFRESH
+  # seconds
+  AUTH_ENABLED = env.bool('AUTH_ENABLED', False)
+  AUTH_SECRET_KEY = env.str('AUTH_SECRET_KEY', None)
+  AUTH_TOKEN_MAX_AGE = env.int('AUTH_TOKEN_MAX_AGE', 30 * 24 * 3600)
+  AUTH_CACHE_SIZE = env.int('AUTH_CACHE_SIZE', 10000)
+  AUTH_REVOCATION_REFRESH = env.int('AUTH_REVOCATION_REFRESH', 30)
+
+  # Number of connections opened by each worker during its warmup, before it accepts traffic
+  WARMUP_CONNECTIONS = env.int('WARMUP_CONNECTIONS', 1)
+  # Outside of gunicorn (ie. flask run) nothing warms the worker up before it serves, it's warmed up by its first
+  # request instead
+  WARMUP_ON_FIRST_REQUEST = env.bool('WARMUP_ON_FIRST_REQUEST', True)
+
+  # Shopping cart snapshot
+  # Pre-encoded JSON body and HTML table of the shopping cart, kept in a memory-mapped file shared by all the
+  # workers of the host. By default the file is placed in shared memory (/dev/shm) when it's available.
+  # Disabled by default: the snapshot only follows the writes of the app on the host, the writes of the other hosts
+  # and services (ie. the nodejs backend) are seen once it's older than CART_SNAPSHOT_TTL seconds, and the workers
+  # must share its epoch (gunicorn preload_app, one master at a time).
+  CART_SNAPSHOT_ENABLED = env.bool('CART_SNAPSHOT_ENABLED', False)
+  CART_SNAPSHOT_TTL = env.float('CART_SNAPSHOT_TTL', 30)
+  CART_SNAPSHOT_PATH = env.str('CART_SNAPSHOT_PATH', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'groceries-cart.snapshot'))
+
 class DevConfig(Config):
   #Database settings with FLASK SQLALCHEMY 
   #By using the exact naming conventions for the variables above, simply having them in our config file will
@@ -39,16 +148,42 @@ class DevConfig(Config):
   SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'myapp.db')
   #SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
  
+class SQLiteConfig(Config):
+  # Production profile for small sites running on a SQLite database (APP_CONFIG_ENV=sqlite)
+  SQLALCHEMY_DATABASE_URI = env.str('SQLITE_DATABASE_URI', 'sqlite:///' + os.path.join(basedir, 'myapp.db'))
+  # The connections are pooled (Flask-SQLAlchemy opens a new connection per session for SQLite files by default),
+  # so their page cache and memory map survive between requests. They are shared by the threads of a worker.
+  SQLALCHEMY_ENGINE_OPTIONS = {
+    'poolclass': QueuePool,
+    'pool_size': env.int('SQLITE_POOL_SIZE', 8),
+    'max_overflow': 8,
+    'connect_args': { 'check_same_thread': False }
+  }
+  # Applied to every new connection, see myapp/sqlite.py
+  SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': env.int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+    # Negative values are in KiB: 64 MB per connection
+    'cache_size': -64 * 1024,
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY'
+  }
+  # Commits of all the threads and workers are queued on a lock file, there is a single writer at a time
+  SQLITE_SERIALIZE_WRITES = True
+
 class TestConfig(Config):
   SQLALCHEMY_DATABASE_URI = env.str('TEST_DATABASE_URI')
   # TESTING = True
 
 class ProdConfig(Config):
-  pass
+  # Required, the app doesn't start without a database (see create_app)
+  SQLALCHEMY_DATABASE_URI = env.str('DATABASE_URI', None)
 
 configs = {
   'dev'  : DevConfig,
   'test' : TestConfig,
   'prod' : ProdConfig,
+  'sqlite' : SQLiteConfig,
   'default' : ProdConfig
   }    
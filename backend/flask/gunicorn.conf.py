@@ -0,0 +1,49 @@
+"""Gunicorn configuration of the production server: gunicorn -c gunicorn.conf.py wsgi:app"""
+
+import multiprocessing
+from environs import Env
+
+
+env = Env()
+env.read_env()
+
+bind = env.str('GUNICORN_BIND', '0.0.0.0:8081')
+
+# Workers and threads
+# Each worker is a process with its own interpreter, the threads of a worker share its memory (caches, connection
+# pool, single flight). Gunicorn doesn't scale the workers by itself, the number of workers can be changed at
+# runtime with signals to the master: TTIN adds a worker, TTOU removes one.
+workers = env.int('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1)
+threads = env.int('GUNICORN_THREADS', 4)
+worker_class = 'gthread' if threads > 1 else 'sync'
+# The memory storage engine keeps the records in the memory of a single process (see myapp/storage.py), it scales
+# with the threads of one worker
+if env.str('STORAGE_ENGINE', 'sql') == 'memory' and workers > 1:
+  raise RuntimeError('STORAGE_ENGINE=memory runs in a single worker, set WEB_CONCURRENCY=1')
+timeout = env.int('GUNICORN_TIMEOUT', 30)
+# Seconds given to the workers to finish their requests on reload or shutdown
+graceful_timeout = env.int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = 5
+# Workers are replaced after a number of requests (jittered so they don't restart together), 0 disables it
+max_requests = env.int('GUNICORN_MAX_REQUESTS', 0)
+max_requests_jitter = max_requests // 10
+
+# Preload
+# The app is imported and created in the master before the workers are forked, so the modules, the compiled
+# request validators and the compiled templates are shared by the workers copy-on-write, and a broken app fails
+# before any worker starts.
+# Graceful reload: HUP starts new workers with the new configuration and stops the old ones once their requests are
+# finished. The code of a preloaded app is not reloaded by HUP: to deploy a new version send USR2 (a new master is
+# started next to the old one), then WINCH and QUIT to the old master once the new workers are ready.
+preload_app = True
+
+
+def when_ready(server):
+  ''' Master: warm up what the workers share, before forking them '''
+  from myapp.extensions import warmup
+  warmup.prepare(server.app.wsgi())
+
+def post_worker_init(worker):
+  ''' Worker: warm up the connections and the caches before accepting connections '''
+  from myapp.extensions import warmup
+  warmup.run(worker.wsgi)
@@ -15,9 +15,16 @@
 from flask import Flask
 from config import configs  
 from myapp.blueprints import product
+from myapp.tenancy import validate_tenant
 from myapp.extensions import (
   db,
-  migrate
+  migrate,
+  sqlite_tuning,
+  single_flight,
+  profiler,
+  storage,
+  warmup,
+  auth
 )
 
 
@@ -38,6 +45,10 @@ def create_app(env):
   # to load the actual configuration but rather configuration defaults. The actual config should be loaded with
   # from_pyfile() and which is located outside myapp package because this package might be installed system wide 
   app.config.from_object(configs[env])
+  # Without a database URI Flask-SQLAlchemy falls back to an in-memory SQLite database, a separate empty database
+  # in each worker: the app refuses to start instead
+  if not app.config.get('SQLALCHEMY_DATABASE_URI'):
+    raise RuntimeError('No database configured for the {} environment (DATABASE_URI)'.format(env))
   
   # overrides the default configuration with values taken from the config.py file in the instance folder if
   # it exists. It contains configuration variables that contain sensitive information. The idea is to separate
@@ -59,6 +70,8 @@ def create_app(env):
 
   register_extensions(app)
   register_blueprints(app)
+  register_request_hooks(app)
+  register_commands(app)
   return app
 
 # Configuration:
@@ -101,6 +114,25 @@ def register_extensions(app):
   # Then each time the database models change repeat the migrate and upgrade commands.
   migrate.init_app(app, db)  
 
+  # SQLite databases: pragmas applied to every connection and writers serialized (see SQLiteConfig)
+  sqlite_tuning.init_app(app)
+
+  # The DAO of the models delegates to a storage engine, selected with STORAGE_ENGINE ('sql' or 'memory')
+  storage.init_app(app)
+
+  # Identical requests running at the same time in a worker share one DB query and one encoded response body
+  single_flight.init_app(app)
+
+  # Opt-in sampling profiler, it registers its request hooks and its admin endpoint only when it's enabled
+  profiler.init_app(app)
+
+  # Health endpoints, the workers are ready once the production server has warmed them up (see gunicorn.conf.py),
+  # or once their first request has warmed them up with other servers
+  warmup.init_app(app)
+
+  # Signed bearer tokens verified without database lookup, required by the API blueprint when AUTH_ENABLED is set
+  auth.init_app(app)
+
   return None
 
 def register_blueprints(app):
@@ -113,3 +145,17 @@ def register_blueprints(app):
   app.register_blueprint(product.resources.api_bp, url_prefix=app.config['URL_PREFIX_API'])
 
   return None
+
+def register_request_hooks(app):
+  # Functions registered with before_request are called before each request, if one of them aborts the request
+  # the view is not called.
+  # Every request belongs to a tenant given in a header, invalid tenants are rejected upfront
+  app.before_request(validate_tenant)
+
+  return None
+
+def register_commands(app):
+  # Commands of the Flask command-line interface, ie. "flask compact-purchases"
+  app.cli.add_command(product.purchases.compact_purchases_command)
+
+  return None
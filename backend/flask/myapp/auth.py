@@ -0,0 +1,202 @@
+
+"""Authentication module, bearer tokens signed by the service and verified without querying the database."""
+
+import calendar
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+import click
+from flask import current_app, g, jsonify, request
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from myapp.tenancy import authenticate_tenant
+
+
+# The API is called for every action of the UI, so the authentication can't afford a database lookup per request.
+# The tokens carry their own claims (subject, tenant, token id) signed with AUTH_SECRET_KEY, so any worker can
+# verify them statelessly, and they expire AUTH_TOKEN_MAX_AGE seconds after being issued:
+# - the verified tokens are kept in a bounded LRU cache (AUTH_CACHE_SIZE tokens per worker), a client sending the
+#   same token again costs a dict lookup instead of a signature check and a JSON decoding
+# - revoked tokens are listed in the revoked_tokens table, the ids of the revoked tokens not expired yet are loaded
+#   in bulk by a background thread of each worker every AUTH_REVOCATION_REFRESH seconds (a revocation takes
+#   effect within that delay, immediately in the worker revoking the token)
+# - a token belongs to a tenant and is only accepted on the requests of its tenant
+# When AUTH_ENABLED is not set the requests are not authenticated at all. The tokens are issued and revoked with
+# "flask auth-token" and "flask auth-revoke".
+class TokenVerifier(object):
+  ''' Verification state of an app in a worker: serializer, cache of verified tokens and revoked token ids '''
+
+  def __init__(self, app, db):
+    self.db = db
+    self.app = app
+    # The tokens must be verifiable by every worker and by the command line, so they are signed with a key
+    # shared through the environment. The secret key of the app is random per process, it can't replace it.
+    secret_key = app.config.get('AUTH_SECRET_KEY')
+    if not secret_key:
+      raise RuntimeError('The authentication requires AUTH_SECRET_KEY')
+    self.serializer = URLSafeTimedSerializer(secret_key, salt='api-token')
+    self.max_age = app.config.get('AUTH_TOKEN_MAX_AGE', 30 * 86400)
+    self.cache_size = app.config.get('AUTH_CACHE_SIZE', 10000)
+    self.refresh_interval = app.config.get('AUTH_REVOCATION_REFRESH', 30)
+    self.tenant_header = app.config['TENANT_HEADER']
+    self.default_tenant = app.config['DEFAULT_TENANT']
+    self._lock = threading.Lock()
+    # Token -> (claims, expiration timestamp), least recently used first
+    self._cache = OrderedDict()
+    self._revoked = frozenset()
+    self._refresher = None
+    # Metrics
+    self.hits = 0
+    self.misses = 0
+
+  def issue(self, subject, tenant):
+    ''' Return a signed token for a subject (ie. the name of a client) of a tenant '''
+    return self.serializer.dumps({ 'sub': subject, 'tenant': tenant, 'jti': uuid.uuid4().hex })
+
+  def claims(self, token):
+    '''
+    Return the claims of a token, without checking the revocation
+    :return: tuple (claims, expiration timestamp)
+    :raise BadSignature: the token is invalid or expired (SignatureExpired)
+    '''
+    claims, signed_at = self.serializer.loads(token, max_age=self.max_age, return_timestamp=True)
+    return claims, calendar.timegm(signed_at.utctimetuple()) + self.max_age
+
+  def verify(self, token):
+    '''
+    Return the claims of a valid token
+    :raise BadSignature: the token is invalid, expired or revoked
+    '''
+    self._start_refresher()
+    with self._lock:
+      entry = self._cache.get(token)
+      if entry is not None:
+        self._cache.move_to_end(token)
+        self.hits += 1
+    if entry is None:
+      # The signature is checked outside of the lock, only the valid tokens are cached so invalid tokens can't
+      # evict them
+      entry = self.claims(token)
+      with self._lock:
+        self.misses += 1
+        self._cache[token] = entry
+        while len(self._cache) > self.cache_size:
+          self._cache.popitem(last=False)
+    claims, expires_at = entry
+    if time.time() >= expires_at:
+      with self._lock:
+        self._cache.pop(token, None)
+      raise SignatureExpired('Token expired')
+    if claims['jti'] in self._revoked:
+      raise BadSignature('Token revoked')
+    return claims
+
+  def revoke(self, token):
+    ''' Revoke a token, in every worker within AUTH_REVOCATION_REFRESH seconds '''
+    claims, expires_at = self.claims(token)
+    table = self.db.metadata.tables['revoked_tokens']
+    now = datetime.utcnow()
+    with self.db.engine.begin() as connection:
+      # The tokens revoked before expire eventually, they don't need to be listed anymore
+      connection.execute(table.delete().where(table.c.expires_at <= now))
+      connection.execute(table.insert().values(jti=claims['jti'], expires_at=datetime.utcfromtimestamp(expires_at)))
+    with self._lock:
+      self._revoked = self._revoked | { claims['jti'] }
+    return claims
+
+  def refresh(self):
+    ''' Load the ids of the revoked tokens that are not expired yet '''
+    table = self.db.metadata.tables['revoked_tokens']
+    with self.app.app_context():
+      with self.db.engine.connect() as connection:
+        rows = connection.execute(table.select().with_only_columns([table.c.jti])
+                                  .where(table.c.expires_at > datetime.utcnow()))
+        revoked = frozenset(row[0] for row in rows)
+    # Replaced at once, the requests read either the old or the new set
+    self._revoked = revoked
+    return revoked
+
+  def _start_refresher(self):
+    # The thread is started by the first request of a worker (the threads of the master don't survive the fork),
+    # which loads the revoked tokens before the verification
+    if self._refresher is not None and self._refresher.is_alive():
+      return
+    with self._lock:
+      if self._refresher is not None and self._refresher.is_alive():
+        return
+      self.refresh()
+      self._refresher = threading.Thread(target=self._refresh_loop, name='auth-revocations', daemon=True)
+      self._refresher.start()
+
+  def _refresh_loop(self):
+    while True:
+      time.sleep(self.refresh_interval)
+      try:
+        self.refresh()
+      except Exception:
+        # The previous list is kept until the database answers again
+        self.app.logger.exception('Cannot refresh the revoked tokens')
+
+
+class TokenAuth(object):
+  ''' Extension authenticating the requests of the blueprints with signed bearer tokens '''
+
+  def __init__(self, db=None, app=None):
+    self.db = db
+    if db is not None:
+      # Revoked tokens until their expiration, created with the other tables (see the migrations)
+      db.Table('revoked_tokens',
+               db.Column('jti', db.String(32), primary_key=True),
+               db.Column('expires_at', db.DateTime(), nullable=False, index=True))
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.extensions['auth'] = TokenVerifier(app, self.db) if app.config.get('AUTH_ENABLED', False) else None
+
+    # Commands to issue and revoke tokens: flask auth-token --subject NAME, flask auth-revoke TOKEN
+    @app.cli.command('auth-token')
+    @click.option('--subject', required=True, help='Name of the client of the token')
+    @click.option('--tenant', default=None, help='Tenant of the token (the default tenant otherwise)')
+    def auth_token(subject, tenant):
+      ''' Print a signed token to call the API '''
+      click.echo(TokenVerifier(app, self.db).issue(subject, tenant or app.config['DEFAULT_TENANT']))
+
+    @app.cli.command('auth-revoke')
+    @click.argument('token')
+    def auth_revoke(token):
+      ''' Revoke a token '''
+      claims = TokenVerifier(app, self.db).revoke(token)
+      click.echo('Token {} of {} revoked'.format(claims['jti'], claims['sub']))
+
+  def authenticate(self):
+    ''' Reject the requests without a valid bearer token of their tenant, when the authentication is enabled '''
+    verifier = current_app.extensions.get('auth')
+    if verifier is None:
+      return None
+    # The proxies (request, current_app) are resolved once, this hook runs on every API request
+    headers = request.headers
+    scheme, _, token = headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+      return self.challenge('Missing bearer token', 'invalid_request')
+    try:
+      claims = verifier.verify(token)
+    except SignatureExpired:
+      return self.challenge('Token expired')
+    except BadSignature:
+      return self.challenge('Invalid token')
+    # The tenant is validated beforehand by the request hook of the app
+    tenant = headers.get(verifier.tenant_header, verifier.default_tenant)
+    if claims['tenant'] != tenant:
+      return jsonify(message='Token not valid for tenant {}'.format(tenant)), 403
+    g.auth = claims
+    authenticate_tenant(tenant)
+    return None
+
+  @staticmethod
+  def challenge(message, error='invalid_token'):
+    response = jsonify(message=message)
+    response.status_code = 401
+    response.headers['WWW-Authenticate'] = 'Bearer error="{}"'.format(error)
+    return response
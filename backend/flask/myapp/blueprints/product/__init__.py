@@ -1,6 +1,13 @@
-from . import views, resources
-from myapp.blueprints.product.resources import Product, ProductList, api
+from . import views, resources, purchases, suggestions, categories
+from myapp.blueprints.product.resources import (Product, ProductList, ProductLookup, CategoryList, Stats, Suggestions,
+                                                Metrics, api)
 
 
 api.add_resource(resources.Product, '/products/<string:name>')
-api.add_resource(resources.ProductList, '/products')    
\ No newline at end of file
+api.add_resource(resources.ProductList, '/products')
+# Only POST is defined, other methods on /products/lookup still reach the product named "lookup"
+api.add_resource(resources.ProductLookup, '/products/lookup')
+api.add_resource(resources.CategoryList, '/categories')
+api.add_resource(resources.Stats, '/stats')
+api.add_resource(resources.Suggestions, '/suggestions')
+api.add_resource(resources.Metrics, '/metrics')
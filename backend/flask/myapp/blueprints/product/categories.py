@@ -0,0 +1,58 @@
+
+"""Categories of the products: counts of the products by category maintained with the writes of the products."""
+
+from collections import defaultdict
+from itertools import groupby
+from myapp.extensions import db, warmup
+from myapp.blueprints.product.models import Product as ProductDao, Category, CategoryCount
+from myapp.tenancy import tenant_context
+
+
+@ProductDao.on_write
+def count_products(operation, old, new):
+  ''' Move the product from the counts of its old category to the counts of its new category '''
+  deltas = defaultdict(lambda: [0, 0])
+  for product, sign in ((old, -1), (new, 1)):
+    if product is not None and product.get('category_id') is not None:
+      delta = deltas[(product['tenant_id'], product['category_id'])]
+      delta[0] += sign
+      delta[1] += sign if product.get('shopping_cart') else 0
+  # Only the categories whose counts change are updated (ie. not when another field of the product is updated).
+  # The rows are locked in the order of their keys, so concurrent moves between two categories in opposite
+  # directions can't deadlock.
+  for (tenant_id, category_id), (products, in_cart) in sorted(deltas.items()):
+    if products or in_cart:
+      CategoryCount.add(tenant_id, category_id, products, in_cart)
+
+
+def recount_products():
+  ''' Count the products of every category of the current tenant again, from the products '''
+  counts = defaultdict(lambda: (0, 0))
+  for product in ProductDao.find_all():
+    if product.get('category_id') is not None:
+      products, in_cart = counts[product['category_id']]
+      counts[product['category_id']] = (products + 1, in_cart + (1 if product['shopping_cart'] else 0))
+  for count in CategoryCount.scoped_query().order_by(CategoryCount.category_id):
+    count.products, count.in_cart = counts[count.category_id]
+  CategoryCount.commit()
+
+@warmup.task
+def repair_counts(app):
+  ''' Recount the products of the categories kept in memory before the worker accepts traffic '''
+  # With the SQL engine the counts are committed with the products. The memory engine commits them before writing
+  # the products in memory and in the log, a failure in between leaves them off until they are counted again.
+  if app.config.get('STORAGE_ENGINE', 'sql') != 'memory':
+    return
+  with app.app_context():
+    tenants = [tenant for tenant, in db.session.query(Category.tenant_id).distinct()]
+    db.session.remove()
+  for tenant in tenants:
+    with tenant_context(app, tenant):
+      recount_products()
+
+
+def facets_by_aisle():
+  ''' Return the categories with their counts grouped by aisle, as a list of (aisle, categories) tuples '''
+  # The facets are sorted by aisle already
+  facets = Category.find_facets()
+  return [(aisle, list(categories)) for aisle, categories in groupby(facets, key=lambda facet: facet['aisle'])]
@@ -1,6 +1,10 @@
 
-from myapp.extensions import db
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from myapp.extensions import db, storage
 from myapp.database import Model
+from myapp.storage import DuplicateKeyError, is_duplicate_key
+from myapp.tenancy import current_tenant
 
 
 #SQL_ALquemy: The data that we will store in our database will be represented by a collection of classes that are
@@ -20,40 +24,216 @@ class Product(Model):
   ''' Model representing a product in the catalog '''
 
   __tablename__ = 'products'
+  # Products are partitioned by tenant, every query is routed to the partition of the current tenant
+  __tenant_key__ = 'tenant_id'
 
+  tenant_id = db.Column(db.String(50), primary_key=True)
   name = db.Column(db.String(50), primary_key=True)
   shopping_cart = db.Column(db.Boolean(), nullable=False)
+  # Optimistic concurrency control: SQLAlchemy increments the version on every update, and it adds the version
+  # read to the WHERE clause of the UPDATE and DELETE statements (compare-and-swap). If another transaction
+  # modified the row in the meantime no row matches and StaleDataError is raised, so lost updates are detected
+  # without locking the row between the read and the write.
+  version = db.Column(db.Integer(), nullable=False, server_default='1')
+  category_id = db.Column(db.Integer(), db.ForeignKey('categories.id'), nullable=True)
 
+  __mapper_args__ = {
+    'version_id_col': version
+  }
+
+  # The shopping cart of a tenant is read far more often than the rest of its products
+  __table_args__ = (
+    db.Index('ix_products_shopping_cart', 'tenant_id', 'shopping_cart'),
+    # Products of a category (/products?category=)
+    db.Index('ix_products_category', 'tenant_id', 'category_id'),
+  )
+
+  # Columns indexed by the in-memory storage engine
+  __secondary_indexes__ = ('shopping_cart', 'category_id')
+
+
+  # The DAO methods delegate to the storage engine of the app (STORAGE_ENGINE), the SQL engine by default
+
+  @classmethod
+  def create(cls, **kwargs):
+    ''' create a product, DuplicateKeyError is raised if the product already exists '''
+    return storage.engine.create(cls, kwargs)
 
   @staticmethod
   def find_all(filter=None): 
     ''' retrieve all products from the database matching the filter condition '''
-    if filter is not None:
-      products = Product.query.filter_by(**filter)      
-    else:
-      products = Product.query.all() 
-    return Product.serialize_list(products)    
+    return storage.engine.find_all(Product, filter)
 
   @staticmethod
   def find_one(query=None):
     ''' retrieve a product from the database matching the query condition '''
-    product = Product.query.filter_by(**query).first()
-    if product is not None:
-      product = product.serialize() 
-    return product  
+    return storage.engine.find_one(Product, query)
 
   @staticmethod
-  def delete_one(query=None):
-    ''' delete a product from the database matching the query condition '''
-    product = Product.query.filter_by(**query).first()
-    if product is not None:      
-      return product.delete()
-    return None  
+  def find_many(names):
+    ''' 
+    retrieve the products with the given names using one query (per chunk of names) 
+    A cache in front of the DAO retrieves all its misses with a single call
+    :return: dict of the products found by name
+    '''
+    return storage.engine.find_many(Product, 'name', list(dict.fromkeys(names)))
 
   @staticmethod
-  def update_one(query=None, props=None):
-    ''' update fields of a product from the database matching the query condition '''
-    product = Product.query.filter_by(**query).first()
-    if product is not None:
-      return product.update(**props) 
-    return None   
\ No newline at end of file
+  def delete_one(query=None, if_match=None):
+    ''' 
+    delete a product from the database matching the query condition 
+    :param if_match: versions accepted for the product, StaleDataError is raised if its version is not one of them
+    '''
+    return storage.engine.delete_one(Product, query, if_match)
+
+  @staticmethod
+  def update_one(query=None, props=None, if_match=None):
+    ''' 
+    update fields of a product from the database matching the query condition 
+    :param if_match: versions accepted for the product, StaleDataError is raised if its version is not one of them
+    '''
+    return storage.engine.update_one(Product, query, props, if_match)
+
+
+# Categories
+# The products are grouped by category, and the categories by aisle of the grocery store. The list UI shows the
+# number of products of each category (total and in the shopping cart): the counts are kept in the category_counts
+# table, updated in the same transaction as the products (see categories.count_products), so the facets are read
+# from one row per category instead of counting the products with a GROUP BY. The categories are stored in the SQL
+# database whatever the storage engine of the products.
+class Category(Model):
+  ''' Model representing a category of products '''
+
+  __tablename__ = 'categories'
+  __tenant_key__ = 'tenant_id'
+
+  id = db.Column(db.Integer(), primary_key=True)
+  tenant_id = db.Column(db.String(50), nullable=False)
+  name = db.Column(db.String(50), nullable=False)
+  aisle = db.Column(db.String(50), nullable=True)
+
+  __table_args__ = (
+    db.UniqueConstraint('tenant_id', 'name', name='uq_categories_name'),
+  )
+
+  @classmethod
+  def create(cls, **kwargs):
+    ''' create a category and its counters, DuplicateKeyError is raised if the category already exists '''
+    instance = cls(tenant_id=current_tenant(), **kwargs)
+    db.session.add(instance)
+
+    # The id of the category is generated by the flush, the counters are created in the same transaction so the
+    # writes of the products only ever update them. The flush is staged to run in the commit, under the writer lock.
+    def add_counts():
+      db.session.flush()
+      db.session.add(CategoryCount(tenant_id=instance.tenant_id, category_id=instance.id, products=0, in_cart=0))
+    cls.before_commit(add_counts)
+    try:
+      cls.commit()
+    except IntegrityError as e:
+      if not is_duplicate_key(e):
+        raise
+      raise DuplicateKeyError(*e.args) from e
+    return instance.serialize()
+
+  @classmethod
+  def find_one(cls, id):
+    ''' retrieve a category of the current tenant by id '''
+    category = cls.scoped_query().filter_by(id=id).first()
+    return category.serialize() if category is not None else None
+
+  @classmethod
+  def find_facets(cls):
+    ''' retrieve the categories of the current tenant with their counts, by aisle and name '''
+    rows = cls.scoped_query().join(CategoryCount, CategoryCount.category_id == cls.id) \
+      .order_by(cls.aisle, cls.name) \
+      .with_entities(cls.id, cls.name, cls.aisle, CategoryCount.products, CategoryCount.in_cart)
+    return [{ 'id': id, 'name': name, 'aisle': aisle, 'products': products, 'in_cart': in_cart }
+            for id, name, aisle, products, in_cart in rows]
+
+
+class CategoryCount(Model):
+  ''' Number of products of a category, and of its products in the shopping cart '''
+
+  __tablename__ = 'category_counts'
+  __tenant_key__ = 'tenant_id'
+
+  tenant_id = db.Column(db.String(50), primary_key=True)
+  category_id = db.Column(db.Integer(), db.ForeignKey('categories.id'), primary_key=True)
+  products = db.Column(db.Integer(), nullable=False)
+  in_cart = db.Column(db.Integer(), nullable=False)
+
+  @classmethod
+  def add(cls, tenant_id, category_id, products, in_cart):
+    ''' Add to the counts of a category, in the current transaction (from a write listener or a staged statement) '''
+    # Relative update: concurrent transactions wait for each other on the row instead of overwriting their counts
+    cls.query.filter_by(tenant_id=tenant_id, category_id=category_id).update({
+      cls.products: cls.products + products,
+      cls.in_cart: cls.in_cart + in_cart
+    }, synchronize_session=False)
+
+
+# Purchase history
+# A product leaving the shopping cart has been bought. Each purchase is appended to the purchase events, and it's
+# counted in the daily and weekly rollups at the same time, so the statistics of a product are read from a few
+# rollup rows (one per bucket) instead of scanning its events. The raw events are kept for
+# PURCHASE_EVENTS_RETENTION_DAYS days only (flask compact-purchases), the rollups keep the counts.
+# The purchase history is stored in the SQL database whatever the storage engine of the products.
+class PurchaseEvent(Model):
+  ''' Model representing the purchase of a product (append-only) '''
+
+  __tablename__ = 'purchase_events'
+  __tenant_key__ = 'tenant_id'
+
+  id = db.Column(db.Integer(), primary_key=True)
+  tenant_id = db.Column(db.String(50), nullable=False)
+  name = db.Column(db.String(50), nullable=False)
+  # Index used to compact the old events
+  purchased_at = db.Column(db.DateTime(), nullable=False, index=True)
+
+
+class PurchaseRollup(Model):
+  ''' Number of purchases of a product in a time bucket (the bucket is identified by its first day) '''
+
+  __abstract__ = True
+  __tenant_key__ = 'tenant_id'
+
+  tenant_id = db.Column(db.String(50), primary_key=True)
+  name = db.Column(db.String(50), primary_key=True)
+  bucket = db.Column(db.Date(), primary_key=True)
+  purchases = db.Column(db.Integer(), nullable=False)
+
+  @classmethod
+  def increment(cls, tenant_id, name, bucket):
+    ''' Add a purchase to the count of a bucket, in the current transaction '''
+    key = { 'tenant_id': tenant_id, 'name': name, 'bucket': bucket }
+    # The row of a bucket is created by its first purchase. The purchases are recorded in the transaction of the
+    # product leaving the cart, so concurrent first purchases must not fail on the primary key: PostgreSQL inserts
+    # or increments the row in one statement, and SQLite serializes the write transactions (the UPDATE takes the
+    # write lock of the database until the commit, no other transaction can insert the row in between).
+    if db.engine.dialect.name == 'postgresql':
+      table = cls.__table__
+      db.session.execute(postgresql.insert(table).values(purchases=1, **key).on_conflict_do_update(
+        index_elements=[table.c.tenant_id, table.c.name, table.c.bucket], set_={ 'purchases': table.c.purchases + 1 }))
+    elif not cls.query.filter_by(**key).update({ cls.purchases: cls.purchases + 1 }, synchronize_session=False):
+      db.session.add(cls(purchases=1, **key))
+
+  @classmethod
+  def find_buckets(cls, name, start):
+    ''' Return the purchases of a product by bucket, from the bucket starting at start '''
+    rows = cls.scoped_query().filter(cls.name == name, cls.bucket >= start).with_entities(cls.bucket, cls.purchases)
+    return dict(rows)
+
+
+class DailyPurchases(PurchaseRollup):
+  __tablename__ = 'purchases_daily'
+  __table_args__ = (
+    db.Index('ix_purchases_daily_bucket', 'tenant_id', 'bucket'),
+  )
+
+
+class WeeklyPurchases(PurchaseRollup):
+  __tablename__ = 'purchases_weekly'
+  __table_args__ = (
+    db.Index('ix_purchases_weekly_bucket', 'tenant_id', 'bucket'),
+  )
@@ -0,0 +1,87 @@
+
+"""Purchase history of the products: purchase events, daily and weekly rollups and purchase statistics."""
+
+import click
+from datetime import datetime, timedelta
+from flask import current_app
+from flask.cli import with_appcontext
+from myapp.extensions import db
+from myapp.blueprints.product.models import Product as ProductDao, PurchaseEvent, DailyPurchases, WeeklyPurchases
+from myapp.tenancy import current_tenant
+
+
+# Rollup tables by period, with the first day of the bucket containing a date
+ROLLUPS = {
+  'day': (DailyPurchases, lambda day: day),
+  'week': (WeeklyPurchases, lambda day: day - timedelta(days=day.weekday()))
+}
+
+
+def bucket_start(period, day):
+  ''' Return the first day of the bucket of the period containing the day '''
+  return ROLLUPS[period][1](day)
+
+def add_purchase(tenant, name, purchased_at):
+  ''' Append a purchase event and count it in the rollups, in the current transaction '''
+  db.session.add(PurchaseEvent(tenant_id=tenant, name=name, purchased_at=purchased_at))
+  for rollup, start in ROLLUPS.values():
+    rollup.increment(tenant, name, start(purchased_at.date()))
+
+def record_purchase(name, purchased_at=None):
+  ''' Append a purchase event and count it in the rollups, in a single transaction '''
+  tenant = current_tenant()
+  purchased_at = purchased_at or datetime.utcnow()
+  PurchaseEvent.before_commit(lambda: add_purchase(tenant, name, purchased_at))
+  PurchaseEvent.commit()
+
+@ProductDao.on_write
+def record_purchases(operation, old, new):
+  ''' Record a purchase when a product leaves the shopping cart, in the transaction of the product '''
+  # Both are committed or neither is: a product update never returns an error after its change is saved
+  if operation == 'update' and old['shopping_cart'] and not new['shopping_cart']:
+    add_purchase(new['tenant_id'], new['name'], datetime.utcnow())
+
+
+def purchase_stats(name, period, buckets, today=None):
+  '''
+  Return the purchases of a product in the last buckets of the period, read from the rollups (one row per bucket)
+  :param name: name of the product
+  :param period: 'day' or 'week'
+  :param buckets: number of buckets, including the current one
+  '''
+  rollup, start = ROLLUPS[period]
+  step = timedelta(days=1 if period == 'day' else 7)
+  last = start(today or datetime.utcnow().date())
+  first = last - step * (buckets - 1)
+  counts = rollup.find_buckets(name, first)
+  series = [{ 'start': (first + step * i).isoformat(), 'purchases': counts.get(first + step * i, 0) }
+            for i in range(buckets)]
+  return { 'period': period, 'start': first.isoformat(), 'name': name, 'buckets': series,
+           'total': sum(bucket['purchases'] for bucket in series) }
+
+
+def compact_events(retention_days, batch_size=10000):
+  ''' Delete the purchase events older than the retention (their purchases remain counted in the rollups) '''
+  cutoff = datetime.utcnow() - timedelta(days=retention_days)
+  deleted = 0
+  counts = []
+
+  def delete_batch():
+    ids = db.session.query(PurchaseEvent.id).filter(PurchaseEvent.purchased_at < cutoff).limit(batch_size)
+    counts.append(PurchaseEvent.query.filter(PurchaseEvent.id.in_(ids.subquery())).delete(synchronize_session=False))
+  while True:
+    # The DELETE runs in the commit, under the writer lock
+    PurchaseEvent.before_commit(delete_batch)
+    PurchaseEvent.commit()
+    count = counts.pop()
+    deleted += count
+    if count < batch_size:
+      return deleted
+
+# Command to run periodically (ie. cron): flask compact-purchases
+@click.command('compact-purchases')
+@with_appcontext
+def compact_purchases_command():
+  ''' Delete the purchase events older than PURCHASE_EVENTS_RETENTION_DAYS '''
+  deleted = compact_events(current_app.config['PURCHASE_EVENTS_RETENTION_DAYS'])
+  click.echo('{} purchase events deleted'.format(deleted))
@@ -1,11 +1,25 @@
 
-from flask_restful import Resource, fields, marshal_with, abort, reqparse, inputs, Api
-from flask import current_app, Blueprint
-from myapp.blueprints.product.models import Product as ProductDao
+from json import dumps
+from flask_restful import Resource, fields, marshal, marshal_with, abort, Api
+from flask import current_app, Blueprint, render_template, request
+from sqlalchemy.orm.exc import StaleDataError
+from myapp.blueprints.product.models import Product as ProductDao, Category as CategoryDao
+from myapp.blueprints.product.purchases import purchase_stats
+from myapp.blueprints.product.suggestions import suggestions
+from myapp.extensions import auth, single_flight, warmup
+from myapp.snapshot import Snapshot
+from myapp.storage import DuplicateKeyError
+from myapp.tenancy import authorize_tenant, current_tenant
+from myapp.validation import load_api_description, operation_parameters, compile_validator
+from config import API_DESCRIPTION_PATH
 
 
 api_bp = Blueprint('api', __name__)
 api = Api(api_bp)
+# Every API request carries a bearer token when the authentication is enabled (AUTH_ENABLED), which authenticates
+# the tenant of the request
+api_bp.before_request(auth.authenticate)
+api_bp.before_request(authorize_tenant)
 
 
 # Output fields
@@ -15,48 +29,179 @@ api = Api(api_bp)
 
 product_fields = {
   'name': fields.String,
-  'shopping_cart': fields.Boolean
+  'shopping_cart': fields.Boolean,
+  'category_id': fields.Integer(default=None)
 }
 
-# Request Parsing
-# While Flask provides easy access to request data (i.e. querystring or POST form encoded data), it’s still a
-# pain to validate form data. Flask-RESTful has built-in support for request data validation using a
-# library similar to argparse.
-# The whole request parser part of Flask-RESTful is slated for removal and will be replaced by documentation
-# on how to integrate with other packages that do the input/output stuff better
-# Using the reqparse module also gives you sane error messages for free. If an argument fails to pass
-# validation, Flask-RESTful will respond with a 400 Bad Request and a response highlighting the error.
-# Calling parse_args with strict=True ensures that an error is thrown if the request includes arguments
-# your parser does not define:  args = parser.parse_args(strict=True)
-# If you specify the help value, it will be rendered as the error message when a type error is raised while
-# parsing it. If you do not specify a help message, the default behavior is to return the message from the
-# type error itself.
-# By default, arguments are not required. Also, arguments supplied in the request that are not part of the
-# RequestParser will be ignored. Arguments declared in your request parser but not set in the request itself
-# will default to None.
-# To require a value be passed for an argument, just add required=True to the call to add_argument().
-# By default, the RequestParser tries to parse values from flask.Request.values, and flask.Request.json.
-# Use the location argument to add_argument() to specify alternate locations to pull the values from. 
-# Any variable on the flask.Request can be used.
-# The default way errors are handled by the RequestParser is to abort on the first error that occurred.
-# This can be beneficial when you have arguments that might take some time to process. However, often it
-# is nice to have the errors bundled together and sent back to the client all at once. This behavior can
-# be specified either at the Flask application level or on the specific RequestParser instance. To invoke
-# a RequestParser with the bundling errors option, pass in the argument bundle_errors.
-
-product_list_parser = reqparse.RequestParser()
-product_list_parser.add_argument('shop', type=inputs.boolean, help='This value must be boolean',\
-                                    location='args', default=False)
-
-create_product_parser = reqparse.RequestParser(bundle_errors=True)
-create_product_parser.add_argument('name', required=True, help="Field 'name' is required")  
-create_product_parser.add_argument('shopping_cart', type=inputs.boolean, help='This value must be boolean',\
-                                             default=False)                               
-
-update_product_parser = reqparse.RequestParser(bundle_errors=True)
-# store_missing– Whether the arguments default value should be stored if the argument is missing from the request.
-update_product_parser.add_argument('shopping_cart', type=inputs.boolean, help='This value must be boolean',\
-                                          store_missing=False)
+category_fields = {
+  'id': fields.Integer,
+  'name': fields.String,
+  'aisle': fields.String,
+  'products': fields.Integer,
+  'in_cart': fields.Integer
+}
+
+# Request Validation
+# The request parser of Flask-RESTful (reqparse) is slated for removal and it's slow: it goes through a generic loop
+# for every argument of every request. The validators below are compiled once from the Product definition and the
+# operation parameters of the API description (api_description.yml), and they validate the query arguments and the
+# JSON body of a request in a single pass. As with reqparse, an invalid request is aborted with 400 (Bad Request) and
+# a message highlighting the error of each field, arguments not defined in the API description are ignored, and
+# fields missing in the request take the default value of the API description.
+
+api_description = load_api_description(API_DESCRIPTION_PATH)
+product_definition = api_description['definitions']['Product']
+
+product_list_validator = compile_validator(*operation_parameters(api_description, '/products', 'get'),
+                                           location='query', bundle_errors=False)
+
+create_product_validator = compile_validator(product_definition['properties'], product_definition['required'])
+
+# The name of a product is immutable (it's given in the path), only the fields sent in the request are updated
+update_product_validator = compile_validator(product_definition['properties'], partial=True, exclude=['name'])
+
+stats_validator = compile_validator(*operation_parameters(api_description, '/stats', 'get'), location='query')
+
+suggestions_validator = compile_validator(*operation_parameters(api_description, '/suggestions', 'get'),
+                                          location='query')
+
+category_definition = api_description['definitions']['Category']
+create_category_validator = compile_validator(category_definition['properties'], category_definition['required'])
+
+lookup_products_validator = compile_validator(api_description['definitions']['ProductNames']['properties'],
+                                              api_description['definitions']['ProductNames']['required'])
+
+# Response encoding
+# Flask-RESTful encodes the output of each resource once per request. To share the encoded body among identical
+# requests running at the same time, the body is encoded in advance with the same settings the default JSON
+# representation of Flask-RESTful uses, and the resource returns a ready made response
+
+def encode_json(data):
+  ''' Encode data into a JSON body the same way the default representation of Flask-RESTful does '''
+  settings = current_app.config.get('RESTFUL_JSON', {})
+  return dumps(data, **settings) + "\n"
+
+def json_response(body, code=200):
+  ''' Make a JSON response from an already encoded body '''
+  return current_app.response_class(body, code, mimetype='application/json')
+
+def find_all_encoded(filter=None):
+  ''' Retrieve all products matching the filter condition and encode them into a JSON body '''
+  return encode_json(marshal(ProductDao.find_all(filter), product_fields))
+
+# Multi-get
+# Clients rendering a recipe need many products at once. Instead of one request (and one query) per product, the
+# products are retrieved by name with a single WHERE name IN (...) query, and the response tells which names were
+# found and which ones are missing.
+
+def find_many_response(names, filter=None):
+  '''
+  Retrieve the products with the given names and return the found products and the missing names
+  :param filter: conditions on the fields of the products, the products not matching them are missing
+  '''
+  max_names = current_app.config['MULTI_GET_MAX_NAMES']
+  if len(names) > max_names:
+    abort(400, message='Too many names, the maximum is {}'.format(max_names))
+  try:
+    products = ProductDao.find_many(names)
+  except Exception as e:
+    current_app.logger.error(e.args)
+    abort(500, message='Cannot complete the operation')
+  if filter:
+    products = { name: product for name, product in products.items()
+                 if all(product.get(column) == value for column, value in filter.items()) }
+  names = list(dict.fromkeys(names))
+  return {
+    'found': marshal([products[name] for name in names if name in products], product_fields),
+    'missing': [name for name in names if name not in products]
+  }, 200
+
+# Categories
+# The category of a product must be a category of the tenant. The database only checks that the category exists
+# (and SQLite doesn't even check foreign keys by default), so it's checked before writing the product.
+
+def check_category(args):
+  ''' Abort with 400 if the category given in the fields of a product is not a category of the tenant '''
+  category_id = args.get('category_id')
+  if category_id is not None and CategoryDao.find_one(category_id) is None:
+    abort(400, message='Category {} not found'.format(category_id))
+
+# Conditional requests
+# Every product has a version that is returned in the ETag header. Clients can send it back in the If-Match header
+# of PUT and DELETE requests, then the operation is only applied if nobody modified the product since they read it,
+# otherwise it fails with 412 (Precondition Failed). The check is a compare-and-swap on the version column, so it
+# doesn't need to lock the row.
+
+def etag(product):
+  ''' Return the entity tag of a serialized product '''
+  return '"{}"'.format(product['version'])
+
+def if_match_versions():
+  ''' Return the versions accepted by the If-Match header of the request, None if any version is accepted '''
+  if not request.if_match or request.if_match.star_tag:
+    return None
+  # Only strong entity tags can match (weak comparison is not allowed for If-Match)
+  return { int(tag) for tag in request.if_match.as_set() if tag.isdigit() }
+
+def write_product(write, if_match):
+  '''
+  Run a write of a product, StaleDataError is raised if the version of the product is not accepted
+  :param write: function writing the product with the accepted versions
+  :param if_match: versions accepted by the If-Match header of the request, None if any version is accepted
+  '''
+  # Only a conditional request fails on a stale version (412). An unconditional write doesn't depend on the version
+  # it read: when a concurrent write changes the version between the read and the write of the product, it's retried
+  # with the new version until it succeeds (the last write wins). Each attempt reads the product again, so an
+  # attempt only fails if another write committed in between.
+  attempt = 1
+  while True:
+    try:
+      return write(if_match)
+    except StaleDataError:
+      if if_match is not None:
+        raise
+      current_app.logger.info('Product modified by a concurrent write, retrying (attempt {})'.format(attempt))
+      attempt += 1
+
+# Shopping cart snapshot
+# The shopping cart is the hottest read of the service. When CART_SNAPSHOT_ENABLED is set, its JSON body and its
+# HTML table are kept pre-encoded in a memory-mapped file shared by all the workers (one file per tenant), and they
+# are updated incrementally each time a product enters or leaves the cart.
+cart_snapshot = Snapshot('CART_SNAPSHOT', key='name',
+                         load=lambda: ProductDao.find_all({ 'shopping_cart': True }),
+                         load_one=lambda name: ProductDao.find_one({ 'name': name, 'shopping_cart': True }),
+                         encode=lambda products: encode_json(marshal(products, product_fields)),
+                         render=lambda products: render_template('table.html', products=products),
+                         scope=current_tenant)
+
+@ProductDao.on_commit
+def update_cart_snapshot(operation, product, changes):
+  ''' Apply the committed changes of the shopping cart to its snapshot '''
+  if not cart_snapshot.enabled:
+    return
+  # Only the products entering or leaving the shopping cart, or the output fields of a product of the cart (ie. its
+  # category), change the snapshot
+  if operation == 'update' and 'shopping_cart' not in changes and \
+      not (product['shopping_cart'] and changes.keys() & product_fields.keys()):
+    return
+  if operation != 'update' and not product['shopping_cart']:
+    return
+  cart_snapshot.refresh(product['name'])
+
+@warmup.task
+def warm_up_cart(app):
+  ''' Run the query of the shopping cart and build its snapshot before the worker accepts traffic '''
+  # The first query also loads the records of the storage engine (ie. replaying the log of the memory engine)
+  with app.test_request_context():
+    ProductDao.find_all({ 'shopping_cart': True })
+    if cart_snapshot.enabled:
+      cart_snapshot.rebuild(force=False)
+
+@warmup.check
+def cart_snapshot_readable():
+  ''' The snapshot of the shopping cart of the default tenant can be read (or built) '''
+  if cart_snapshot.enabled:
+    cart_snapshot.json()
 
 # The main building block provided by Flask-RESTful are resources. Resources are built on top of Flask 
 # pluggable views, giving you easy access to multiple HTTP methods just by defining methods on your resource. 
@@ -83,7 +228,7 @@ class Product(Resource):
     if product is None:
       current_app.logger.info('Product "{}" not found'.format(name))
       abort(404, message="Product {} not found".format(name)) 
-    return product  
+    return product, 200, { 'ETag': etag(product) }
 
   def delete(self, name):
     ''' 
@@ -92,9 +237,13 @@ class Product(Resource):
     '''
     current_app.logger.info('Request to delete product "{}" from the catalog'.format(name))
     # Delete product into database 
+    if_match = if_match_versions()
     try:
       query = { 'name': name }
-      result = ProductDao.delete_one(query)
+      result = write_product(lambda versions: ProductDao.delete_one(query, versions), if_match)
+    except StaleDataError as e:
+      current_app.logger.info('Product "{}" was modified: {}'.format(name, e))
+      abort(412, message='Product {} has been modified'.format(name))
     except Exception as e:
       current_app.logger.error(e.args)
       abort(500, message='Cannot complete the operation')
@@ -113,14 +262,19 @@ class Product(Resource):
     '''
     current_app.logger.info('Request to update product "{}" from the catalog'.format(name))
     # Validate input arguments    
-    args = update_product_parser.parse_args()
+    args = update_product_validator(request)
     if not args:
       abort(400, message='No valid fields to update are detected')   
     args['name'] = name       
+    check_category(args)
     # Update product in database  
+    if_match = if_match_versions()
     try:
       query = { 'name': name }
-      result = ProductDao.update_one(query, args)
+      result = write_product(lambda versions: ProductDao.update_one(query, args, versions), if_match)
+    except StaleDataError as e:
+      current_app.logger.info('Product "{}" was modified: {}'.format(name, e))
+      abort(412, message='Product {} has been modified'.format(name))
     except Exception as e:
       current_app.logger.error(e.args)  
       abort(500, message='Cannot complete the operation') 
@@ -133,37 +287,130 @@ class Product(Resource):
   
 
 class ProductList(Resource):
-  @marshal_with(product_fields)
+
   def get(self):
     ''' Return the list of all products in the catalog  ''' 
     current_app.logger.info('Request to retrieve all products in the catalog')
     # Validate input arguments
-    args = product_list_parser.parse_args()
+    args = product_list_validator(request)
     # If query parameter "shop" is True, then only list products to buy in grocery store (shopping_cart = True)
+    # Query parameter "category" retrieves only the products of a category (composite index on the category)
+    shop = args['shop'] == True
+    category = args.get('category')
+    filter = { 'shopping_cart': True } if shop else {}
+    if category is not None:
+      filter['category_id'] = category
+    # Query parameter "names" retrieves only the products with these names, the other filters apply to them
+    if 'names' in args:
+      return find_many_response(args['names'], filter)
+    # The shopping cart is served from its snapshot, otherwise identical requests in flight share the query and
+    # the encoded body
     try:
-      filter = { 'shopping_cart': True } if args['shop'] == True else None
-      products = ProductDao.find_all(filter) 
+      if shop and category is None and cart_snapshot.enabled:
+        body = cart_snapshot.json()
+      else:
+        body = single_flight.do(('products', current_tenant(), shop, category), find_all_encoded, filter or None)
     except Exception as e:
       current_app.logger.error(e.args) 
       abort(500, message='Cannot complete the operation')      
-    return products, 200
+    return json_response(body, 200)
 
   def post(self):
     ''' Create a new product into the catalog '''    
     current_app.logger.info('Request to create product into the catalog')
     # Validate input arguments
-    args = create_product_parser.parse_args()
+    args = create_product_validator(request)
     name = args['name'] 
+    check_category(args)
     # Create product into database  
     try:
       product = ProductDao.create(**args)
+    except DuplicateKeyError as e:
+      current_app.logger.error(e.args[0])
+      abort(400, message='Product {} is already registered'.format(name))       
     except Exception as e:
       current_app.logger.error(e.args[0])
-      if 'sqlite3.IntegrityError' in e.args[0] or 'psycopg2.errors.UniqueViolation' in e.args[0]: 
-        abort(400, message='Product {} is already registered'.format(name))       
-      else:
-        abort(500, message='Cannot complete the operation')      
+      abort(500, message='Cannot complete the operation')      
     current_app.logger.info('Product "{}" was saved in database'.format(name))
     # Return product  
-    return product, 201  
+    return marshal(product, product_fields), 201, { 'ETag': etag(product) }
+
+
+class ProductLookup(Resource):
 
+  def post(self):
+    ''' Return the products with the names given in the body (for lists of names too long for a query string) '''
+    current_app.logger.info('Request to retrieve products by name from the catalog')
+    args = lookup_products_validator(request)
+    return find_many_response(args['names'])
+
+
+class CategoryList(Resource):
+
+  def get(self):
+    ''' Return the categories with their number of products and of products in the shopping cart '''
+    current_app.logger.info('Request to retrieve the categories')
+    # The counts are read from the counters of the categories, there is no count of the products
+    try:
+      facets = CategoryDao.find_facets()
+    except Exception as e:
+      current_app.logger.error(e.args)
+      abort(500, message='Cannot complete the operation')
+    return marshal(facets, category_fields), 200
+
+  def post(self):
+    ''' Create a new category '''
+    current_app.logger.info('Request to create a category')
+    args = create_category_validator(request)
+    name = args['name']
+    try:
+      category = CategoryDao.create(**args)
+    except DuplicateKeyError as e:
+      current_app.logger.error(e.args[0])
+      abort(400, message='Category {} is already registered'.format(name))
+    except Exception as e:
+      current_app.logger.error(e.args[0])
+      abort(500, message='Cannot complete the operation')
+    current_app.logger.info('Category "{}" was saved in database'.format(name))
+    return marshal(dict(category, products=0, in_cart=0), category_fields), 201
+
+
+class Stats(Resource):
+
+  def get(self):
+    ''' Return how often the products are bought, from the daily or weekly rollups of the purchases '''
+    current_app.logger.info('Request to retrieve the purchase statistics')
+    args = stats_validator(request)
+    try:
+      stats = purchase_stats(args['name'], args['period'], args['buckets'])
+    except Exception as e:
+      current_app.logger.error(e.args)
+      abort(500, message='Cannot complete the operation')
+    return stats, 200
+
+
+class Suggestions(Resource):
+
+  def get(self):
+    ''' Return the products frequently bought together with the products of the shopping cart (or the given ones) '''
+    current_app.logger.info('Request to suggest products')
+    args = suggestions_validator(request)
+    limit = args['limit']
+    try:
+      names = args.get('names')
+      if names is None:
+        names = [product['name'] for product in ProductDao.find_all({ 'shopping_cart': True })]
+      # Some candidates might have been deleted from the catalog since they were bought
+      candidates = suggestions.suggest(names, limit * 2)
+      found = ProductDao.find_many([name for name, _ in candidates]) if candidates else {}
+    except Exception as e:
+      current_app.logger.error(e.args)
+      abort(500, message='Cannot complete the operation')
+    return [{ 'name': name, 'trips': trips } for name, trips in candidates if name in found][:limit], 200
+
+
+class Metrics(Resource):
+
+  def get(self):
+    ''' Return the runtime metrics of the service '''
+    return { 'single_flight': single_flight.stats() }, 200
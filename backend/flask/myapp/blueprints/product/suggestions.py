@@ -0,0 +1,263 @@
+
+"""Suggestions of products frequently bought together, from a sparse co-occurrence matrix of the purchases."""
+
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+import numpy as np
+from scipy import sparse
+from flask import current_app
+from myapp.extensions import warmup
+from myapp.blueprints.product.models import Product as ProductDao, PurchaseEvent
+from myapp.tenancy import current_tenant
+
+
+logger = logging.getLogger(__name__)
+
+# Products bought on the same day by a tenant (a shopping trip) have been bought together. The number of trips in
+# which two products were bought together is kept in a sparse co-occurrence matrix indexed by product, and the
+# suggestions for a cart are the products with the highest sum of co-occurrences with the products of the cart:
+# the rows of the cart are summed in one vectorized operation and the best products are selected with a partial
+# sort, so a suggestion costs the same whatever the number of purchases.
+# The matrix of a tenant is built from its purchase events of the last SUGGESTIONS_HISTORY_DAYS days, updated
+# incrementally with the purchases of the worker (products leaving the cart), and rebuilt in the background every
+# SUGGESTIONS_REFRESH seconds to include the purchases of the other workers. Memory is bounded: at most
+# SUGGESTIONS_MAX_PRODUCTS products and SUGGESTIONS_MAX_PAIRS non-zero counts per tenant (the counts are halved when
+# the matrix is full, which also favours the recent purchases) and SUGGESTIONS_MAX_TENANTS tenants per worker.
+# The products of a full matrix are not replaced: the products bought for the first time after the matrix is built
+# are neither counted nor suggested until the next rebuild, which keeps the products bought the most often (and
+# logs a warning).
+# A matrix is never modified once built (the merges and the halvings build a new one), so the suggestions are scored
+# without holding the lock shared by the tenants: only the references to the matrix and the pending increments of
+# the cart are taken under the lock.
+
+class CoOccurrence(object):
+  ''' Sparse co-occurrence counts of the products of a tenant '''
+
+  # Number of pending increments merged into the matrix at once
+  MERGE_EVERY = 10000
+
+  def __init__(self, max_products, max_pairs):
+    self.max_products = max_products
+    self.max_pairs = max_pairs
+    self.index = {}
+    self.names = []
+    self.matrix = sparse.csr_matrix((max_products, max_products), dtype=np.int32)
+    # Increments not merged into the matrix yet: row -> Counter(column -> count)
+    self.pending = {}
+    self.pending_count = 0
+    # Products bought by the tenant on the current day
+    self.trip_day = None
+    self.trip = set()
+    self.built_at = time.monotonic()
+    self.full = False
+
+  def product(self, name, add=True):
+    ''' Return the index of a product, None if it's unknown (or if there is no room for it) '''
+    i = self.index.get(name)
+    if i is None and add:
+      if len(self.names) < self.max_products:
+        i = self.index[name] = len(self.names)
+        self.names.append(name)
+      elif not self.full:
+        # Logged once per matrix, the products are dropped until the next rebuild
+        self.full = True
+        logger.warning('The suggestions matrix is full ({} products), the new products are not counted '
+                       'until it is rebuilt'.format(self.max_products))
+    return i
+
+  def build(self, purchases):
+    '''
+    Build the matrix from purchases
+    :param purchases: list of (name, day) tuples
+    '''
+    # When there are more products than the matrix holds, the products bought the most often are indexed first so
+    # they are the ones kept
+    counts = Counter(name for name, _ in purchases)
+    if len(counts) > self.max_products:
+      for name, _ in counts.most_common(self.max_products):
+        self.product(name)
+    bought = [(self.product(name), day.toordinal()) for name, day in purchases]
+    bought = [(i, day) for i, day in bought if i is not None]
+    if bought:
+      products, days = np.array(bought, dtype=np.int64).T
+      # Incidence matrix trips x products (1 if the product was bought during the trip), then the co-occurrences
+      # of every pair of products are the product of the incidence matrix by its transpose
+      trips = np.unique(days, return_inverse=True)[1]
+      incidence = sparse.csr_matrix((np.ones(len(products), dtype=np.int32), (trips, products)),
+                                    shape=(trips.max() + 1, self.max_products))
+      incidence.data[:] = 1
+      matrix = (incidence.T @ incidence).tocsr()
+      # A product is not bought together with itself
+      matrix = matrix - sparse.diags(matrix.diagonal(), format='csr', dtype=matrix.dtype)
+      matrix.eliminate_zeros()
+      self.matrix = self._bound(matrix.astype(np.int32))
+    today = datetime.utcnow().date()
+    self.trip_day = today
+    self.trip = { name for name, day in purchases if day == today and name in self.index }
+
+  def add_purchase(self, name, day):
+    ''' Count a purchase together with the products already bought during the same trip '''
+    if day != self.trip_day:
+      self.trip_day = day
+      self.trip = set()
+    i = self.product(name)
+    if i is None or name in self.trip:
+      return
+    for other in self.trip:
+      j = self.index[other]
+      self.pending.setdefault(i, Counter())[j] += 1
+      self.pending.setdefault(j, Counter())[i] += 1
+      self.pending_count += 2
+    self.trip.add(name)
+    if self.pending_count >= self.MERGE_EVERY:
+      self.merge()
+
+  def merge(self):
+    ''' Merge the pending increments into the matrix '''
+    if not self.pending:
+      return
+    rows, columns, counts = [], [], []
+    for i, row in self.pending.items():
+      for j, count in row.items():
+        rows.append(i)
+        columns.append(j)
+        counts.append(count)
+    increments = sparse.csr_matrix((np.array(counts, dtype=np.int32), (rows, columns)), shape=self.matrix.shape)
+    self.matrix = self._bound(self.matrix + increments)
+    self.pending = {}
+    self.pending_count = 0
+
+  def _bound(self, matrix):
+    # The counts of a new matrix are halved until it fits in its budget, the pairs bought together once are dropped
+    # first
+    while matrix.nnz > self.max_pairs:
+      matrix.data >>= 1
+      matrix.eliminate_zeros()
+    return matrix
+
+  def view(self, names):
+    '''
+    Return what the suggestions for the given products are scored from, to score them outside of the lock
+    :return: (rows of the products, matrix, number of products, pending increments of the rows as (column, count))
+    '''
+    rows = [i for i in (self.product(name, add=False) for name in names) if i is not None]
+    increments = [(j, count) for i in rows for j, count in self.pending.get(i, {}).items()]
+    return rows, self.matrix, len(self.names), increments
+
+  def score(self, view, limit):
+    '''
+    Return the products most often bought together with the products of a view
+    :return: list of (name, number of trips) tuples, best first
+    '''
+    rows, matrix, size, increments = view
+    if not rows:
+      return []
+    scores = np.asarray(matrix[rows].sum(axis=0)).ravel()[:size]
+    for j, count in increments:
+      scores[j] += count
+    scores[rows] = 0
+    limit = min(limit, len(scores))
+    best = np.argpartition(-scores, limit - 1)[:limit]
+    # Best first, the ties in the order the products were first bought
+    best = best[np.lexsort((best, -scores[best]))]
+    # The names are only appended, the first size names are those of the view
+    return [(self.names[i], int(scores[i])) for i in best if scores[i] > 0]
+
+  def suggest(self, names, limit):
+    ''' Return the products most often bought together with the given products '''
+    return self.score(self.view(names), limit)
+
+  def memory(self):
+    ''' Return the number of bytes used by the matrix '''
+    return self.matrix.data.nbytes + self.matrix.indices.nbytes + self.matrix.indptr.nbytes
+
+
+class Suggestions(object):
+  ''' Co-occurrence matrices of the tenants of the worker '''
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._tenants = OrderedDict()
+    self._refreshing = set()
+
+  def clear(self):
+    with self._lock:
+      self._tenants.clear()
+
+  def load(self, tenant):
+    ''' Build the co-occurrence matrix of a tenant from its purchase events '''
+    config = current_app.config
+    since = datetime.utcnow() - timedelta(days=config['SUGGESTIONS_HISTORY_DAYS'])
+    events = PurchaseEvent.query.filter(PurchaseEvent.tenant_id == tenant, PurchaseEvent.purchased_at >= since) \
+      .with_entities(PurchaseEvent.name, PurchaseEvent.purchased_at)
+    model = CoOccurrence(config['SUGGESTIONS_MAX_PRODUCTS'], config['SUGGESTIONS_MAX_PAIRS'])
+    model.build([(name, purchased_at.date()) for name, purchased_at in events])
+    return model
+
+  def model(self, tenant):
+    ''' Return the co-occurrence matrix of a tenant, built on first use and refreshed in the background '''
+    with self._lock:
+      model = self._tenants.get(tenant)
+      if model is not None:
+        self._tenants.move_to_end(tenant)
+    if model is None:
+      model = self.load(tenant)
+      self._store(tenant, model)
+    elif time.monotonic() - model.built_at > current_app.config['SUGGESTIONS_REFRESH']:
+      self._refresh(tenant)
+    return model
+
+  def _store(self, tenant, model):
+    with self._lock:
+      self._tenants[tenant] = model
+      self._tenants.move_to_end(tenant)
+      while len(self._tenants) > current_app.config['SUGGESTIONS_MAX_TENANTS']:
+        self._tenants.popitem(last=False)
+
+  def _refresh(self, tenant):
+    # The stale matrix keeps serving while the new one is built
+    with self._lock:
+      if tenant in self._refreshing:
+        return
+      self._refreshing.add(tenant)
+    app = current_app._get_current_object()
+    def refresh():
+      try:
+        with app.app_context():
+          self._store(tenant, self.load(tenant))
+      finally:
+        with self._lock:
+          self._refreshing.discard(tenant)
+    threading.Thread(target=refresh, name='suggestions-refresh', daemon=True).start()
+
+  def record(self, name, day):
+    ''' Count a purchase of the current tenant in its co-occurrence matrix, if it's loaded in the worker '''
+    with self._lock:
+      model = self._tenants.get(current_tenant())
+      if model is not None:
+        model.add_purchase(name, day)
+
+  def suggest(self, names, limit):
+    ''' Return the products most often bought together with the given products, for the current tenant '''
+    model = self.model(current_tenant())
+    with self._lock:
+      view = model.view(names)
+    return model.score(view, limit)
+
+
+suggestions = Suggestions()
+
+@ProductDao.on_commit
+def record_suggestions(operation, product, changes):
+  ''' Count a purchase when a product leaves the shopping cart '''
+  if operation == 'update' and changes.get('shopping_cart') is False:
+    suggestions.record(product['name'], datetime.utcnow().date())
+
+@warmup.task
+def warm_up_suggestions(app):
+  ''' Build the co-occurrence matrix of the default tenant before the worker accepts traffic '''
+  with app.test_request_context():
+    suggestions.model(current_tenant())
@@ -13,15 +13,24 @@
 from flask import Blueprint, render_template, abort, request, redirect, flash, url_for
 from myapp.blueprints.product.models import Product as ProductDao
 from myapp.blueprints.product.forms import ProductForm
+from myapp.blueprints.product.resources import cart_snapshot
+from myapp.blueprints.product.categories import facets_by_aisle
+from myapp.extensions import single_flight
+from myapp.tenancy import authorize_tenant, current_tenant
 
 #Instantiate blueprint 
 bp = Blueprint('products', __name__, url_prefix='/products')
+# The pages are not authenticated, they only accept the tenant header of a trusted proxy (TENANT_HEADER_TRUSTED)
+bp.before_request(authorize_tenant)
 
 
 @bp.route('/')
 def list():
-  products = ProductDao.find_all()
-  return render_template('list.html', title='Products', products=products, description='Products Catalog')  
+  # The catalog can be narrowed to a category, the categories are listed with their counts (facets)
+  category = request.args.get('category', type=int)
+  products = ProductDao.find_all({ 'category_id': category } if category is not None else None)
+  return render_template('list.html', title='Products', products=products, description='Products Catalog',
+                         aisles=facets_by_aisle(), category=category)
 
 # Any view using FlaskForm to process the request is already getting CSRF protection
 @bp.route('/create/', methods = ['GET', 'POST'])
@@ -37,6 +46,11 @@ def create():
 
 @bp.route('/shop/')
 def shop():
+  # The table of the shopping cart is already rendered in its snapshot
+  if cart_snapshot.enabled:
+    return render_template('list.html', title='Shop', products_table=cart_snapshot.html(),
+                           description='Shopping Cart')
   filter = { 'shopping_cart': True }
-  products = ProductDao.find_all(filter)
+  # Concurrent requests to the shopping cart share the same query
+  products = single_flight.do(('find_all', current_tenant(), 'shop'), ProductDao.find_all, filter)
   return render_template('list.html', title='Shop', products=products, description='Shopping Cart')   
\ No newline at end of file
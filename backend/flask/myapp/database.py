@@ -1,7 +1,9 @@
 
 """Database module, including the SQLAlchemy database object and DB-related utilities."""
 
-from myapp.extensions import db
+from myapp.extensions import db, sqlite_tuning
+from myapp.tenancy import current_tenant
+from sqlalchemy import event
 from sqlalchemy.inspection import inspect
 
 
@@ -20,38 +22,141 @@ class Serializer(object):
     return [m.serialize() for m in l]
 
 
+# Key of the statements staged in the info of the session until its commit (see CRUDMixin.before_commit)
+STAGED = 'staged_statements'
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_staged(session, previous_transaction):
+  # The statements staged with the changes rolled back are discarded with them
+  session.info.pop(STAGED, None)
+
+
 class CRUDMixin(Serializer):
   """ Mixin that adds convenience methods for CRUD (create, read, update, delete) operations."""
 
+  # Listeners of the committed CRUD operations, by model class
+  _commit_listeners = {}
+  # Listeners of the CRUD operations before their commit, by model class
+  _write_listeners = {}
+  # Name of the column holding the tenant of the records, None if the model is not multi-tenant
+  __tenant_key__ = None
+
   # Returns a class method for the given function. A class method is a method that is bound to a class rather
   # than its object. It doesn't require creation of a class instance, much like @staticmethod.
   # Unlike @staticmethod, Class method works with the class since its parameter is always the class itself.
   @classmethod
   def create(cls, **kwargs):
     """Create a new record and save it the database."""
+    if cls.__tenant_key__ is not None:
+      kwargs.setdefault(cls.__tenant_key__, current_tenant())
     instance = cls(**kwargs)
-    return instance.save().serialize()
+    db.session.add(instance)
+    cls.stage('create', None, instance.serialize())
+    data = instance.save().serialize()
+    instance.notify('create', data, data)
+    return data
+
+  @classmethod
+  def scoped_query(cls):
+    """Query restricted to the records of the current tenant."""
+    # Multi-tenant tables are partitioned by tenant, filtering by the partition key lets the database prune the
+    # partitions of the other tenants (plan time for literal values, execution time for bound parameters) instead
+    # of probing the index of every partition
+    if cls.__tenant_key__ is None:
+      return cls.query
+    return cls.query.filter_by(**{ cls.__tenant_key__: current_tenant() })
 
   def update(self, commit=True, **kwargs):
     """Update specific fields of a record."""
+    changes = {attr: value for attr, value in kwargs.items() if getattr(self, attr, None) != value}
+    old = self.serialize() if changes else None
     for attr, value in kwargs.items():
       setattr(self, attr, value)
-    return commit and self.save() or self
+    if changes:
+      self.stage('update', old, self.serialize())
+    if not commit:
+      return self
+    # The data is taken before the commit, afterwards the attributes of the record are expired
+    data = self.serialize()
+    self.save()
+    self.notify('update', data, changes)
+    return self
 
   def save(self, commit=True):
     """Save the record."""
     db.session.add(self)
     if commit:
-      db.session.commit()
+      self.commit()
     return self
 
   def delete(self, commit=True):
     """Remove the record from the database."""
+    data = self.serialize()
     db.session.delete(self)
+    self.stage('delete', data, None)
     if commit:
-      db.session.commit()
+      self.commit()
+      self.notify('delete', data, {})
     return self
 
+  @staticmethod
+  def commit():
+    """Commit the session, rolling it back if the commit fails (ie. a version conflict) so it remains usable."""
+    # The pending changes are flushed by the commit and the staged statements run right before it, so the write
+    # transaction runs entirely under the writer lock (SQLite databases with SQLITE_SERIALIZE_WRITES, no lock
+    # otherwise)
+    with sqlite_tuning.writer():
+      try:
+        for statement in db.session.info.pop(STAGED, []):
+          statement()
+        db.session.commit()
+      except Exception:
+        db.session.rollback()
+        raise
+
+  # Commit listeners
+  # Other components of the application can keep derived data (ie. precomputed views of a table) up to date
+  # by listening to the operations committed through this mixin, instead of querying the table again.
+  # A listener is called with the name of the operation ('create', 'update' or 'delete'), the serialized record
+  # and the dict of fields changed by the operation.
+  @classmethod
+  def on_commit(cls, listener):
+    """Register a function to call after each committed operation on the records of this model."""
+    CRUDMixin._commit_listeners.setdefault(cls, []).append(listener)
+    return listener
+
+  @classmethod
+  def notify(cls, operation, data, changes):
+    """Call the listeners of the model with a committed operation."""
+    for listener in CRUDMixin._commit_listeners.get(cls, []):
+      listener(operation, data, changes)
+
+  # Write listeners
+  # Derived data stored in the same database (ie. counters of a table) is updated by listeners called with the
+  # operation before it's committed, so the derived data is committed in the same transaction as the record: both
+  # are written or neither is. A listener is called with the name of the operation and the serialized record before
+  # and after the operation (None when the record doesn't exist), it adds its changes to the session.
+  @classmethod
+  def on_write(cls, listener):
+    """Register a function to call with each operation on the records of this model, in its transaction."""
+    CRUDMixin._write_listeners.setdefault(cls, []).append(listener)
+    return listener
+
+  @classmethod
+  def stage(cls, operation, old, new):
+    """Stage the calls of the write listeners of the model with an operation, return False if it has no listener."""
+    listeners = CRUDMixin._write_listeners.get(cls, [])
+    for listener in listeners:
+      cls.before_commit(lambda listener=listener: listener(operation, old, new))
+    return bool(listeners)
+
+  @staticmethod
+  def before_commit(statement):
+    """Run a function adding changes to the session (ie. executing statements) when the session is committed."""
+    # The statements that execute right away (ie. Query.update, flush) must not run before the commit: they would
+    # start the write transaction outside of the writer lock. They run in the order they are staged, in commit().
+    db.session.info.setdefault(STAGED, []).append(statement)
+
 
 class Model(CRUDMixin, db.Model):
   """Base model class that includes CRUD convenience methods."""
@@ -2,6 +2,12 @@
 
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from myapp.singleflight import SingleFlight
+from myapp.profiling import RequestProfiler
+from myapp.storage import Storage
+from myapp.sqlite import SQLiteTuning
+from myapp.warmup import Warmup
+from myapp.auth import TokenAuth
 
   
 # This extension provides a wrapper for the SQLAlchemy project, which is an Object Relational Mapper or ORM.
@@ -11,3 +17,15 @@ from flask_migrate import Migrate
 db = SQLAlchemy()
 # Flask-Migrate is an extension that handles SQLAlchemy database migrations for Flask applications using Alembic
 migrate = Migrate()
+# Pragmas of the SQLite connections (WAL, mmap, busy timeout...) and writer lock of the SQLite databases
+sqlite_tuning = SQLiteTuning(db)
+# Collapses identical concurrent reads (same query, same encoded response) into a single execution
+single_flight = SingleFlight()
+# Sampling profiler attached to a fraction of the requests, disabled by default
+profiler = RequestProfiler()
+# Storage engine behind the DAO of the models (SQL by default, or in memory)
+storage = Storage()
+# Warmup of the workers before they accept traffic, and their liveness/readiness endpoints
+warmup = Warmup(db)
+# Bearer token authentication of the API, disabled by default (AUTH_ENABLED)
+auth = TokenAuth(db)
@@ -0,0 +1,189 @@
+
+"""Online migrations module, helpers for the migrations changing large tables while the service keeps writing."""
+
+import logging
+import time
+import sqlalchemy as sa
+from alembic import op
+from flask import current_app
+from sqlalchemy.exc import OperationalError
+
+
+logger = logging.getLogger('alembic.online')
+
+# SQLSTATE of PostgreSQL when a lock is not granted within the lock timeout
+LOCK_NOT_AVAILABLE = '55P03'
+
+
+# A plain migration holds its locks until the end of its transaction: CREATE INDEX blocks the writes on the table
+# for the whole build, an UPDATE of every row locks all of them until the commit, and a DDL statement waiting for a
+# lock (ie. behind a long running query) blocks every query queued after it. These helpers are called from the
+# migration scripts instead of the plain operations of alembic:
+# - create_index_concurrently/drop_index_concurrently build and drop the indexes without blocking the writes
+#   (PostgreSQL CONCURRENTLY, outside of a transaction)
+# - backfill updates the rows in small batches committed one by one, with a pause between the batches
+# - with_lock_timeout gives up on a lock after a short time and retries, instead of queueing the traffic behind it
+# The statements are run outside of the migration transaction, so the migrations using them must be run with one
+# transaction per migration (MIGRATIONS_TRANSACTION_PER_MIGRATION, see migrations/env.py). On other databases the
+# helpers fall back to the plain operations.
+
+def is_postgresql():
+  return op.get_bind().dialect.name == 'postgresql'
+
+def in_autocommit():
+  return op.get_bind().get_execution_options().get('isolation_level') == 'AUTOCOMMIT'
+
+def config(name, default):
+  return current_app.config.get(name, default) if current_app else default
+
+
+def with_lock_timeout(operation, timeout=None, attempts=None, backoff=None):
+  '''
+  Run a statement that needs a lock on a busy table, giving up on the lock after a timeout and retrying
+  :param operation: function running the statement(s)
+  :param timeout: lock timeout in milliseconds (MIGRATIONS_LOCK_TIMEOUT)
+  :param attempts: number of attempts before the error is raised (MIGRATIONS_LOCK_ATTEMPTS)
+  :param backoff: seconds to wait before the second attempt, doubled on each attempt (MIGRATIONS_LOCK_BACKOFF)
+  '''
+  if not is_postgresql():
+    return operation()
+  timeout = timeout if timeout is not None else config('MIGRATIONS_LOCK_TIMEOUT', 2000)
+  attempts = attempts if attempts is not None else config('MIGRATIONS_LOCK_ATTEMPTS', 5)
+  backoff = backoff if backoff is not None else config('MIGRATIONS_LOCK_BACKOFF', 1)
+  bind = op.get_bind()
+  for attempt in range(1, attempts + 1):
+    try:
+      if in_autocommit():
+        bind.execute(sa.text('SET lock_timeout = {:d}'.format(timeout)))
+        try:
+          return operation()
+        finally:
+          bind.execute(sa.text('RESET lock_timeout'))
+      # In a transaction the failed statement is rolled back to a savepoint, which also reverts the SET
+      with bind.begin_nested():
+        bind.execute(sa.text('SET LOCAL lock_timeout = {:d}'.format(timeout)))
+        result = operation()
+        bind.execute(sa.text('RESET lock_timeout'))
+        return result
+    except OperationalError as e:
+      if getattr(e.orig, 'pgcode', None) != LOCK_NOT_AVAILABLE or attempt == attempts:
+        raise
+      logger.warning('Lock not available (attempt {}/{}), retrying'.format(attempt, attempts))
+      time.sleep(backoff * 2 ** (attempt - 1))
+
+
+def partitions_of(table_name):
+  ''' Return the names of the partitions of a partitioned table, empty if the table is not partitioned '''
+  rows = op.get_bind().execute(sa.text("""
+    SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = CAST(:table_name AS regclass) ORDER BY c.relname
+  """), { 'table_name': table_name })
+  return [row[0] for row in rows]
+
+def drop_invalid_index(index_name):
+  ''' Drop an index left invalid by a concurrent build that failed (it's maintained by the writes but never used) '''
+  invalid = op.get_bind().execute(sa.text("""
+    SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE c.relname = :index_name AND NOT i.indisvalid AND c.relkind = 'i'
+  """), { 'index_name': index_name }).first()
+  if invalid is not None:
+    build_concurrently('DROP INDEX CONCURRENTLY IF EXISTS {}'.format(index_name))
+
+
+def build_concurrently(statement):
+  ''' Run a CONCURRENTLY statement without lock timeout '''
+  # A concurrent build waits for the transactions already using the table, but it doesn't block the writes
+  # meanwhile, so the lock timeout of the migrations doesn't apply to it
+  op.execute('SET lock_timeout = 0')
+  try:
+    op.execute(statement)
+  finally:
+    op.execute('RESET lock_timeout')
+
+def create_index_concurrently(index_name, table_name, columns, unique=False):
+  '''
+  Create an index without blocking the writes on the table (PostgreSQL), a plain index on other databases
+  The index is only created if it doesn't exist, so a migration interrupted during the build can be run again
+  '''
+  if not is_postgresql():
+    op.create_index(index_name, table_name, columns, unique=unique)
+    return
+  unique = 'UNIQUE ' if unique else ''
+  columns = ', '.join(columns)
+  with op.get_context().autocommit_block():
+    partitions = partitions_of(table_name)
+    if not partitions:
+      drop_invalid_index(index_name)
+      build_concurrently('CREATE {}INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({})'.format(
+        unique, index_name, table_name, columns))
+      return
+    # CONCURRENTLY is not supported on partitioned tables: the index of the parent table is created (invalid) on
+    # the parent only, then each partition is indexed concurrently and its index attached to the parent index,
+    # which becomes valid when the index of the last partition is attached
+    with_lock_timeout(lambda: op.execute('CREATE {}INDEX IF NOT EXISTS {} ON ONLY {} ({})'.format(
+      unique, index_name, table_name, columns)))
+    for partition in partitions:
+      partition_index = '{}_{}'.format(index_name, partition)
+      drop_invalid_index(partition_index)
+      build_concurrently('CREATE {}INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({})'.format(
+        unique, partition_index, partition, columns))
+      attach = 'ALTER INDEX {} ATTACH PARTITION {}'.format(index_name, partition_index)
+      with_lock_timeout(lambda: op.execute(attach))
+
+def drop_index_concurrently(index_name, table_name):
+  ''' Drop an index without blocking the writes on the table (PostgreSQL), a plain drop on other databases '''
+  if not is_postgresql():
+    op.drop_index(index_name, table_name=table_name)
+    return
+  with op.get_context().autocommit_block():
+    if partitions_of(table_name):
+      # The index of a partitioned table can't be dropped concurrently, dropping it drops the partition indexes
+      with_lock_timeout(lambda: op.execute('DROP INDEX IF EXISTS {}'.format(index_name)))
+    else:
+      build_concurrently('DROP INDEX CONCURRENTLY IF EXISTS {}'.format(index_name))
+
+
+def backfill(table_name, values, where=None, batch_size=None, pause=None, progress=None):
+  '''
+  Update the rows of a table in batches, each batch in its own transaction
+  :param table_name: name of the table
+  :param values: new values by column name (values or SQL expressions)
+  :param where: SQL condition selecting the rows to update (ie. "category_id IS NULL"), all the rows if None
+  :param batch_size: number of rows per batch (MIGRATIONS_BACKFILL_BATCH_SIZE)
+  :param pause: seconds to sleep between two batches, so the replication and the traffic keep up
+                (MIGRATIONS_BACKFILL_PAUSE)
+  :param progress: function called after each batch with the number of rows updated so far and the total
+  :return: number of rows updated
+  '''
+  batch_size = batch_size or config('MIGRATIONS_BACKFILL_BATCH_SIZE', 1000)
+  pause = pause if pause is not None else config('MIGRATIONS_BACKFILL_PAUSE', 0.1)
+  bind = op.get_bind()
+  table = sa.Table(table_name, sa.MetaData(), autoload_with=bind)
+  keys = list(table.primary_key.columns)
+  condition = sa.text(where) if where is not None else sa.true()
+  total = bind.execute(sa.select([sa.func.count()]).select_from(table).where(condition)).scalar()
+  updated = 0
+  last = None
+  started = time.perf_counter()
+  with op.get_context().autocommit_block():
+    while True:
+      # Keyset pagination on the primary key: each batch is a range of keys, the rows are locked for one batch only
+      batch = sa.select(keys).where(condition).order_by(*keys).limit(batch_size)
+      if last is not None:
+        batch = batch.where(sa.tuple_(*keys) > sa.tuple_(*last))
+      rows = bind.execute(batch).fetchall()
+      if not rows:
+        break
+      in_batch = sa.tuple_(*keys) <= sa.tuple_(*rows[-1])
+      if last is not None:
+        in_batch = sa.and_(sa.tuple_(*keys) > sa.tuple_(*last), in_batch)
+      updated += bind.execute(table.update().where(sa.and_(in_batch, condition)).values(**values)).rowcount
+      last = tuple(rows[-1])
+      logger.info('Backfill of {}: {}/{} rows ({:.0f} rows/s)'.format(
+        table_name, updated, total, updated / max(time.perf_counter() - started, 1e-6)))
+      if progress is not None:
+        progress(updated, total)
+      if len(rows) < batch_size:
+        break
+      time.sleep(pause)
+  return updated
@@ -0,0 +1,135 @@
+
+"""Profiling module, sampling the call stacks of a fraction of the requests into flamegraph collapsed stacks."""
+
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+import click
+from flask import request, current_app
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+
+# When latency regresses in production we need to know where the time goes inside the request pipeline (argument
+# parsing, DAO query, serialization, marshalling, template rendering). A background thread samples the call stack
+# of the threads handling the profiled requests at a fixed interval, and the stacks are aggregated in memory in the
+# collapsed format used by flamegraph tools (frames separated by ';' followed by the number of samples):
+#   GET /api/v1//products;dispatch_request (app.py:1936);get (resources.py:211);find_all (models.py:42) 17
+# Requests are profiled 1 in PROFILING_SAMPLE_RATE, or when they carry a valid signed token in the
+# PROFILING_HEADER header. When PROFILING_ENABLED is not set no hook is registered, so there is no overhead at all.
+class RequestProfiler(object):
+  ''' Extension profiling a sample of the requests with a sampling profiler '''
+
+  def __init__(self, app=None):
+    self._lock = threading.Lock()
+    # Threads handling a profiled request: thread id -> root frame of the collapsed stacks (the request line)
+    self._active = {}
+    self._stacks = Counter()
+    self._sampler = None
+    self._requests = itertools.count()
+    self.enabled = False
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.extensions['profiler'] = self
+    self.enabled = app.config.get('PROFILING_ENABLED', False)
+    if not self.enabled:
+      return
+    self.sample_rate = app.config.get('PROFILING_SAMPLE_RATE', 0)
+    self.interval = app.config.get('PROFILING_INTERVAL', 0.001)
+    self.max_stacks = app.config.get('PROFILING_MAX_STACKS', 10000)
+    self.header = app.config.get('PROFILING_HEADER', 'X-Profile')
+    # The tokens must be verifiable by every worker and by the command line, so they are signed with a key
+    # shared through the environment. The secret key of the app is random per process, it can't replace it.
+    secret_key = app.config.get('PROFILING_SECRET_KEY')
+    if not secret_key:
+      raise RuntimeError('PROFILING_ENABLED requires PROFILING_SECRET_KEY')
+    self.serializer = URLSafeTimedSerializer(secret_key, salt='profiling')
+    app.before_request(self._start)
+    app.teardown_request(self._stop)
+    app.add_url_rule(app.config['URL_PREFIX_API'] + 'admin/profile', 'admin_profile', self.view,
+                     methods=['GET', 'DELETE'])
+
+    # Command to generate a token: flask profiling-token
+    @app.cli.command('profiling-token')
+    def profiling_token():
+      ''' Print a signed token to profile requests and read the profile '''
+      click.echo(self.token())
+
+  def token(self):
+    ''' Return a signed token to profile a request or to read the profile '''
+    return self.serializer.dumps('profile')
+
+  def stacks(self):
+    ''' Return the collapsed stacks sampled so far, one stack per line '''
+    with self._lock:
+      return ''.join('{} {}\n'.format(stack, count) for stack, count in sorted(self._stacks.items()))
+
+  def reset(self):
+    ''' Forget the stacks sampled so far '''
+    with self._lock:
+      self._stacks.clear()
+
+  def view(self):
+    ''' Admin endpoint: GET returns the collapsed stacks, DELETE resets them. Requires a signed token. '''
+    if not self._signed():
+      return 'Forbidden', 403
+    if request.method == 'DELETE':
+      self.reset()
+      return '', 204
+    return current_app.response_class(self.stacks(), 200, mimetype='text/plain')
+
+  def _signed(self):
+    token = request.headers.get(self.header)
+    if token is None:
+      return False
+    try:
+      self.serializer.loads(token, max_age=current_app.config.get('PROFILING_TOKEN_MAX_AGE', 86400))
+    except BadSignature:
+      return False
+    return True
+
+  def _start(self):
+    sampled = self.sample_rate and next(self._requests) % self.sample_rate == 0
+    if not (sampled or self._signed()):
+      return
+    with self._lock:
+      # The rule (ie. /api/v1/products/<string:name>) keeps the number of distinct stacks bounded
+      path = request.url_rule.rule if request.url_rule is not None else request.path
+      self._active[threading.get_ident()] = '{} {}'.format(request.method, path)
+      if self._sampler is None or not self._sampler.is_alive():
+        self._sampler = threading.Thread(target=self._sample, name='request-profiler', daemon=True)
+        self._sampler.start()
+
+  def _stop(self, exc=None):
+    with self._lock:
+      self._active.pop(threading.get_ident(), None)
+
+  def _sample(self):
+    # The sampler stops when no request is being profiled, the next profiled request starts it again
+    while True:
+      frames = sys._current_frames()
+      with self._lock:
+        if not self._active:
+          self._sampler = None
+          return
+        for thread_id, root in self._active.items():
+          frame = frames.get(thread_id)
+          if frame is not None:
+            self._add(root, frame)
+      time.sleep(self.interval)
+
+  def _add(self, root, frame):
+    stack = []
+    while frame is not None:
+      code = frame.f_code
+      stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+      frame = frame.f_back
+    stack.append(root)
+    collapsed = ';'.join(reversed(stack))
+    if collapsed not in self._stacks and len(self._stacks) >= self.max_stacks:
+      collapsed = root + ';[truncated]'
+    self._stacks[collapsed] += 1
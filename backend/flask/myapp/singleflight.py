@@ -0,0 +1,87 @@
+
+"""Single-flight module, collapsing identical concurrent calls into one execution of the same function."""
+
+import threading
+
+
+# During traffic spikes many requests ask for exactly the same data at the same time (ie. the shopping cart).
+# Instead of running the same query and serialization for each of them, the first request (the leader) executes
+# the function and the requests arriving while it's still running (the followers) wait for it and share its
+# result. Nothing is cached: as soon as the leader finishes the key is forgotten, so the next request triggers a
+# fresh execution and the data served is never older than the data of a request running in parallel.
+class _Call(object):
+  ''' In-flight execution of a function shared by the leader and its followers '''
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+
+class SingleFlight(object):
+  ''' Extension collapsing concurrent calls with the same key into a single execution '''
+
+  def __init__(self, app=None):
+    self._lock = threading.Lock()
+    self._calls = {}
+    self.enabled = True
+    self.timeout = None
+    # Metrics
+    self.requests = 0
+    self.executions = 0
+    self.collapsed = 0
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    # Every worker thread handling a request shares the same extension object, so the collapsing happens across
+    # the threads of a worker process when the server is threaded (or greenlets when it's monkey patched)
+    self.enabled = app.config.get('SINGLE_FLIGHT_ENABLED', True)
+    # Maximum number of seconds a follower waits for the leader before running the function by itself
+    self.timeout = app.config.get('SINGLE_FLIGHT_TIMEOUT', None)
+    app.extensions['single_flight'] = self
+
+  def do(self, key, fn, *args, **kwargs):
+    '''
+    Execute fn(*args, **kwargs), or wait for the result of the execution already in flight for the same key
+    :param key: hashable value identifying the call, identical calls must have the same key
+    :param fn: function to execute
+    '''
+    if not self.enabled:
+      return fn(*args, **kwargs)
+    with self._lock:
+      self.requests += 1
+      call = self._calls.get(key)
+      leader = call is None
+      if leader:
+        call = self._calls[key] = _Call()
+        self.executions += 1
+      else:
+        self.collapsed += 1
+    if not leader:
+      if call.done.wait(self.timeout):
+        if call.error is not None:
+          raise call.error
+        return call.result
+      # The leader is taking too long, don't let the follower hang with it
+      return fn(*args, **kwargs)
+    try:
+      call.result = fn(*args, **kwargs)
+      return call.result
+    except Exception as e:
+      call.error = e
+      raise
+    finally:
+      with self._lock:
+        del self._calls[key]
+      call.done.set()
+
+  def stats(self):
+    ''' Return the counters of the collapsed calls '''
+    with self._lock:
+      return {
+        'requests': self.requests,
+        'executions': self.executions,
+        'collapsed': self.collapsed,
+        'in_flight': len(self._calls)
+      }
@@ -0,0 +1,191 @@
+
+"""Snapshot module, keeping a pre-encoded view of a set of records in a memory-mapped file shared by the workers."""
+
+import fcntl
+import mmap
+import os
+import struct
+import time
+import uuid
+from contextlib import contextmanager
+from json import dumps, loads
+from flask import current_app
+from markupsafe import Markup
+
+
+# File layout: the epoch of the snapshot (16 bytes), the time it was built from the database (seconds since the epoch,
+# a double), the length of the versions of the records and the length of the JSON body (8 bytes each, big endian),
+# the versions of the records (JSON), the JSON body and the rendered HTML
+HEADER = struct.Struct('>16sdQQ')
+
+
+# Some views are read far more often than they are written (ie. the shopping cart). Instead of querying and
+# encoding them on every request, the snapshot keeps the JSON body and the HTML fragment already encoded in a file
+# that every worker maps in memory, so serving the view is just a copy of bytes.
+# The file is replaced atomically (write a temporary file and rename it) each time the records change, the
+# readers detect the new file with a stat call and map it again. The writers of all the workers are serialized with
+# a lock file, and they apply the changes incrementally on top of the current snapshot instead of querying the
+# whole view again. The database is always the source of truth:
+# - a change is applied by reading the changed record again from the database under the lock, instead of applying
+#   the change notified by the writer: the listeners of concurrent commits run in any order, but the last one to
+#   take the lock reads the last committed state. The version of each record is kept in the file, a record read
+#   again at the same version doesn't rewrite the file.
+# - the file is stamped with the epoch of the snapshot, generated when the snapshot is created at import time (in
+#   the master, the workers are preloaded). A file written before the app started (ie. before a restart, or a
+#   restore of the database) belongs to another epoch, it's built again from the database by the first reader.
+# - only the writes of the app on the host are applied to the snapshot. The writes of the other hosts, of the other
+#   services sharing the database (ie. the nodejs backend) or of raw SQL are only seen when the snapshot expires:
+#   the file is built again from the database by the first reader once it's older than <prefix>_TTL seconds.
+class Snapshot(object):
+  ''' Pre-encoded JSON body and rendered HTML of a set of records stored in a memory-mapped file '''
+
+  def __init__(self, config_prefix, key, load, load_one, encode, render, scope=None, version='version'):
+    '''
+    :param config_prefix: prefix of the configuration variables of the snapshot (<prefix>_ENABLED, <prefix>_PATH,
+                          <prefix>_TTL)
+    :param key: name of the field identifying a record
+    :param load: function returning the serialized records of the snapshot from the database
+    :param load_one: function returning the serialized record of a key from the database, None if it's not part of
+                     the snapshot
+    :param encode: function encoding a list of records into a JSON body
+    :param render: function rendering a list of records into an HTML fragment
+    :param scope: function returning the scope of the current request (ie. the tenant), each scope has its own file
+    :param version: name of the field holding the version of a record
+    '''
+    self.config_prefix = config_prefix
+    self.key = key
+    self.load = load
+    self.load_one = load_one
+    self.version = version
+    self.epoch = uuid.uuid4().bytes
+    self.encode = encode
+    self.render = render
+    self.scope = scope
+    # Memory maps of the snapshot files in this worker, by path
+    self._maps = {}
+
+  @property
+  def enabled(self):
+    return current_app.config.get(self.config_prefix + '_ENABLED', False)
+
+  @property
+  def ttl(self):
+    return current_app.config.get(self.config_prefix + '_TTL', 0)
+
+  def expired(self, built_at):
+    ''' Return True if a snapshot built at the given time is older than its TTL (0: the snapshot doesn't expire) '''
+    return self.ttl > 0 and time.time() - built_at > self.ttl
+
+  @property
+  def path(self):
+    path = current_app.config[self.config_prefix + '_PATH']
+    if self.scope is not None:
+      path = '{}.{}'.format(path, self.scope())
+    return path
+
+  def json(self):
+    ''' Return the encoded JSON body of the snapshot '''
+    mm, start, end = self._mapped()
+    return mm[start:end]
+
+  def html(self):
+    ''' Return the rendered HTML fragment of the snapshot '''
+    mm, start, end = self._mapped()
+    return Markup(mm[end:].decode('utf-8'))
+
+  def rebuild(self, force=True):
+    '''
+    Build the snapshot from the database
+    :param force: if False, the snapshot is only built when the file doesn't exist, belongs to another epoch or has
+                  expired
+    '''
+    with self._locked():
+      if force or self._read() is None:
+        records = self.load()
+        self._write(records, { record[self.key]: record[self.version] for record in records })
+
+  def refresh(self, key):
+    ''' Apply the current state of a record in the database to the snapshot (added, replaced or removed) '''
+    with self._locked():
+      content = self._read()
+      if content is None:
+        # Nothing to update, the first reader builds the snapshot from the database
+        return
+      # The records applied one by one don't make the snapshot fresher, the build time is kept
+      versions, records, built_at = content
+      record = self.load_one(key)
+      version = record[self.version] if record is not None else None
+      if versions.get(key) == version:
+        return
+      if record is None:
+        records.pop(key, None)
+        versions.pop(key, None)
+      else:
+        records[key] = record
+        versions[key] = version
+      self._write(records.values(), versions, built_at)
+
+  def _read(self):
+    # Return the versions, the records and the build time of the snapshot, None if there is no (unexpired) snapshot of the current
+    # epoch
+    try:
+      with open(self.path, 'rb') as f:
+        content = f.read()
+    except FileNotFoundError:
+      return None
+    epoch, built_at, versions_size, size = HEADER.unpack_from(content)
+    if epoch != self.epoch or self.expired(built_at):
+      return None
+    start = HEADER.size + versions_size
+    versions = loads(content[HEADER.size:start])
+    records = { record[self.key]: record for record in loads(content[start:start + size]) }
+    return versions, records, built_at
+
+  def _write(self, records, versions, built_at=None):
+    records = sorted(records, key=lambda record: record[self.key])
+    versions = dumps(versions).encode('utf-8')
+    body = self.encode(records).encode('utf-8')
+    html = self.render(records).encode('utf-8')
+    path = self.path
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+      f.write(HEADER.pack(self.epoch, built_at or time.time(), len(versions), len(body)))
+      f.write(versions)
+      f.write(body)
+      f.write(html)
+    os.replace(tmp_path, path)
+
+  def _mapped(self):
+    path = self.path
+    # A missing file, a file of another epoch or an expired file is built again once, then it's mapped whatever its
+    # epoch
+    for attempt in range(2):
+      try:
+        stat = os.stat(path)
+      except FileNotFoundError:
+        self.rebuild(force=False)
+        stat = os.stat(path)
+      version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+      mapped = self._maps.get(path)
+      if mapped is None or mapped[0] != version:
+        # The previous map is not closed, a request of another thread might still be reading it. It's released
+        # by the garbage collector.
+        with open(path, 'rb') as f:
+          mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        epoch, built_at, versions_size, size = HEADER.unpack_from(mm)
+        start = HEADER.size + versions_size
+        mapped = self._maps[path] = (version, mm, start, start + size, epoch, built_at)
+      if attempt or (mapped[4] == self.epoch and not self.expired(mapped[5])):
+        break
+      self.rebuild(force=False)
+    return mapped[1], mapped[2], mapped[3]
+
+  @contextmanager
+  def _locked(self):
+    # flock locks are held by the open file, so they serialize the writers of the threads and the processes
+    with open(self.path + '.lock', 'a') as f:
+      fcntl.flock(f, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
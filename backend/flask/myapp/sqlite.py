@@ -0,0 +1,67 @@
+
+"""SQLite module, tuning the connections to SQLite databases and serializing their writers."""
+
+import fcntl
+from contextlib import contextmanager, nullcontext
+from flask import current_app
+from sqlalchemy import event
+
+
+# With its default settings SQLite is a poor fit for a web server with several workers and threads: the rollback
+# journal blocks the readers while a transaction commits, every commit is synced to disk twice, and a writer that
+# finds the database locked fails right away with "database is locked".
+# The SQLITE_PRAGMAS of the configuration are applied to every new connection of the engine (connect event):
+# - journal_mode=WAL: the readers read a snapshot of the database while the writer appends to the write-ahead log
+# - synchronous=NORMAL: the log is synced at checkpoints only, a commit is still atomic (but the last commits can
+#   be lost on a power failure)
+# - mmap_size/cache_size: pages read through a memory map and kept in the page cache of the connection
+# - busy_timeout: a writer waits for the lock of another writer instead of failing
+# There is only one writer at a time in SQLite anyway, so with SQLITE_SERIALIZE_WRITES the commits of all the
+# threads and workers are queued on a lock file instead of spinning in the busy handler of SQLite.
+class SQLiteTuning(object):
+  ''' Extension applying pragmas to the SQLite connections and serializing the writers '''
+
+  def __init__(self, db=None, app=None):
+    self.db = db
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.extensions['sqlite'] = None
+    pragmas = app.config.get('SQLITE_PRAGMAS')
+    serialize_writes = app.config.get('SQLITE_SERIALIZE_WRITES', False)
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite:') or not (pragmas or serialize_writes):
+      return
+    # The engine is created here so the listener is registered before its first connection
+    engine = self.db.get_engine(app)
+    if pragmas:
+      event.listen(engine, 'connect', lambda connection, record: self.apply_pragmas(connection, pragmas))
+    # The lock file sits next to the database file (in memory databases are private to a process)
+    if serialize_writes and engine.url.database not in (None, '', ':memory:'):
+      app.extensions['sqlite'] = engine.url.database + '.writer.lock'
+
+  @staticmethod
+  def apply_pragmas(connection, pragmas):
+    ''' Apply the pragmas to a DBAPI connection '''
+    cursor = connection.cursor()
+    for name, value in pragmas.items():
+      cursor.execute('PRAGMA {} = {}'.format(name, value))
+    cursor.close()
+
+  def writer(self):
+    ''' Return a context manager holding the writer lock of the database of the current app, if it's enabled '''
+    lock_path = current_app.extensions.get('sqlite')
+    if lock_path is None:
+      return nullcontext()
+    return self._locked(lock_path)
+
+  @staticmethod
+  @contextmanager
+  def _locked(lock_path):
+    # flock locks are held by the open file, so they serialize the writers of the threads and the processes
+    with open(lock_path, 'a') as f:
+      fcntl.flock(f, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,432 @@
+
+"""Storage module, including the storage engines behind the DAO of the models."""
+
+import fcntl
+import json
+import os
+import threading
+from flask import current_app
+from sortedcontainers import SortedDict, SortedSet
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm.exc import StaleDataError
+from myapp.tenancy import current_tenant
+
+
+# The DAO methods of a model (ie. Product.find_all) don't talk to the database directly, they delegate to the
+# storage engine configured with STORAGE_ENGINE:
+# - 'sql': the records are stored with Flask-SQLAlchemy (SQLite, PostgreSQL). This is the default engine.
+# - 'memory': the records are kept in memory in sorted tables, with secondary indexes, and persisted in an
+#   append-only log that is compacted into a snapshot periodically. It's meant for single node deployments (one
+#   worker process, any number of threads) and edge deployments without a database server.
+# Every engine stores serialized records (dicts), it isolates the records by tenant, it checks the versions of the
+# records for conditional updates (StaleDataError) and it notifies the commit listeners of the model.
+
+class DuplicateKeyError(Exception):
+  ''' Raised when a record is created with the key of an existing record '''
+
+
+def is_duplicate_key(error):
+  ''' Return True if an IntegrityError is the violation of a primary key or of a unique constraint '''
+  # Other integrity errors (NOT NULL, foreign key, check) are bugs or invalid data, not a duplicate record.
+  # PostgreSQL reports the SQLSTATE of the error (23505 unique_violation), SQLite only a message.
+  return getattr(error.orig, 'pgcode', None) == '23505' or str(error.orig).startswith('UNIQUE constraint failed')
+
+
+class StorageEngine(object):
+  ''' Interface of the storage engines '''
+
+  def create(self, model, data):
+    ''' Create a record and return it serialized, DuplicateKeyError is raised if the key already exists '''
+    raise NotImplementedError
+
+  def find_all(self, model, filter=None):
+    ''' Return the serialized records matching the filter condition (all the records if None) '''
+    raise NotImplementedError
+
+  def find_one(self, model, query):
+    ''' Return the first serialized record matching the query condition, None if there is none '''
+    raise NotImplementedError
+
+  def find_many(self, model, column, values):
+    ''' Return the serialized records having one of the values in the column, by value '''
+    raise NotImplementedError
+
+  def update_one(self, model, query, props, if_match=None):
+    ''' Update the fields of the record matching the query condition, return None if there is none '''
+    raise NotImplementedError
+
+  def delete_one(self, model, query, if_match=None):
+    ''' Delete the record matching the query condition, return None if there is none '''
+    raise NotImplementedError
+
+  @staticmethod
+  def check_version(record, if_match=None):
+    ''' raise StaleDataError if the version of the record is not one of the accepted versions '''
+    if if_match is not None and record['version'] not in if_match:
+      raise StaleDataError('Record is at version {}'.format(record['version']))
+
+
+class SQLEngine(StorageEngine):
+  ''' Storage engine persisting the records with Flask-SQLAlchemy '''
+
+  # Maximum number of values in the IN clause of a query (SQLite allows 999 bound parameters by default)
+  IN_CHUNK_SIZE = 500
+
+  def create(self, model, data):
+    # The model overrides create() to delegate to the engine, the SQL engine uses the implementation of CRUDMixin
+    try:
+      return super(model, model).create(**data)
+    except IntegrityError as e:
+      if not is_duplicate_key(e):
+        raise
+      raise DuplicateKeyError(*e.args) from e
+
+  def find_all(self, model, filter=None):
+    if filter is not None:
+      records = model.scoped_query().filter_by(**filter)
+    else:
+      records = model.scoped_query().all()
+    return model.serialize_list(records)
+
+  def find_one(self, model, query):
+    record = model.scoped_query().filter_by(**query).first()
+    if record is not None:
+      record = record.serialize()
+    return record
+
+  def find_many(self, model, column, values):
+    found = {}
+    # WHERE column IN (...) is split in chunks to stay below the limit of bound parameters of the database
+    for i in range(0, len(values), self.IN_CHUNK_SIZE):
+      chunk = values[i:i + self.IN_CHUNK_SIZE]
+      for record in model.scoped_query().filter(getattr(model, column).in_(chunk)):
+        found[getattr(record, column)] = record.serialize()
+    return found
+
+  def update_one(self, model, query, props, if_match=None):
+    record = model.scoped_query().filter_by(**query).first()
+    if record is not None:
+      self.check_version({ 'version': record.version }, if_match)
+      return record.update(**props)
+    return None
+
+  def delete_one(self, model, query, if_match=None):
+    record = model.scoped_query().filter_by(**query).first()
+    if record is not None:
+      self.check_version({ 'version': record.version }, if_match)
+      return record.delete()
+    return None
+
+
+class MemoryTable(object):
+  ''' Records of a model for a tenant, sorted by key, with secondary indexes '''
+
+  def __init__(self, key, indexes=()):
+    self.key = key
+    # Records by key in key order: the sorted map inserts and deletes a key in O(log n), where inserting in a sorted
+    # list moves every key after it
+    self.records = SortedDict()
+    # Secondary indexes: column -> value -> sorted set of keys
+    self.indexes = { column: {} for column in indexes }
+
+  def get(self, key):
+    return self.records.get(key)
+
+  def put(self, record):
+    key = record[self.key]
+    old = self.records.get(key)
+    if old is not None:
+      self._unindex(old)
+    self.records[key] = record
+    for column, index in self.indexes.items():
+      index.setdefault(record.get(column), SortedSet()).add(key)
+
+  def delete(self, key):
+    record = self.records.pop(key, None)
+    if record is not None:
+      self._unindex(record)
+    return record
+
+  def scan(self, filter=None):
+    ''' Return the records matching the filter condition in key order, using a secondary index if possible '''
+    if not filter:
+      return list(self.records.values())
+    keys = self.records.keys()
+    for column, value in filter.items():
+      if column in self.indexes:
+        keys = self.indexes[column].get(value, ())
+        break
+    return [self.records[key] for key in keys
+            if all(self.records[key].get(column) == value for column, value in filter.items())]
+
+  def _unindex(self, record):
+    for column, index in self.indexes.items():
+      keys = index.get(record.get(column))
+      if keys is not None:
+        keys.discard(record[self.key])
+
+
+class MemoryEngine(StorageEngine):
+  ''' Storage engine keeping the records in memory, persisted in an append-only log compacted into snapshots '''
+
+  def __init__(self, log_path=None, snapshot_every=10000, fsync=False):
+    '''
+    :param log_path: path of the append-only log, None to keep the records in memory only
+    :param snapshot_every: number of operations appended to the log before compacting it into a snapshot
+    :param fsync: flush the log to disk on every operation (durable, slower)
+    '''
+    self._lock = threading.RLock()
+    # Locks serializing the writes of a table, by (table name, tenant)
+    self._write_locks = {}
+    # Tables by (table name, tenant)
+    self._tables = {}
+    self._models = {}
+    self.log_path = log_path
+    self.snapshot_path = log_path + '.snapshot' if log_path else None
+    self.snapshot_every = snapshot_every
+    self.fsync = fsync
+    self._log = None
+    self._log_lock = None
+    self._logged = 0
+    self._pending = {}
+    if log_path is not None:
+      self._recover()
+
+  def close(self):
+    ''' Close the log, another engine can use it afterwards '''
+    with self._lock:
+      if self._log is not None:
+        self._log.close()
+        self._log_lock.close()
+        self._log = self._log_lock = None
+
+  # DAO operations
+
+  def create(self, model, data):
+    record = self._new_record(model, data)
+    tenant = record[model.__tenant_key__]
+    with self._writer(model, tenant):
+      with self._lock:
+        table = self._table(model, tenant)
+        if table.get(record[table.key]) is not None:
+          raise DuplicateKeyError('Duplicate key {}'.format(record[table.key]))
+      self._write_through(model, 'create', None, record)
+      with self._lock:
+        self._put(model, table, record)
+    model.notify('create', dict(record), dict(record))
+    return dict(record)
+
+  def find_all(self, model, filter=None):
+    with self._lock:
+      return [dict(record) for record in self._table(model).scan(filter)]
+
+  def find_one(self, model, query):
+    with self._lock:
+      record = self._find(model, query)
+      return dict(record) if record is not None else None
+
+  def find_many(self, model, column, values):
+    with self._lock:
+      table = self._table(model)
+      if column == table.key:
+        records = (table.get(value) for value in values)
+      else:
+        records = (record for value in values for record in table.scan({ column: value }))
+      return { record[column]: dict(record) for record in records if record is not None }
+
+  def update_one(self, model, query, props, if_match=None):
+    with self._writer(model):
+      with self._lock:
+        record = self._find(model, query)
+        if record is None:
+          return None
+        self.check_version(record, if_match)
+        changes = { column: value for column, value in props.items() if record.get(column) != value }
+      if changes:
+        # The records are never modified in place, readers may hold them
+        old, record = record, dict(record, **changes)
+        record['version'] += 1
+        self._write_through(model, 'update', old, record)
+        with self._lock:
+          self._put(model, self._table(model), record)
+    if changes:
+      model.notify('update', dict(record), changes)
+    return dict(record)
+
+  def delete_one(self, model, query, if_match=None):
+    with self._writer(model):
+      with self._lock:
+        record = self._find(model, query)
+        if record is None:
+          return None
+        self.check_version(record, if_match)
+      self._write_through(model, 'delete', record, None)
+      with self._lock:
+        table = self._table(model)
+        table.delete(record[table.key])
+        self._append({ 'op': 'delete', 'table': model.__tablename__, 'tenant': record[model.__tenant_key__],
+                       'key': record[table.key] })
+    model.notify('delete', dict(record), {})
+    return dict(record)
+
+  def _writer(self, model, tenant=None):
+    # The writes of a table are serialized from the check of the record (duplicate key, version) to its write in
+    # memory, so the record checked is the record replaced. The memory lock is only held to read and write the
+    # memory, never during the SQL commit of _write_through: the reads (of every tenant) and the writes of the other
+    # tables don't wait for the database.
+    key = (model.__tablename__, tenant if tenant is not None else current_tenant())
+    with self._lock:
+      return self._write_locks.setdefault(key, threading.Lock())
+
+  @staticmethod
+  def _write_through(model, operation, old, new):
+    # The write listeners of the model keep derived data in the SQL database (ie. counters). There is no transaction
+    # spanning the database and the memory, so the derived data is committed first, before the record is written in
+    # memory: if the commit fails the record is not written and the client gets the error. The derived data can still
+    # drift if the log can't be appended after the commit, the components keeping it repair it when the workers
+    # start (ie. categories.repair_counts).
+    if model.stage(operation, dict(old) if old else None, dict(new) if new else None):
+      model.commit()
+
+  # Tables
+
+  def _table(self, model, tenant=None):
+    tenant = tenant if tenant is not None else current_tenant()
+    if model.__tablename__ not in self._models:
+      self._models[model.__tablename__] = model
+      self._replay(model)
+    table = self._tables.get((model.__tablename__, tenant))
+    if table is None:
+      table = self._tables[(model.__tablename__, tenant)] = self._new_table(model)
+    return table
+
+  @staticmethod
+  def _new_table(model):
+    # The key of the table is the primary key of the model without the tenant (the tenant selects the table)
+    keys = [column.name for column in inspect(model).primary_key if column.name != model.__tenant_key__]
+    return MemoryTable(keys[0], getattr(model, '__secondary_indexes__', ()))
+
+  @staticmethod
+  def _new_record(model, data):
+    record = {}
+    for column in model.__table__.columns:
+      if column.name in data:
+        record[column.name] = data[column.name]
+      elif column.default is not None and column.default.is_scalar:
+        record[column.name] = column.default.arg
+      else:
+        record[column.name] = None
+    record[model.__tenant_key__] = data.get(model.__tenant_key__) or current_tenant()
+    record['version'] = 1
+    return record
+
+  def _find(self, model, query):
+    table = self._table(model)
+    if set(query) == { table.key }:
+      return table.get(query[table.key])
+    records = table.scan(query)
+    return records[0] if records else None
+
+  def _put(self, model, table, record):
+    table.put(record)
+    self._append({ 'op': 'put', 'table': model.__tablename__, 'record': record })
+
+  # Persistence
+  # Every operation is appended to the log as a JSON line. After snapshot_every operations all the records are
+  # written to a new snapshot file, which replaces the previous one atomically, and the log is truncated. On start
+  # the snapshot is loaded and the log is replayed on top of it (replaying an operation twice is harmless, so a crash
+  # between the snapshot and the truncation of the log loses nothing). The log is locked by the engine for its
+  # lifetime: the records are in the memory of a single process, a second process appending to the same log would
+  # lose the records of the first one on recovery (ie. several gunicorn workers), so it fails to start.
+
+  def _append(self, entry):
+    if self._log is None:
+      return
+    self._log.write(json.dumps(entry) + '\n')
+    self._log.flush()
+    if self.fsync:
+      os.fsync(self._log.fileno())
+    self._logged += 1
+    if self._logged >= self.snapshot_every:
+      self.snapshot()
+
+  def snapshot(self):
+    ''' Write all the records to the snapshot file and truncate the log '''
+    with self._lock:
+      tmp_path = self.snapshot_path + '.tmp'
+      with open(tmp_path, 'w') as f:
+        for (table_name, tenant), table in self._tables.items():
+          for record in table.records.values():
+            f.write(json.dumps({ 'table': table_name, 'record': record }) + '\n')
+        # The tables whose model hasn't been used since the start are not replayed yet (the key of their records is
+        # only known by their model), their entries are kept as they are, in order
+        for entries in self._pending.values():
+          for entry in entries:
+            f.write(json.dumps(entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+      os.replace(tmp_path, self.snapshot_path)
+      self._log.close()
+      self._log = open(self.log_path, 'w')
+      self._logged = 0
+
+  def _recover(self):
+    self._log_lock = open(self.log_path + '.lock', 'a')
+    try:
+      fcntl.flock(self._log_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+      self._log_lock.close()
+      raise RuntimeError('The log {} is used by another process, the memory engine runs in a single process'
+                         .format(self.log_path))
+    # The entries are replayed table by table, when the model of the table is used for the first time
+    self._pending = {}
+    for path in (self.snapshot_path, self.log_path):
+      if os.path.exists(path):
+        with open(path) as f:
+          for line in f:
+            if line.strip():
+              entry = json.loads(line)
+              self._pending.setdefault(entry['table'], []).append(entry)
+    self._log = open(self.log_path, 'a')
+
+  def _replay(self, model):
+    for entry in self._pending.pop(model.__tablename__, []):
+      if entry.get('op') == 'delete':
+        self._table(model, entry['tenant']).delete(entry['key'])
+      else:
+        record = entry['record']
+        self._table(model, record[model.__tenant_key__]).put(record)
+
+
+# Storage engines by name (STORAGE_ENGINE)
+ENGINES = {
+  'sql': lambda config: SQLEngine(),
+  'memory': lambda config: MemoryEngine(config.get('MEMORY_ENGINE_LOG_PATH'),
+                                        config.get('MEMORY_ENGINE_SNAPSHOT_EVERY', 10000),
+                                        config.get('MEMORY_ENGINE_FSYNC', False))
+}
+
+
+class Storage(object):
+  ''' Extension giving access to the storage engine of the app '''
+
+  def __init__(self, app=None):
+    self._lock = threading.Lock()
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.extensions['storage'] = None
+
+  @property
+  def engine(self):
+    ''' Return the storage engine of the current app, created on first use from STORAGE_ENGINE '''
+    engine = current_app.extensions.get('storage')
+    if engine is None:
+      with self._lock:
+        engine = current_app.extensions.get('storage')
+        if engine is None:
+          create_engine = ENGINES[current_app.config.get('STORAGE_ENGINE', 'sql')]
+          engine = current_app.extensions['storage'] = create_engine(current_app.config)
+    return engine
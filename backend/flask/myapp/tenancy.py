@@ -0,0 +1,61 @@
+"""Tenancy module. Every request belongs to a tenant, which is the partition key of the multi-tenant tables."""
+
+import re
+from contextlib import contextmanager
+from flask import current_app, has_request_context, request, abort
+
+
+# Tenant identifiers are also used to name per-tenant resources (ie. snapshot files), so they are restricted
+# to a safe set of characters
+TENANT_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,50}$')
+
+# Key of the WSGI environment holding the tenant of the request once it has been authenticated
+TENANT_ENVIRON_KEY = 'myapp.tenant'
+
+
+# Any client can send the tenant header, so it's not trusted by itself to select the data of a tenant:
+# - the tenant of a request authenticated with a bearer token is the tenant of the token (see auth.py, the tokens
+#   are only accepted with the tenant header of their tenant)
+# - otherwise the header is only accepted when TENANT_HEADER_TRUSTED is set: the service runs behind a proxy which
+#   authenticates the clients and sets the header (replacing the header sent by the clients)
+# The requests without tenant header belong to the default tenant.
+def current_tenant():
+  ''' Return the tenant of the current request (the default tenant otherwise) '''
+  if not has_request_context():
+    return current_app.config['DEFAULT_TENANT']
+  tenant = request.environ.get(TENANT_ENVIRON_KEY)
+  if tenant is not None:
+    return tenant
+  tenant = header_tenant()
+  if tenant is None:
+    return current_app.config['DEFAULT_TENANT']
+  if not current_app.config.get('TENANT_HEADER_TRUSTED', False):
+    abort(403, 'The tenant header is only accepted on authenticated requests')
+  return tenant
+
+def header_tenant():
+  ''' Return the tenant of the tenant header of the request, None if there is no header '''
+  tenant = request.headers.get(current_app.config['TENANT_HEADER'])
+  if tenant is not None and not TENANT_PATTERN.match(tenant):
+    abort(400, 'Invalid tenant {}'.format(tenant))
+  return tenant
+
+def authenticate_tenant(tenant):
+  ''' Set the tenant of the current request, authenticated by the caller '''
+  request.environ[TENANT_ENVIRON_KEY] = tenant
+
+
+def validate_tenant():
+  ''' Reject the requests with an invalid tenant before they reach the views '''
+  header_tenant()
+
+def authorize_tenant():
+  ''' Reject the requests selecting a tenant they are not allowed to, after their authentication '''
+  current_tenant()
+
+
+@contextmanager
+def tenant_context(app, tenant):
+  ''' Request context of a tenant, for the work done outside of the requests (ie. warmup tasks) '''
+  with app.test_request_context(environ_overrides={ TENANT_ENVIRON_KEY: tenant }):
+    yield
@@ -0,0 +1,151 @@
+
+"""Validation module, compiling the schemas of the API description into request validators."""
+
+import yaml
+from flask_restful import abort
+
+
+# The request parser of Flask-RESTful (reqparse) is generic: for every argument of every request it probes several
+# locations of the request, looks up the options of the argument and deep copies them. Here the schemas of the API
+# description (Swagger) are compiled once, at import time, into a tuple of fields with their converter, default value
+# and error message already resolved, so a request is validated with a single pass over its payload.
+# The error messages are taken from the 'x-error-message' extension of each property or parameter, and the errors
+# are reported like reqparse does: 400 (Bad Request) with a message dict { field: error message }.
+
+MISSING = object()
+
+
+def to_string(value):
+  ''' Convert a value to a string, like the default type of reqparse '''
+  return str(value)
+
+def to_boolean(value):
+  ''' Convert a value to a boolean, accepting "true"/"false"/"1"/"0" (case insensitive) like inputs.boolean '''
+  if isinstance(value, bool):
+    return value
+  value = value.lower()
+  if value in ('true', '1'):
+    return True
+  if value in ('false', '0'):
+    return False
+  raise ValueError('Invalid literal for boolean(): {}'.format(value))
+
+def to_integer(value):
+  ''' Convert a value to an integer '''
+  if isinstance(value, bool):
+    raise ValueError('Invalid literal for integer(): {}'.format(value))
+  return int(value)
+
+def to_list(value):
+  ''' Convert a value to a list of strings, a string is split by commas (Swagger collectionFormat csv) '''
+  if isinstance(value, str):
+    return [item for item in value.split(',') if item]
+  if not isinstance(value, list):
+    raise ValueError('Invalid literal for list(): {}'.format(value))
+  return [to_string(item) for item in value]
+
+# Converters by Swagger type
+CONVERTERS = {
+  'string': to_string,
+  'boolean': to_boolean,
+  'integer': to_integer,
+  'array': to_list
+}
+
+def json_body(request):
+  ''' Return the JSON object in the body of the request, or the form/query values if the body is not JSON '''
+  # A body sent as JSON is never read as form values: a malformed body is rejected, like reqparse does
+  if not request.is_json:
+    return request.values
+  data = request.get_json(silent=True)
+  if not isinstance(data, dict):
+    abort(400, message='The body of the request must be a JSON object')
+  return data
+
+def query_args(request):
+  ''' Return the query arguments of the request '''
+  return request.args
+
+# Sources of the values by Swagger location
+SOURCES = {
+  'body': json_body,
+  'query': query_args
+}
+
+
+def constrained(convert, schema):
+  ''' Wrap a converter with the constraints of a schema (enum, minimum, maximum), if it has any '''
+  enum = schema.get('enum')
+  minimum = schema.get('minimum')
+  maximum = schema.get('maximum')
+  if enum is None and minimum is None and maximum is None:
+    return convert
+  def convert_constrained(value):
+    value = convert(value)
+    if enum is not None and value not in enum:
+      raise ValueError('{} is not one of {}'.format(value, enum))
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+      raise ValueError('{} is out of range'.format(value))
+    return value
+  return convert_constrained
+
+
+def load_api_description(path):
+  ''' Load the API description (Swagger) from a YAML file '''
+  with open(path) as f:
+    return yaml.safe_load(f)
+
+def operation_parameters(description, path, method):
+  ''' Return the properties and the required names of the parameters of an operation (other than body/path) '''
+  parameters = description['paths'][path][method].get('parameters', [])
+  properties = { p['name']: p for p in parameters if p['in'] not in ('body', 'path') }
+  required = [p['name'] for p in parameters if p.get('required') and p['in'] not in ('body', 'path')]
+  return properties, required
+
+
+def compile_validator(properties, required=(), location='body', bundle_errors=True, partial=False, exclude=()):
+  '''
+  Compile the properties of a schema into a function validating a request
+  :param properties: schemas of the fields by name
+  :param required: names of the required fields
+  :param location: location of the values in the request ('body' or 'query')
+  :param bundle_errors: report the errors of all the fields, otherwise stop at the first error
+  :param partial: the fields are neither required nor defaulted, only the fields present are returned (updates)
+  :param exclude: names of the fields to ignore
+  :return: function taking the request and returning the dict of converted values, it aborts with 400 on errors
+  '''
+  fields = []
+  for name, schema in properties.items():
+    if name in exclude:
+      continue
+    convert = constrained(CONVERTERS[schema.get('type', 'string')], schema)
+    has_default = 'default' in schema and not partial
+    default = convert(schema['default']) if has_default else None
+    message = schema.get('x-error-message', 'Invalid value for {}'.format(name))
+    fields.append((name, convert, name in required and not partial, has_default, default, message))
+  fields = tuple(fields)
+  source = SOURCES[location]
+
+  def validate(request):
+    values = source(request)
+    args = {}
+    errors = {}
+    for name, convert, is_required, has_default, default, message in fields:
+      value = values.get(name, MISSING)
+      if value is MISSING or value is None:
+        if is_required:
+          errors[name] = message
+        elif has_default:
+          args[name] = default
+      else:
+        try:
+          args[name] = convert(value)
+        except (AttributeError, TypeError, ValueError):
+          errors[name] = message
+      if errors and not bundle_errors:
+        break
+    if errors:
+      abort(400, message=errors)
+    return args
+
+  return validate
@@ -0,0 +1,108 @@
+
+"""Warmup module, preparing a worker before it accepts traffic and reporting its readiness."""
+
+import threading
+from flask import current_app, jsonify
+
+
+# A worker that starts serving cold pays for the first connection to the database, the compilation of the
+# templates and the first build of the hot caches (ie. the shopping cart snapshot) on the latency of its first
+# requests. The production server (gunicorn.conf.py) runs the warmup in each worker after the fork and before the
+# worker accepts connections:
+# - prepare(): work that doesn't hold any connection or file descriptor, run once in the master before forking
+#   (preload_app) so the workers share the result copy-on-write (ie. the compiled templates)
+# - run(): the connections of the engine inherited from the master are discarded, the pool is filled with new
+#   connections and the warmup tasks registered by the blueprints are run (ie. building a snapshot)
+# Other servers (ie. the development server of flask run) don't call the warmup, the worker is then warmed up by its
+# first request (WARMUP_ON_FIRST_REQUEST), whichever endpoint it is. Under gunicorn the worker is already warmed up
+# by then, the first request doesn't do anything.
+# The readiness endpoint answers 503 until the warmup of the worker has completed, so a load balancer or an
+# orchestrator doesn't route traffic to it, and the liveness endpoint answers 200 as soon as the worker serves.
+# Once warmed up, the worker is only ready if its dependencies answer: each readiness request runs a query on the
+# database and the readiness checks registered by the blueprints (ie. reading the shopping cart snapshot).
+class Warmup(object):
+  ''' Extension running the warmup tasks of a worker and serving its readiness '''
+
+  def __init__(self, db=None, app=None):
+    self.db = db
+    self._tasks = []
+    self._checks = []
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.extensions['warmup'] = { 'ready': False, 'lock': threading.Lock() }
+    app.add_url_rule(app.config['URL_PREFIX_API'] + 'health/live', 'health_live', self.live)
+    app.add_url_rule(app.config['URL_PREFIX_API'] + 'health/ready', 'health_ready', self.ready)
+    app.before_first_request(self.first_request)
+
+  def task(self, fn):
+    ''' Register a function to call, with the app as argument, when a worker warms up '''
+    self._tasks.append(fn)
+    return fn
+
+  def check(self, fn):
+    ''' Register a function to call on each readiness request, the worker is not ready if it raises '''
+    self._checks.append(fn)
+    return fn
+
+  def prepare(self, app):
+    ''' Warm up what can be shared by the workers, before forking them '''
+    for template in app.jinja_env.list_templates():
+      app.jinja_env.get_template(template)
+
+  def run(self, app, forked=True):
+    '''
+    Warm up a worker and mark it ready
+    :param forked: the worker has been forked from a master which may have opened connections
+    '''
+    state = app.extensions['warmup']
+    with state['lock']:
+      if state['ready']:
+        return
+      with app.app_context():
+        # The connections opened by the master must not be shared by the workers
+        if forked:
+          self.db.engine.dispose()
+        connections = [self.db.engine.connect() for _ in range(app.config.get('WARMUP_CONNECTIONS', 1))]
+        for connection in connections:
+          connection.execute('SELECT 1')
+          connection.close()
+      # The caches are built lazily anyway, a failing task doesn't prevent the worker from serving
+      for task in self._tasks:
+        try:
+          task(app)
+        except Exception:
+          app.logger.exception('Warmup task {} failed'.format(task.__name__))
+      state['ready'] = True
+      app.logger.info('Worker warmed up')
+
+  def first_request(self):
+    ''' Warm up the worker on its first request, if the server didn't (WARMUP_ON_FIRST_REQUEST) '''
+    app = current_app._get_current_object()
+    if app.config.get('WARMUP_ON_FIRST_REQUEST', True):
+      # The process isn't forked, the connections of the engine are kept
+      self.run(app, forked=False)
+
+  def is_ready(self, app):
+    return app.extensions['warmup']['ready']
+
+  def live(self):
+    ''' Liveness endpoint: the worker is serving requests '''
+    return jsonify(status='live')
+
+  def ready(self):
+    ''' Readiness endpoint: the worker has completed its warmup and its dependencies answer '''
+    if not self.is_ready(current_app):
+      return jsonify(status='warming up'), 503
+    for check in [self.check_database] + self._checks:
+      try:
+        check()
+      except Exception:
+        current_app.logger.exception('Readiness check {} failed'.format(check.__name__))
+        return jsonify(status='unavailable', check=check.__name__), 503
+    return jsonify(status='ready')
+
+  def check_database(self):
+    with self.db.engine.connect() as connection:
+      connection.execute('SELECT 1')
@@ -8,6 +8,9 @@ export $(cat $APP_PATH/../../.env)
 # Own custom environment variable setting the configuration to run myapp. Possible values: dev, test, prod
 export APP_CONFIG_ENV='test'   
 
+# Package the API description shared by the backends with the app (the request validators are compiled from it)
+cp $APP_PATH/../../api_description.yml $APP_PATH/myapp/api_description.yml
+
 # Flask detects factory method "create_app" in myapp package
 export FLASK_APP="$APP_PATH/myapp:create_app('$APP_CONFIG_ENV')"
 
@@ -25,5 +28,10 @@ export FLASK_ENV=development
 # Set OS environment variable to select the configuration file to load based on the deployment environment
 # export APP_CONFIG_FILE=$PWD/config/development.py
 
-# Start the web application 
-flask run --host=0.0.0.0 --port=8081
+# Start the web application. The development server (flask run) is used with APP_CONFIG_ENV=dev, the other
+# environments run the production server configured in gunicorn.conf.py (preloaded app, warmed up workers)
+if [ "$APP_CONFIG_ENV" = 'dev' ]; then
+  flask run --host=0.0.0.0 --port=8081
+else
+  cd $APP_PATH && exec gunicorn -c gunicorn.conf.py wsgi:app
+fi
@@ -2,7 +2,6 @@
 import pytest
 from myapp import create_app
 from myapp.database import db
-import os
 from environs import Env
 
 
@@ -10,10 +9,14 @@ env = Env()
 env.read_env()
 env_type = 'dev'
 
-@pytest.fixture
-def app():
+# Every test runs against each storage engine
+@pytest.fixture(params=['sql', 'memory'])
+def app(request):
     """Create application for the tests."""
     app = create_app(env_type)
+    app.config['STORAGE_ENGINE'] = request.param
+    # The tests warm the app up explicitly
+    app.config['WARMUP_ON_FIRST_REQUEST'] = False
     ctx = app.test_request_context()
     ctx.push()
     yield app
@@ -30,3 +33,9 @@ def client(app):
     # Explicitly close DB connection
     db.session.close()
     db.drop_all()
+
+@pytest.fixture
+def sql_engine(app):
+    """Skip the tests relying on the SQL database with other storage engines."""
+    if app.config['STORAGE_ENGINE'] != 'sql':
+      pytest.skip('requires the SQL storage engine')
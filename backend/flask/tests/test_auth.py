@@ -0,0 +1,112 @@
+import time
+import pytest
+from urllib.parse import urljoin
+from itsdangerous import BadSignature
+from myapp.extensions import auth
+
+URL_PREFIX = 'api/v1/'
+PRODUCTS_URL = urljoin(URL_PREFIX, 'products')
+
+
+@pytest.fixture
+def auth_client(app, client):
+  """Enable the authentication for the tests."""
+  app.config.update(AUTH_ENABLED=True, AUTH_SECRET_KEY='test-secret', AUTH_CACHE_SIZE=2)
+  auth.init_app(app)
+  yield client
+  app.extensions['auth'] = None
+
+def bearer(token):
+  return { 'Authorization': 'Bearer {}'.format(token) }
+
+
+"""
+GIVEN the authentication is disabled (default)
+WHEN a request without token is sent
+THEN it's served
+"""
+def test_auth_disabled(client):
+  assert client.get(PRODUCTS_URL).status_code == 200
+
+"""
+GIVEN the authentication is enabled
+WHEN requests without token, with an invalid token, and with a valid token are sent
+THEN only the request with the valid token is served, the others are challenged
+"""
+def test_bearer_token_required(app, auth_client):
+  resp = auth_client.get(PRODUCTS_URL)
+  assert resp.status_code == 401
+  assert resp.headers['WWW-Authenticate'] == 'Bearer error="invalid_request"'
+  token = app.extensions['auth'].issue('ui', 'default')
+  assert auth_client.get(PRODUCTS_URL, headers=bearer(token + 'x')).status_code == 401
+  assert auth_client.get(PRODUCTS_URL, headers=bearer(token)).status_code == 200
+  # The health endpoints are not part of the API blueprint
+  assert auth_client.get(urljoin(URL_PREFIX, 'health/live')).status_code == 200
+
+"""
+GIVEN a valid token of a tenant
+WHEN it's sent on a request of another tenant
+THEN the request is forbidden
+"""
+def test_token_of_another_tenant(app, auth_client):
+  token = app.extensions['auth'].issue('ui', 'tenant1')
+  assert auth_client.get(PRODUCTS_URL, headers=bearer(token)).status_code == 403
+  headers = dict(bearer(token), **{ app.config['TENANT_HEADER']: 'tenant1' })
+  assert auth_client.get(PRODUCTS_URL, headers=headers).status_code == 200
+
+"""
+GIVEN tokens verified once
+WHEN they are sent again
+THEN they are served from the cache of verified tokens, which keeps the most recently used tokens only
+"""
+def test_verified_tokens_cached(app, auth_client):
+  verifier = app.extensions['auth']
+  tokens = [verifier.issue('client{}'.format(i), 'default') for i in range(3)]
+  for token in tokens + tokens[-1:]:
+    verifier.verify(token)
+  assert (verifier.hits, verifier.misses) == (1, 3)
+  assert list(verifier._cache) == tokens[1:]
+
+"""
+GIVEN a valid token, cached by a worker
+WHEN the token is revoked and the revoked tokens are refreshed
+THEN the token is rejected, without the revocation being queried per request
+"""
+def test_revoked_token(app, auth_client):
+  verifier = app.extensions['auth']
+  token = verifier.issue('ui', 'default')
+  assert auth_client.get(PRODUCTS_URL, headers=bearer(token)).status_code == 200
+  # Revoked by another process (ie. flask auth-revoke)
+  auth.init_app(app)
+  app.extensions['auth'].revoke(token)
+  assert verifier.refresh() == { verifier.claims(token)[0]['jti'] }
+  app.extensions['auth'] = verifier
+  assert auth_client.get(PRODUCTS_URL, headers=bearer(token)).status_code == 401
+  with pytest.raises(BadSignature):
+    verifier.verify(token)
+
+"""
+GIVEN a token older than the maximum age of the tokens
+WHEN it's sent, even if it was verified before
+THEN it's rejected as expired
+"""
+def test_expired_token(app, auth_client):
+  verifier = app.extensions['auth']
+  token = verifier.issue('ui', 'default')
+  assert auth_client.get(PRODUCTS_URL, headers=bearer(token)).status_code == 200
+  claims, expires_at = verifier._cache[token]
+  verifier._cache[token] = (claims, time.time() - 1)
+  resp = auth_client.get(PRODUCTS_URL, headers=bearer(token))
+  assert resp.status_code == 401
+  assert resp.get_json()['message'] == 'Token expired'
+
+"""
+GIVEN the authentication is enabled without AUTH_SECRET_KEY
+WHEN the extension is initialized
+THEN it refuses to start, the tokens couldn't be verified by the other workers
+"""
+def test_auth_requires_secret_key(app):
+  app.config.update(AUTH_ENABLED=True, AUTH_SECRET_KEY=None)
+  with pytest.raises(RuntimeError):
+    auth.init_app(app)
+  app.extensions['auth'] = None
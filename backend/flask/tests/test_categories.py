@@ -0,0 +1,150 @@
+import pytest
+import sqlalchemy as sa
+from urllib.parse import urljoin
+from myapp.database import db, STAGED
+from myapp.blueprints.product.models import Product as ProductDao, CategoryCount
+from myapp.blueprints.product.categories import recount_products, repair_counts
+
+URL_PREFIX = 'api/v1/'
+PRODUCTS_URL = urljoin(URL_PREFIX, 'products')
+CATEGORIES_URL = urljoin(URL_PREFIX, 'categories')
+
+
+def create_category(client, name, aisle=None):
+  return client.post(CATEGORIES_URL, json={ 'name': name, 'aisle': aisle }).get_json()['id']
+
+def product_url(name):
+  return urljoin(URL_PREFIX, 'products/{}'.format(name))
+
+def facets(client):
+  return { facet['name']: (facet['products'], facet['in_cart']) for facet in client.get(CATEGORIES_URL).get_json() }
+
+
+"""
+GIVEN categories of products
+WHEN products are created, moved to the shopping cart, moved to another category and deleted
+THEN the counts of the categories follow every write
+"""
+def test_category_counts_follow_writes(client):
+  bakery = create_category(client, 'bakery', 'aisle 1')
+  dairy = create_category(client, 'dairy', 'aisle 2')
+  assert facets(client) == { 'bakery': (0, 0), 'dairy': (0, 0) }
+  client.post(PRODUCTS_URL, json={ 'name': 'bread', 'category_id': bakery })
+  client.post(PRODUCTS_URL, json={ 'name': 'butter', 'category_id': bakery, 'shopping_cart': True })
+  client.post(PRODUCTS_URL, json={ 'name': 'salt' })
+  assert facets(client) == { 'bakery': (2, 1), 'dairy': (0, 0) }
+  client.put(product_url('bread'), json={ 'shopping_cart': True })
+  assert facets(client) == { 'bakery': (2, 2), 'dairy': (0, 0) }
+  client.put(product_url('butter'), json={ 'category_id': dairy })
+  assert facets(client) == { 'bakery': (1, 1), 'dairy': (1, 1) }
+  client.put(product_url('salt'), json={ 'category_id': dairy })
+  client.delete(product_url('bread'))
+  assert facets(client) == { 'bakery': (0, 0), 'dairy': (2, 1) }
+
+"""
+GIVEN a product of a category
+WHEN the same product is created again
+THEN the creation fails and the counts of the category are unchanged
+"""
+def test_failed_write_doesnt_count(client):
+  bakery = create_category(client, 'bakery')
+  client.post(PRODUCTS_URL, json={ 'name': 'bread', 'category_id': bakery })
+  resp = client.post(PRODUCTS_URL, json={ 'name': 'bread', 'category_id': bakery, 'shopping_cart': True })
+  assert resp.status_code == 400
+  assert facets(client) == { 'bakery': (1, 0) }
+
+"""
+GIVEN a category
+WHEN the write of a product is staged
+THEN the counts are only updated when the session is committed (under the writer lock), or not at all on rollback
+"""
+def test_counts_updated_in_commit(client):
+  bakery = create_category(client, 'bakery')
+  product = { 'tenant_id': 'default', 'name': 'bread', 'shopping_cart': True, 'category_id': bakery }
+  ProductDao.stage('create', None, product)
+  assert db.session.info[STAGED]
+  assert facets(client) == { 'bakery': (0, 0) }
+  ProductDao.stage('create', None, product)
+  db.session.rollback()
+  assert STAGED not in db.session.info
+  ProductDao.stage('create', None, product)
+  ProductDao.commit()
+  assert facets(client) == { 'bakery': (1, 1) }
+
+"""
+GIVEN counts of categories that drifted from the products
+WHEN the products are counted again (when a worker keeping the products in memory starts)
+THEN the counts match the products
+"""
+def test_counts_repaired(app, client):
+  bakery = create_category(client, 'bakery')
+  dairy = create_category(client, 'dairy')
+  client.post(PRODUCTS_URL, json={ 'name': 'bread', 'category_id': bakery, 'shopping_cart': True })
+  client.post(PRODUCTS_URL, json={ 'name': 'milk', 'category_id': dairy })
+  CategoryCount.query.update({ CategoryCount.products: 5, CategoryCount.in_cart: 5 })
+  db.session.commit()
+  if app.config['STORAGE_ENGINE'] == 'memory':
+    repair_counts(app)
+  else:
+    recount_products()
+  assert facets(client) == { 'bakery': (1, 1), 'dairy': (1, 0) }
+
+"""
+GIVEN products of several categories
+WHEN the products of a category are requested
+THEN only the products of the category are returned, and an unknown category is rejected on writes
+"""
+def test_products_of_category(client):
+  bakery = create_category(client, 'bakery')
+  dairy = create_category(client, 'dairy')
+  client.post(PRODUCTS_URL, json={ 'name': 'bread', 'category_id': bakery, 'shopping_cart': True })
+  client.post(PRODUCTS_URL, json={ 'name': 'baguette', 'category_id': bakery })
+  client.post(PRODUCTS_URL, json={ 'name': 'milk', 'category_id': dairy, 'shopping_cart': True })
+  resp = client.get(PRODUCTS_URL + '?category={}'.format(bakery))
+  assert sorted(product['name'] for product in resp.get_json()) == ['baguette', 'bread']
+  resp = client.get(PRODUCTS_URL + '?category={}&shop=true'.format(bakery))
+  assert resp.get_json() == [{ 'name': 'bread', 'shopping_cart': True, 'category_id': bakery }]
+  assert client.post(PRODUCTS_URL, json={ 'name': 'cheese', 'category_id': 999 }).status_code == 400
+  assert client.put(product_url('milk'), json={ 'category_id': 999 }).status_code == 400
+  assert client.post(CATEGORIES_URL, json={ 'name': 'bakery' }).status_code == 400
+
+"""
+GIVEN categories in several aisles
+WHEN the list of products is displayed
+THEN the categories are listed by aisle with their counts, and the list can be narrowed to a category
+"""
+def test_list_facets(client):
+  bakery = create_category(client, 'bakery', 'aisle 1')
+  create_category(client, 'dairy', 'aisle 2')
+  client.post(PRODUCTS_URL, json={ 'name': 'bread', 'category_id': bakery, 'shopping_cart': True })
+  client.post(PRODUCTS_URL, json={ 'name': 'milk' })
+  page = client.get('/products/').get_data(as_text=True)
+  assert page.index('aisle 1') < page.index('bakery') < page.index('aisle 2') < page.index('dairy')
+  assert '(1/1)' in page and '(0/0)' in page
+  page = client.get('/products/?category={}'.format(bakery)).get_data(as_text=True)
+  assert 'bread' in page and 'milk' not in page
+
+"""
+GIVEN the products table
+WHEN the products of a category are queried
+THEN the query is served by the composite index on the tenant and the category
+"""
+def test_category_filter_uses_index(client, sql_engine):
+  if db.engine.dialect.name != 'sqlite':
+    pytest.skip('reads the query plan of SQLite')
+  plan = db.session.execute(sa.text('EXPLAIN QUERY PLAN SELECT * FROM products WHERE tenant_id = :tenant AND '
+                                    'category_id = :category'), { 'tenant': 'default', 'category': 1 }).fetchall()
+  assert 'ix_products_category' in ' '.join(str(row) for row in plan)
+
+"""
+GIVEN the snapshot of the shopping cart is enabled
+WHEN a product of the cart is moved to another category
+THEN the shopping cart is served with the new category of the product
+"""
+def test_cart_snapshot_follows_category(app, client, tmp_path):
+  app.config.update(CART_SNAPSHOT_ENABLED=True, CART_SNAPSHOT_PATH=str(tmp_path / 'cart.snapshot'))
+  bakery = create_category(client, 'bakery')
+  client.post(PRODUCTS_URL, json={ 'name': 'bread', 'shopping_cart': True })
+  assert client.get(PRODUCTS_URL + '?shop=true').get_json()[0]['category_id'] is None
+  client.put(product_url('bread'), json={ 'category_id': bakery })
+  assert client.get(PRODUCTS_URL + '?shop=true').get_json()[0]['category_id'] == bakery
@@ -11,12 +11,15 @@ CREATE_DUPLICATED_PRODUCT = 'Product {} is already registered'
 PRODUCT_NOT_FOUND = 'Product {} not found'
 NO_PRODUCT_FIELDS_TO_UPDATE = 'No valid fields to update are detected'
 NOT_BOOLEAN_TYPE = 'This value must be boolean'
+PRODUCT_MODIFIED = 'Product {} has been modified'
+NOT_A_LIST_OF_NAMES = 'This value must be a list of names'
 
 # Class for pytest unit testing
 class Product_test():
-  def __init__(self, name=None, shopping_cart=False):
+  def __init__(self, name=None, shopping_cart=False, category_id=None):
     self.name = name
     self.shopping_cart = shopping_cart
+    self.category_id = category_id
 
   def to_dict(self):    
     return self.__dict__
@@ -333,4 +336,151 @@ def test_update_product_with_invalid_shopping_cart_type(client):
   bread['shopping_cart'] = 'a string'
   resp = update_product(client, bread)
   assert resp.status_code == 400  
-  assert resp.get_json()['message']['shopping_cart'] == NOT_BOOLEAN_TYPE
\ No newline at end of file
+  assert resp.get_json()['message']['shopping_cart'] == NOT_BOOLEAN_TYPE
+
+# CONDITIONAL REQUESTS TESTS
+
+"""
+GIVEN the product database has one product 
+WHEN a request is sent to get that product and then to update it with its ETag in the If-Match header
+THEN the response returns the updated product with html code 200 (OK) and a new ETag
+"""
+def test_update_product_with_current_version(client):
+  bread = { 'name': 'bread'}
+  create_product(client, bread)
+  etag = get_product_by_name(client, 'bread').headers['ETag']
+  bread['shopping_cart'] = True
+  resp = client.put(urljoin(URL_PREFIX, 'products/bread'), json=bread, headers={'If-Match': etag})
+  assert resp.status_code == 200
+  assert resp.get_json()['shopping_cart'] == True
+  assert resp.headers['ETag'] != etag
+
+"""
+GIVEN the product database has one product that was modified after reading its ETag
+WHEN a request is sent to update or delete it with the old ETag in the If-Match header
+THEN the response returns an error message with html code 412 (Precondition Failed),
+     and the product keeps the values of the last update
+"""
+def test_update_and_delete_product_with_stale_version(client):
+  bread = { 'name': 'bread'}
+  create_product(client, bread)
+  etag = get_product_by_name(client, 'bread').headers['ETag']
+  update_product(client, { 'name': 'bread', 'shopping_cart': True })
+  url = urljoin(URL_PREFIX, 'products/bread')
+  updresp = client.put(url, json={ 'name': 'bread', 'shopping_cart': False }, headers={'If-Match': etag})
+  delresp = client.delete(url, headers={'If-Match': etag})
+  assert updresp.status_code == 412
+  assert updresp.get_json()['message'] == PRODUCT_MODIFIED.format('bread')
+  assert delresp.status_code == 412
+  assert get_product_by_name(client, 'bread').get_json()['shopping_cart'] == True
+
+"""
+GIVEN a product read by a request 
+WHEN another transaction updates the product before the request writes its changes
+THEN the compare-and-swap on the version detects the conflict and the changes are not applied
+"""
+def test_concurrent_update_detected_by_version(sql_engine, client):
+  from sqlalchemy.orm.exc import StaleDataError
+  from myapp.database import db
+  from myapp.blueprints.product.models import Product
+  create_product(client, { 'name': 'bread'})
+  product = Product.query.filter_by(name='bread').first()
+  db.session.execute("UPDATE products SET version = version + 1")
+  with pytest.raises(StaleDataError):
+    product.update(shopping_cart=True)
+  assert Product.find_one({ 'name': 'bread' })['shopping_cart'] == False
+
+"""
+GIVEN a product modified by concurrent writes while a request without If-Match header updates or deletes it
+WHEN the write fails on the version of the product
+THEN the write is retried until it succeeds (the last write wins)
+"""
+def test_unconditional_write_retried(client, monkeypatch):
+  from sqlalchemy.orm.exc import StaleDataError
+  from myapp.blueprints.product.models import Product
+  create_product(client, { 'name': 'bread' })
+  url = urljoin(URL_PREFIX, 'products/bread')
+  for method, send, status in (('update_one', client.put, 200), ('delete_one', client.delete, 204)):
+    write = getattr(Product, method)
+    conflicts = []
+    def conflicting(*args, **kwargs):
+      if len(conflicts) < 5:
+        conflicts.append(args)
+        raise StaleDataError('Record is at version 2')
+      return write(*args, **kwargs)
+    monkeypatch.setattr(Product, method, conflicting)
+    assert send(url, json={ 'shopping_cart': True }).status_code == status
+    assert len(conflicts) == 5
+  assert get_product_by_name(client, 'bread').status_code == 404
+
+
+# MULTI-GET TESTS
+
+"""
+GIVEN the product database has two products 
+WHEN a request is sent to get three products by name, one of them not registered  
+THEN the response returns the two products found and the missing name with html code 200 (OK)
+"""
+def test_get_products_by_names(client):
+  create_product(client, { 'name': 'bread' })
+  create_product(client, { 'name': 'butter', 'shopping_cart': True })
+  resp = client.get(urljoin(URL_PREFIX, 'products?names=butter,milk,bread'))
+  assert resp.status_code == 200
+  assert resp.get_json() == {
+    'found': [Product_test('butter', True).to_dict(), Product_test('bread').to_dict()],
+    'missing': ['milk']
+  }
+
+"""
+GIVEN the product database has products of several categories, in the shopping cart or not
+WHEN a request is sent to get products by name in the shopping cart and in a category
+THEN only the products matching the filters are found, the other names are missing
+"""
+def test_get_products_by_names_filtered(client):
+  category = client.post(urljoin(URL_PREFIX, 'categories'), json={ 'name': 'bakery' }).get_json()['id']
+  create_product(client, { 'name': 'bread', 'shopping_cart': True, 'category_id': category })
+  create_product(client, { 'name': 'baguette', 'category_id': category })
+  create_product(client, { 'name': 'butter', 'shopping_cart': True })
+  url = urljoin(URL_PREFIX, 'products?names=bread,baguette,butter&shop=true&category={}'.format(category))
+  resp = client.get(url)
+  assert resp.status_code == 200
+  assert resp.get_json() == {
+    'found': [Product_test('bread', True, category).to_dict()],
+    'missing': ['baguette', 'butter']
+  }
+
+"""
+GIVEN the product database has one product 
+WHEN a request is sent to look up products with the list of names in the body  
+THEN the response returns the product found and the missing names with html code 200 (OK)
+"""
+def test_lookup_products_by_names_in_body(client):
+  create_product(client, { 'name': 'bread' })
+  resp = client.post(urljoin(URL_PREFIX, 'products/lookup'), json={ 'names': ['bread', 'milk', 'bread'] })
+  assert resp.status_code == 200
+  assert resp.get_json() == { 'found': [Product_test('bread').to_dict()], 'missing': ['milk'] }
+  # A product named "lookup" is still reachable
+  assert get_product_by_name(client, 'lookup').status_code == 404
+
+"""
+GIVEN the product database is empty 
+WHEN a request is sent to look up products without a list of names  
+THEN the response returns an error message with html code 400 (Bad Request)
+"""
+def test_lookup_products_without_names(client):
+  resp = client.post(urljoin(URL_PREFIX, 'products/lookup'), json={})
+  assert resp.status_code == 400
+  assert resp.get_json()['message']['names'] == NOT_A_LIST_OF_NAMES
+
+"""
+GIVEN products in the database
+WHEN the products are retrieved by name, with a name repeated and an unknown name
+THEN the products found are returned once by name
+"""
+def test_find_many(client):
+  from myapp.blueprints.product.models import Product
+  create_product(client, { 'name': 'bread' })
+  create_product(client, { 'name': 'butter', 'shopping_cart': True })
+  found = Product.find_many(['bread', 'butter', 'bread', 'milk'])
+  assert sorted(found) == ['bread', 'butter']
+  assert found['butter']['shopping_cart'] == True
@@ -0,0 +1,149 @@
+
+import os
+import threading
+import time
+import pytest
+import sqlalchemy as sa
+from contextlib import contextmanager
+from alembic.runtime.migration import MigrationContext
+from alembic.operations import Operations
+from myapp.online_migrations import backfill, create_index_concurrently, with_lock_timeout
+
+# The tests of the PostgreSQL specific operations run against the database of TEST_DATABASE_URI when it's a
+# PostgreSQL database (ie. a local server started with docker-compose)
+POSTGRES_URI = os.environ.get('TEST_DATABASE_URI', '')
+postgres = pytest.mark.skipif(not POSTGRES_URI.startswith('postgresql'), reason='requires a PostgreSQL database')
+
+ROWS = 2500
+
+
+@contextmanager
+def operations(engine):
+  ''' Run the alembic operations (op) of the block on a connection, like in a migration script '''
+  with engine.connect() as connection:
+    with Operations.context(MigrationContext.configure(connection, opts={ 'transaction_per_migration': True })):
+      yield connection
+
+def create_table(engine, rows=ROWS):
+  with engine.begin() as connection:
+    connection.execute(sa.text('DROP TABLE IF EXISTS online_products'))
+    connection.execute(sa.text("""
+      CREATE TABLE online_products (
+        tenant_id VARCHAR(50) NOT NULL,
+        name VARCHAR(50) NOT NULL,
+        shopping_cart BOOLEAN NOT NULL,
+        PRIMARY KEY (tenant_id, name)
+      )
+    """))
+    connection.execute(sa.text('INSERT INTO online_products VALUES (:tenant_id, :name, :shopping_cart)'), [
+      { 'tenant_id': 'tenant{}'.format(i % 3), 'name': 'product{:05d}'.format(i), 'shopping_cart': False }
+      for i in range(rows)])
+
+@pytest.fixture
+def sqlite_engine(app, tmp_path):
+  engine = sa.create_engine('sqlite:///' + str(tmp_path / 'online.db'))
+  create_table(engine)
+  yield engine
+  engine.dispose()
+
+@pytest.fixture
+def postgres_engine(app):
+  engine = sa.create_engine(POSTGRES_URI)
+  create_table(engine, rows=200000)
+  yield engine
+  with engine.begin() as connection:
+    connection.execute(sa.text('DROP TABLE IF EXISTS online_products'))
+  engine.dispose()
+
+
+"""
+GIVEN a table with rows to backfill
+WHEN the backfill runs in batches
+THEN every row matching the condition is updated, one batch at a time, and the progress is reported
+"""
+def test_backfill_in_batches(sqlite_engine):
+  reports = []
+  with operations(sqlite_engine):
+    updated = backfill('online_products', { 'shopping_cart': True }, where="tenant_id <> 'tenant0'",
+                       batch_size=500, pause=0, progress=lambda done, total: reports.append((done, total)))
+  with sqlite_engine.connect() as connection:
+    counts = dict(connection.execute(sa.text(
+      'SELECT tenant_id, SUM(shopping_cart) FROM online_products GROUP BY tenant_id')).fetchall())
+  assert updated == ROWS - len(range(0, ROWS, 3))
+  assert counts == { 'tenant0': 0, 'tenant1': len(range(1, ROWS, 3)), 'tenant2': len(range(2, ROWS, 3)) }
+  assert len(reports) == -(-updated // 500)
+  assert reports[-1] == (updated, updated)
+
+"""
+GIVEN a database other than PostgreSQL
+WHEN an index is created concurrently
+THEN a plain index is created
+"""
+def test_create_index_concurrently_fallback(sqlite_engine):
+  with operations(sqlite_engine):
+    create_index_concurrently('ix_online_products_cart', 'online_products', ['tenant_id', 'shopping_cart'])
+  assert 'ix_online_products_cart' in [index['name'] for index in sa.inspect(sqlite_engine).get_indexes(
+    'online_products')]
+
+
+def max_write_latency(engine, migration):
+  ''' Run the migration while another connection keeps writing, return the duration of the slowest write '''
+  latencies = []
+  done = threading.Event()
+  def write():
+    with engine.connect() as connection:
+      i = 0
+      while not done.is_set():
+        start = time.perf_counter()
+        connection.execute(sa.text('UPDATE online_products SET shopping_cart = NOT shopping_cart WHERE name = :name'),
+                           { 'name': 'product{:05d}'.format(i % 1000) })
+        latencies.append(time.perf_counter() - start)
+        i += 1
+  writer = threading.Thread(target=write)
+  writer.start()
+  time.sleep(0.1)
+  started = time.perf_counter()
+  migration()
+  duration = time.perf_counter() - started
+  done.set()
+  writer.join()
+  return max(latencies), duration
+
+"""
+GIVEN a large table written continuously
+WHEN an index is created concurrently
+THEN the writes are not blocked for the duration of the build, unlike a plain CREATE INDEX in a transaction
+"""
+@postgres
+def test_create_index_concurrently_doesnt_block_writes(postgres_engine):
+  def plain():
+    with postgres_engine.begin() as connection:
+      connection.execute(sa.text('CREATE INDEX ix_plain ON online_products (shopping_cart, tenant_id)'))
+  def concurrent():
+    with operations(postgres_engine):
+      create_index_concurrently('ix_concurrent', 'online_products', ['shopping_cart', 'tenant_id'])
+  plain_blocked, plain_duration = max_write_latency(postgres_engine, plain)
+  concurrent_blocked, concurrent_duration = max_write_latency(postgres_engine, concurrent)
+  assert plain_blocked > plain_duration / 2, \
+    'plain: writes blocked {:.3f}s (build {:.3f}s)'.format(plain_blocked, plain_duration)
+  assert concurrent_blocked < concurrent_duration / 2, \
+    'concurrent: writes blocked {:.3f}s (build {:.3f}s)'.format(concurrent_blocked, concurrent_duration)
+
+"""
+GIVEN a transaction holding a lock on a table
+WHEN a migration needs a conflicting lock on the table
+THEN it gives up after the lock timeout, retries, and fails once the attempts are exhausted
+"""
+@postgres
+def test_lock_timeout_retries(postgres_engine):
+  with postgres_engine.connect() as blocker:
+    transaction = blocker.begin()
+    blocker.execute(sa.text('SELECT * FROM online_products LIMIT 1'))
+    started = time.perf_counter()
+    with operations(postgres_engine) as connection:
+      with pytest.raises(sa.exc.OperationalError):
+        with_lock_timeout(lambda: connection.execute(sa.text(
+          'ALTER TABLE online_products ADD COLUMN category_id INTEGER')), timeout=100, attempts=3, backoff=0.1)
+    # 3 attempts of 100 ms with 100 + 200 ms of backoff
+    assert 0.6 <= time.perf_counter() - started < 5
+    transaction.rollback()
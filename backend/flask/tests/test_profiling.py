@@ -0,0 +1,81 @@
+
+import time
+import pytest
+from urllib.parse import urljoin
+from myapp.blueprints.product import resources
+from myapp.extensions import profiler
+
+URL_PREFIX = 'api/v1/'
+PROFILE_URL = urljoin(URL_PREFIX, 'admin/profile')
+
+
+@pytest.fixture
+def profiled_client(app, client, monkeypatch):
+  """Enable the profiler for the tests, with a slow DAO query so the requests are long enough to be sampled."""
+  app.config.update(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=0, PROFILING_INTERVAL=0.001,
+                    PROFILING_SECRET_KEY='test-secret')
+  profiler.init_app(app)
+  profiler.reset()
+  find_all_encoded = resources.find_all_encoded
+  def slow_find_all_encoded(filter=None):
+    time.sleep(0.05)
+    return find_all_encoded(filter)
+  monkeypatch.setattr(resources, 'find_all_encoded', slow_find_all_encoded)
+  yield client
+  profiler.enabled = False
+
+def profile_headers():
+  return { 'X-Profile': profiler.token() }
+
+
+"""
+GIVEN the profiler is enabled
+WHEN a request carrying a signed token is sent, and then the profile is requested with the token
+THEN the profile contains the collapsed stacks of the request
+"""
+def test_signed_request_is_profiled(profiled_client):
+  profiled_client.get(urljoin(URL_PREFIX, 'products'), headers=profile_headers())
+  resp = profiled_client.get(PROFILE_URL, headers=profile_headers())
+  assert resp.status_code == 200
+  stacks = resp.get_data(as_text=True).splitlines()
+  # The root frame of the stacks is the rule of the request
+  assert any(stack.split(';')[0] == 'GET /api/v1//products' and 'slow_find_all_encoded' in stack for stack in stacks)
+
+"""
+GIVEN the profiler is enabled and no request is sampled
+WHEN a request without token is sent
+THEN the profile remains empty
+"""
+def test_unsigned_request_is_not_profiled(profiled_client):
+  profiled_client.get(urljoin(URL_PREFIX, 'products'))
+  resp = profiled_client.get(PROFILE_URL, headers=profile_headers())
+  assert resp.get_data(as_text=True) == ''
+
+"""
+GIVEN the profiler is enabled
+WHEN the profile is requested without a valid token
+THEN the response returns html code 403 (Forbidden)
+"""
+def test_profile_requires_token(profiled_client):
+  assert profiled_client.get(PROFILE_URL).status_code == 403
+  assert profiled_client.get(PROFILE_URL, headers={ 'X-Profile': 'forged' }).status_code == 403
+
+"""
+GIVEN the profiler is disabled (default configuration)
+WHEN the application is created
+THEN no request hook nor admin endpoint is registered
+"""
+def test_disabled_profiler_has_no_hooks(app):
+  assert profiler._start not in app.before_request_funcs.get(None, [])
+  assert 'admin_profile' not in app.view_functions
+
+"""
+GIVEN the profiler is enabled without PROFILING_SECRET_KEY
+WHEN the extension is initialized
+THEN it refuses to start, the tokens couldn't be verified by the other workers
+"""
+def test_profiler_requires_secret_key(app):
+  app.config.update(PROFILING_ENABLED=True, PROFILING_SECRET_KEY=None)
+  with pytest.raises(RuntimeError):
+    profiler.init_app(app)
+  profiler.enabled = False
@@ -0,0 +1,93 @@
+
+from datetime import date, datetime, timedelta
+from urllib.parse import urljoin
+from myapp.blueprints.product.models import PurchaseEvent, DailyPurchases
+from myapp.blueprints.product.purchases import record_purchase, purchase_stats, compact_events
+
+URL_PREFIX = 'api/v1/'
+# A Wednesday, its week starts on Monday 2026-10-12
+TODAY = date(2026, 10, 14)
+
+
+def buy(client, name):
+  client.put(urljoin(URL_PREFIX, 'products/{}'.format(name)), json={ 'shopping_cart': True })
+  client.put(urljoin(URL_PREFIX, 'products/{}'.format(name)), json={ 'shopping_cart': False })
+
+def at(day, hour=12):
+  return datetime(day.year, day.month, day.day, hour)
+
+
+"""
+GIVEN a product in the catalog
+WHEN the product leaves the shopping cart twice
+THEN two purchases are recorded and the stats endpoint returns them in the current bucket
+"""
+def test_purchase_recorded_when_leaving_cart(client):
+  client.post(urljoin(URL_PREFIX, 'products'), json={ 'name': 'bread' })
+  buy(client, 'bread')
+  buy(client, 'bread')
+  assert PurchaseEvent.query.count() == 2
+  resp = client.get(urljoin(URL_PREFIX, 'stats?name=bread&period=day&buckets=2'))
+  assert resp.status_code == 200
+  stats = resp.get_json()
+  assert stats['total'] == 2
+  assert [bucket['purchases'] for bucket in stats['buckets']] == [0, 2]
+
+"""
+GIVEN a product in the shopping cart
+WHEN the product leaves the cart and its purchase can't be recorded
+THEN the update fails as a whole: the product stays in the cart and no purchase is counted
+"""
+def test_purchase_recorded_with_product(client, monkeypatch):
+  client.post(urljoin(URL_PREFIX, 'products'), json={ 'name': 'bread', 'shopping_cart': True })
+  def fail(*args):
+    raise RuntimeError('rollups unavailable')
+  monkeypatch.setattr(DailyPurchases, 'increment', fail)
+  resp = client.put(urljoin(URL_PREFIX, 'products/bread'), json={ 'shopping_cart': False })
+  assert resp.status_code == 500
+  monkeypatch.undo()
+  assert client.get(urljoin(URL_PREFIX, 'products/bread')).get_json()['shopping_cart'] is True
+  assert PurchaseEvent.query.count() == 0
+
+"""
+GIVEN purchases recorded over several days
+WHEN the statistics are computed by day and by week
+THEN the purchases are counted in the bucket of their day and of their week
+"""
+def test_purchase_stats_by_day_and_week(client):
+  for day, name in [(TODAY, 'bread'), (TODAY, 'bread'), (TODAY - timedelta(days=1), 'bread'),
+                    (TODAY - timedelta(days=3), 'bread'), (TODAY - timedelta(days=8), 'milk')]:
+    record_purchase(name, at(day))
+  daily = purchase_stats('bread', 'day', 4, today=TODAY)
+  assert daily['start'] == '2026-10-11'
+  assert [bucket['purchases'] for bucket in daily['buckets']] == [1, 0, 1, 2]
+  weekly = purchase_stats('bread', 'week', 2, today=TODAY)
+  assert weekly['buckets'] == [{ 'start': '2026-10-05', 'purchases': 1 }, { 'start': '2026-10-12', 'purchases': 3 }]
+  assert purchase_stats('milk', 'week', 2, today=TODAY)['total'] == 1
+
+"""
+GIVEN purchases older than the retention of the events
+WHEN the events are compacted
+THEN the old events are deleted and the statistics still count their purchases
+"""
+def test_compact_purchase_events(client):
+  old = datetime.utcnow() - timedelta(days=10)
+  record_purchase('bread', old)
+  record_purchase('bread')
+  before = purchase_stats('bread', 'day', 11)
+  assert compact_events(retention_days=5, batch_size=1) == 1
+  assert PurchaseEvent.query.count() == 1
+  assert purchase_stats('bread', 'day', 11) == before
+  assert before['total'] == 2
+
+"""
+GIVEN the stats endpoint
+WHEN an invalid period is requested
+THEN the response returns 400 (Bad Request) with the error message of the period
+"""
+def test_purchase_stats_invalid_period(client):
+  resp = client.get(urljoin(URL_PREFIX, 'stats?name=bread&period=month'))
+  assert resp.status_code == 400
+  assert resp.get_json()['message'] == { 'period': "This value must be 'day' or 'week'" }
+  # The statistics are read per product, the rollups of every product are never scanned
+  assert client.get(urljoin(URL_PREFIX, 'stats?period=week')).status_code == 400
@@ -0,0 +1,84 @@
+
+import threading
+import time
+import pytest
+from urllib.parse import urljoin
+from myapp.singleflight import SingleFlight
+
+URL_PREFIX = 'api/v1/'
+FOLLOWERS = 5
+
+
+def run_followers(group, key, fn, results):
+  # Start the threads calling the same key while the leader is still running
+  threads = [threading.Thread(target=lambda: results.append(group.do(key, fn))) for _ in range(FOLLOWERS)]
+  for thread in threads:
+    thread.start()
+  return threads
+
+
+"""
+GIVEN a call in flight for a key
+WHEN other calls with the same key arrive before it finishes
+THEN the function is executed only once and every call gets the same result
+"""
+def test_identical_calls_are_collapsed():
+  group = SingleFlight()
+  started, release = threading.Event(), threading.Event()
+  executions = []
+  def query():
+    executions.append(1)
+    started.set()
+    release.wait()
+    return 'body'
+  results = []
+  leader = threading.Thread(target=lambda: results.append(group.do('products', query)))
+  leader.start()
+  started.wait()
+  followers = run_followers(group, 'products', query, results)
+  # Wait until every follower is blocked on the leader's call
+  while group.stats()['collapsed'] < FOLLOWERS:
+    time.sleep(0.001)
+  release.set()
+  for thread in [leader] + followers:
+    thread.join()
+  assert len(executions) == 1
+  assert results == ['body'] * (FOLLOWERS + 1)
+  assert group.stats() == { 'requests': FOLLOWERS + 1, 'executions': 1, 'collapsed': FOLLOWERS, 'in_flight': 0 }
+
+"""
+GIVEN a call for a key that has already finished
+WHEN a new call with the same key arrives
+THEN the function is executed again (results are never cached)
+"""
+def test_sequential_calls_are_not_cached():
+  group = SingleFlight()
+  results = iter(['first', 'second'])
+  assert group.do('products', lambda: next(results)) == 'first'
+  assert group.do('products', lambda: next(results)) == 'second'
+  assert group.stats()['collapsed'] == 0
+
+"""
+GIVEN a call in flight raising an exception
+WHEN the leader fails
+THEN the exception is raised to the leader and the key is released
+"""
+def test_failed_call_releases_key():
+  group = SingleFlight()
+  def query():
+    raise ValueError('Cannot complete the operation')
+  with pytest.raises(ValueError):
+    group.do('products', query)
+  assert group.stats()['in_flight'] == 0
+  assert group.do('products', lambda: 'body') == 'body'
+
+"""
+GIVEN the products database
+WHEN a request is sent to get the products and then to get the metrics
+THEN the metrics report the single flight counters
+"""
+def test_metrics_report_single_flight(client):
+  client.get(urljoin(URL_PREFIX, 'products?shop=true'))
+  resp = client.get(urljoin(URL_PREFIX, 'metrics'))
+  assert resp.status_code == 200
+  assert resp.get_json()['single_flight']['executions'] >= 1
@@ -0,0 +1,122 @@
+
+import os
+import time
+import pytest
+from urllib.parse import urljoin
+from myapp.database import db
+
+URL_PREFIX = 'api/v1/'
+
+
+@pytest.fixture
+def snapshot_client(app, client, tmp_path):
+  """Enable the snapshot of the shopping cart in a temporary file for the tests."""
+  app.config['CART_SNAPSHOT_ENABLED'] = True
+  app.config['CART_SNAPSHOT_PATH'] = str(tmp_path / 'cart.snapshot')
+  yield client
+
+def get_cart(client):
+  return client.get(urljoin(URL_PREFIX, 'products?shop=true'))
+
+def create_product(client, product):
+  return client.post(urljoin(URL_PREFIX, 'products'), json=product)
+
+def update_product(client, product):
+  return client.put(urljoin(URL_PREFIX, 'products/{}'.format(product['name'])), json=product)
+
+def delete_product(client, name):
+  return client.delete(urljoin(URL_PREFIX, 'products/{}'.format(name)))
+
+
+"""
+GIVEN the snapshot of the shopping cart is enabled and the snapshot file doesn't exist
+WHEN a request is sent to get the shopping cart
+THEN the snapshot is built from the database and the response returns the products in the cart
+"""
+def test_cart_snapshot_built_on_first_read(app, snapshot_client):
+  create_product(snapshot_client, { 'name': 'bread', 'shopping_cart': True })
+  create_product(snapshot_client, { 'name': 'butter' })
+  # One snapshot file per tenant
+  path = app.config['CART_SNAPSHOT_PATH'] + '.' + app.config['DEFAULT_TENANT']
+  assert not os.path.exists(path)
+  resp = get_cart(snapshot_client)
+  assert resp.status_code == 200
+  assert resp.get_json() == [{ 'name': 'bread', 'shopping_cart': True, 'category_id': None }]
+  assert os.path.exists(path)
+
+"""
+GIVEN the snapshot of the shopping cart has been built
+WHEN products enter and leave the cart through the API
+THEN the snapshot is updated incrementally with the changes
+"""
+def test_cart_snapshot_updated_with_cart_changes(snapshot_client):
+  create_product(snapshot_client, { 'name': 'bread', 'shopping_cart': True })
+  create_product(snapshot_client, { 'name': 'butter' })
+  create_product(snapshot_client, { 'name': 'milk', 'shopping_cart': True })
+  assert len(get_cart(snapshot_client).get_json()) == 2
+  update_product(snapshot_client, { 'name': 'butter', 'shopping_cart': True })
+  update_product(snapshot_client, { 'name': 'bread', 'shopping_cart': False })
+  delete_product(snapshot_client, 'milk')
+  assert get_cart(snapshot_client).get_json() == [{ 'name': 'butter', 'shopping_cart': True, 'category_id': None }]
+
+"""
+GIVEN the snapshot of the shopping cart has been built
+WHEN the products table changes without going through the CRUD operations (ie. another service)
+THEN the shopping cart is served from the snapshot without querying the database until the snapshot expires, then
+     it's built again from the database
+"""
+def test_cart_snapshot_expires(app, sql_engine, snapshot_client):
+  app.config['CART_SNAPSHOT_TTL'] = 0.2
+  create_product(snapshot_client, { 'name': 'bread', 'shopping_cart': True })
+  get_cart(snapshot_client)
+  db.session.execute('DELETE FROM products')
+  db.session.commit()
+  assert get_cart(snapshot_client).get_json() == [{ 'name': 'bread', 'shopping_cart': True, 'category_id': None }]
+  time.sleep(0.3)
+  assert get_cart(snapshot_client).get_json() == []
+
+"""
+GIVEN the snapshot of the shopping cart is enabled
+WHEN the shopping cart page is requested
+THEN the page contains the table rendered in the snapshot
+"""
+def test_cart_snapshot_html(snapshot_client):
+  create_product(snapshot_client, { 'name': 'bread', 'shopping_cart': True })
+  resp = snapshot_client.get('/products/shop/')
+  assert resp.status_code == 200
+  assert b'<td>bread</td>' in resp.data
+
+"""
+GIVEN the snapshot of the shopping cart has been built
+WHEN the listeners of two concurrent updates of a product run in the reverse order of their commits
+THEN the snapshot reflects the last committed state of the product
+"""
+def test_cart_snapshot_listeners_out_of_order(snapshot_client):
+  from myapp.blueprints.product.resources import update_cart_snapshot
+  create_product(snapshot_client, { 'name': 'bread' })
+  assert get_cart(snapshot_client).get_json() == []
+  update_product(snapshot_client, { 'name': 'bread', 'shopping_cart': True })
+  update_product(snapshot_client, { 'name': 'bread', 'shopping_cart': False })
+  # The listener of the first update runs last, with the state of its own commit
+  update_cart_snapshot('update', { 'name': 'bread', 'shopping_cart': True, 'version': 2 }, { 'shopping_cart': True })
+  assert get_cart(snapshot_client).get_json() == []
+
+"""
+GIVEN a snapshot file written before the app started (ie. before a restart or a restore of the database)
+WHEN the shopping cart is requested
+THEN the snapshot is built again from the database
+"""
+def test_cart_snapshot_of_previous_epoch_rebuilt(app, snapshot_client):
+  from myapp.blueprints.product.resources import cart_snapshot
+  create_product(snapshot_client, { 'name': 'bread', 'shopping_cart': True })
+  get_cart(snapshot_client)
+  epoch = cart_snapshot.epoch
+  try:
+    # Restart: the snapshot of the new app has a new epoch, the database changed meanwhile
+    cart_snapshot.epoch = b'0' * 16
+    cart_snapshot._maps.clear()
+    update_product(snapshot_client, { 'name': 'bread', 'shopping_cart': False })
+    create_product(snapshot_client, { 'name': 'milk', 'shopping_cart': True })
+    assert get_cart(snapshot_client).get_json() == [{ 'name': 'milk', 'shopping_cart': True, 'category_id': None }]
+  finally:
+    cart_snapshot.epoch = epoch
@@ -0,0 +1,56 @@
+
+import threading
+import pytest
+from urllib.parse import urljoin
+from config import configs
+from myapp import create_app
+from myapp.database import db
+
+URL_PREFIX = 'api/v1/'
+WRITERS = 8
+
+
+@pytest.fixture
+def sqlite_app(monkeypatch, tmp_path):
+  """Create an application with the SQLite production profile on a temporary database."""
+  monkeypatch.setattr(configs['sqlite'], 'SQLALCHEMY_DATABASE_URI', 'sqlite:///' + str(tmp_path / 'myapp.db'))
+  app = create_app('sqlite')
+  app.config['CART_SNAPSHOT_ENABLED'] = False
+  with app.app_context():
+    db.create_all()
+  yield app
+  with app.app_context():
+    db.session.close()
+    db.get_engine(app).dispose()
+
+
+"""
+GIVEN the SQLite production profile
+WHEN a connection to the database is opened
+THEN the pragmas of the profile are applied to the connection
+"""
+def test_sqlite_pragmas_applied_on_connect(sqlite_app):
+  with sqlite_app.app_context():
+    assert db.session.execute('PRAGMA journal_mode').scalar() == 'wal'
+    assert db.session.execute('PRAGMA synchronous').scalar() == 1
+    assert db.session.execute('PRAGMA busy_timeout').scalar() == 5000
+    assert db.session.execute('PRAGMA cache_size').scalar() == -64 * 1024
+
+"""
+GIVEN the SQLite production profile
+WHEN several threads create products at the same time
+THEN the writes are serialized and every product is created
+"""
+def test_sqlite_concurrent_writers(sqlite_app):
+  statuses = []
+  def create(i):
+    with sqlite_app.test_client() as client:
+      statuses.append(client.post(urljoin(URL_PREFIX, 'products'), json={ 'name': 'product{}'.format(i) }).status_code)
+  threads = [threading.Thread(target=create, args=(i,)) for i in range(WRITERS)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert statuses == [201] * WRITERS
+  with sqlite_app.test_client() as client:
+    assert len(client.get(urljoin(URL_PREFIX, 'products')).get_json()) == WRITERS
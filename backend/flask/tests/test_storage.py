@@ -0,0 +1,135 @@
+
+import threading
+import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from myapp.blueprints.product.models import Product
+from myapp.storage import MemoryEngine, SQLEngine, DuplicateKeyError
+
+
+@pytest.fixture
+def log_path(app, tmp_path):
+  yield str(tmp_path / 'products.log')
+
+
+"""
+GIVEN a memory engine persisting its operations in a log
+WHEN the engine is restarted on the same log
+THEN the records created, updated and deleted before the restart are recovered
+"""
+def test_memory_engine_recovers_from_log(log_path):
+  engine = MemoryEngine(log_path)
+  engine.create(Product, { 'name': 'bread', 'shopping_cart': True })
+  engine.create(Product, { 'name': 'butter', 'shopping_cart': False })
+  engine.create(Product, { 'name': 'milk', 'shopping_cart': False })
+  engine.update_one(Product, { 'name': 'butter' }, { 'shopping_cart': True })
+  engine.delete_one(Product, { 'name': 'milk' })
+  engine.close()
+  engine = MemoryEngine(log_path)
+  assert [product['name'] for product in engine.find_all(Product)] == ['bread', 'butter']
+  assert engine.find_one(Product, { 'name': 'butter' })['version'] == 2
+
+"""
+GIVEN a memory engine compacting its log into a snapshot every 2 operations
+WHEN the engine is restarted after several snapshots
+THEN the records are recovered from the snapshot and the operations logged after it
+"""
+def test_memory_engine_recovers_from_snapshot(log_path):
+  engine = MemoryEngine(log_path, snapshot_every=2)
+  for name in ('bread', 'butter', 'milk', 'eggs', 'flour'):
+    engine.create(Product, { 'name': name, 'shopping_cart': False })
+  engine.delete_one(Product, { 'name': 'eggs' })
+  engine.update_one(Product, { 'name': 'flour' }, { 'shopping_cart': True })
+  # Only the operations after the last snapshot remain in the log
+  with open(log_path) as f:
+    assert len(f.readlines()) == 1
+  engine.close()
+  engine = MemoryEngine(log_path, snapshot_every=2)
+  assert [product['name'] for product in engine.find_all(Product)] == ['bread', 'butter', 'flour', 'milk']
+  assert engine.find_all(Product, { 'shopping_cart': True }) == [engine.find_one(Product, { 'name': 'flour' })]
+
+"""
+GIVEN a memory engine with a product
+WHEN the product is created again or updated with a stale version
+THEN DuplicateKeyError and StaleDataError are raised like with the SQL engine
+"""
+def test_memory_engine_errors(app):
+  engine = MemoryEngine()
+  engine.create(Product, { 'name': 'bread', 'shopping_cart': False })
+  with pytest.raises(DuplicateKeyError):
+    engine.create(Product, { 'name': 'bread', 'shopping_cart': True })
+  engine.update_one(Product, { 'name': 'bread' }, { 'shopping_cart': True }, if_match=[1])
+  with pytest.raises(StaleDataError):
+    engine.update_one(Product, { 'name': 'bread' }, { 'shopping_cart': False }, if_match=[1])
+  with pytest.raises(StaleDataError):
+    engine.delete_one(Product, { 'name': 'bread' }, if_match=[1])
+  assert engine.delete_one(Product, { 'name': 'bread' }, if_match=[2])['name'] == 'bread'
+
+"""
+GIVEN a memory engine restarted on its log, whose products haven't been read since
+WHEN the log is compacted into a snapshot and the engine is restarted again
+THEN the products not replayed yet are kept in the snapshot
+"""
+def test_memory_engine_snapshot_keeps_pending_tables(log_path):
+  engine = MemoryEngine(log_path)
+  for name in ('bread', 'butter', 'milk'):
+    engine.create(Product, { 'name': name, 'shopping_cart': False })
+  engine.delete_one(Product, { 'name': 'milk' })
+  engine.close()
+  engine = MemoryEngine(log_path)
+  engine.snapshot()
+  engine.close()
+  engine = MemoryEngine(log_path)
+  assert [product['name'] for product in engine.find_all(Product)] == ['bread', 'butter']
+
+"""
+GIVEN a memory engine persisting its operations in a log
+WHEN another engine (ie. another worker process) is started on the same log
+THEN it fails to start
+"""
+def test_memory_engine_log_locked(log_path):
+  engine = MemoryEngine(log_path)
+  with pytest.raises(RuntimeError):
+    MemoryEngine(log_path)
+  engine.close()
+  MemoryEngine(log_path).close()
+
+"""
+GIVEN a memory engine writing a product whose derived data is being committed to the database
+WHEN the products are read meanwhile
+THEN the reads don't wait for the commit, they return the product as it was before the write
+"""
+def test_memory_engine_reads_during_commit(app, monkeypatch):
+  engine = MemoryEngine()
+  engine.create(Product, { 'name': 'bread', 'shopping_cart': False })
+  committing, release = threading.Event(), threading.Event()
+  commit = Product.commit
+  def slow_commit():
+    committing.set()
+    release.wait(5)
+    commit()
+  monkeypatch.setattr(Product, 'commit', slow_commit)
+  def update():
+    with app.app_context():
+      engine.update_one(Product, { 'name': 'bread' }, { 'shopping_cart': True })
+  writer = threading.Thread(target=update)
+  writer.start()
+  try:
+    assert committing.wait(5)
+    assert engine.find_one(Product, { 'name': 'bread' })['shopping_cart'] == False
+  finally:
+    release.set()
+    writer.join()
+  assert engine.find_one(Product, { 'name': 'bread' })['shopping_cart'] == True
+
+"""
+GIVEN the SQL engine
+WHEN a product violating another constraint than its key is created
+THEN the integrity error is raised as is, not as a duplicate key
+"""
+def test_sql_engine_integrity_errors(client, sql_engine):
+  SQLEngine().create(Product, { 'name': 'bread', 'shopping_cart': False })
+  with pytest.raises(DuplicateKeyError):
+    SQLEngine().create(Product, { 'name': 'bread', 'shopping_cart': False })
+  with pytest.raises(IntegrityError):
+    SQLEngine().create(Product, { 'name': 'butter', 'shopping_cart': None })
@@ -0,0 +1,134 @@
+
+import pytest
+from datetime import date, datetime, timedelta
+from urllib.parse import urljoin
+from myapp.blueprints.product.purchases import record_purchase
+from myapp.blueprints.product.suggestions import CoOccurrence, suggestions
+
+URL_PREFIX = 'api/v1/'
+TODAY = date(2026, 10, 14)
+
+
+@pytest.fixture(autouse=True)
+def fresh_suggestions():
+  # The matrices are kept by the worker (module state), each test starts without any
+  suggestions.clear()
+  yield
+  suggestions.clear()
+
+def trips(*baskets):
+  ''' Return the purchases of one basket per day '''
+  return [(name, TODAY - timedelta(days=day)) for day, basket in enumerate(baskets) for name in basket]
+
+def buy(client, name):
+  client.put(urljoin(URL_PREFIX, 'products/{}'.format(name)), json={ 'shopping_cart': True })
+  client.put(urljoin(URL_PREFIX, 'products/{}'.format(name)), json={ 'shopping_cart': False })
+
+
+"""
+GIVEN purchases grouped in shopping trips
+WHEN the suggestions for a cart are computed
+THEN the products are ranked by the number of trips they share with the cart, the cart itself excluded
+"""
+def test_co_occurrence_ranking():
+  model = CoOccurrence(max_products=100, max_pairs=1000)
+  model.build(trips(['bread', 'butter', 'jam'], ['bread', 'butter'], ['bread', 'milk'], ['milk', 'cereals']))
+  assert model.suggest(['bread'], 5) == [('butter', 2), ('jam', 1), ('milk', 1)]
+  assert model.suggest(['bread', 'milk'], 1) == [('butter', 2)]
+  assert ('cereals', 1) in model.suggest(['bread', 'milk'], 3)
+  assert model.suggest(['unknown'], 5) == []
+
+"""
+GIVEN a co-occurrence matrix
+WHEN purchases are added incrementally
+THEN they are counted with the products of the same trip, before and after being merged into the matrix
+"""
+def test_co_occurrence_incremental():
+  model = CoOccurrence(max_products=100, max_pairs=1000)
+  model.build(trips(['bread', 'butter']))
+  model.add_purchase('jam', TODAY + timedelta(days=1))
+  model.add_purchase('bread', TODAY + timedelta(days=1))
+  model.add_purchase('bread', TODAY + timedelta(days=1))
+  assert model.suggest(['bread'], 5) == [('butter', 1), ('jam', 1)]
+  model.merge()
+  assert not model.pending
+  assert model.suggest(['jam'], 5) == [('bread', 1)]
+
+"""
+GIVEN more pairs of products than the budget of the matrix
+WHEN the matrix is built
+THEN the counts are halved until the matrix fits, the pairs seen once are dropped and the ranking is kept
+"""
+def test_co_occurrence_bounded():
+  baskets = [['bread', 'butter']] * 4 + [['product{}'.format(i), 'product{}'.format(i + 1)] for i in range(50)]
+  model = CoOccurrence(max_products=100, max_pairs=10)
+  model.build(trips(*baskets))
+  assert model.matrix.nnz <= 10
+  assert model.suggest(['bread'], 5) == [('butter', 2)]
+
+"""
+GIVEN more products than the matrix holds
+WHEN the matrix is built and new products are bought
+THEN the products bought the most often are kept, and the new products are dropped with a warning
+"""
+def test_co_occurrence_full(caplog):
+  baskets = [['product{}'.format(i), 'product{}'.format(i + 1)] for i in range(50)] + [['bread', 'butter']] * 4
+  full = CoOccurrence(max_products=5, max_pairs=1000)
+  full.build(trips(*baskets))
+  assert len(full.names) == 5
+  assert full.suggest(['bread'], 5) == [('butter', 4)]
+  full.add_purchase('jam', TODAY)
+  full.add_purchase('cheese', TODAY)
+  assert 'jam' not in full.index
+  assert [record.message for record in caplog.records] == [
+    'The suggestions matrix is full (5 products), the new products are not counted until it is rebuilt']
+
+"""
+GIVEN the view of a cart taken from a matrix
+WHEN purchases are merged into the matrix before the view is scored
+THEN the view is scored from the matrix it was taken from (the matrices are never modified once built)
+"""
+def test_co_occurrence_view():
+  model = CoOccurrence(max_products=100, max_pairs=2)
+  model.build(trips(['bread', 'butter']))
+  view = model.view(['bread'])
+  model.add_purchase('bread', TODAY + timedelta(days=1))
+  model.add_purchase('jam', TODAY + timedelta(days=1))
+  model.merge()
+  assert model.score(view, 5) == [('butter', 1)]
+  assert model.suggest(['bread'], 5) == []
+
+"""
+GIVEN products bought together during the same day
+WHEN the suggestions for a product are requested
+THEN the products bought with it are returned, except the products deleted since
+"""
+def test_suggestions_endpoint(client, sql_engine):
+  for name in ['bread', 'butter', 'jam', 'milk']:
+    client.post(urljoin(URL_PREFIX, 'products'), json={ 'name': name })
+  for day in range(3):
+    record_purchase('bread', datetime.utcnow() - timedelta(days=day))
+    record_purchase('butter', datetime.utcnow() - timedelta(days=day))
+  record_purchase('jam', datetime.utcnow())
+  record_purchase('milk', datetime.utcnow())
+  client.delete(urljoin(URL_PREFIX, 'products/milk'))
+  resp = client.get(urljoin(URL_PREFIX, 'suggestions?names=bread&limit=5'))
+  assert resp.status_code == 200
+  assert resp.get_json() == [{ 'name': 'butter', 'trips': 3 }, { 'name': 'jam', 'trips': 1 }]
+  assert client.get(urljoin(URL_PREFIX, 'suggestions?limit=0')).status_code == 400
+
+"""
+GIVEN a loaded co-occurrence matrix
+WHEN products leave the shopping cart and the suggestions for the cart are requested
+THEN the new purchases are counted without rebuilding the matrix
+"""
+def test_suggestions_for_cart(client, sql_engine):
+  for name in ['bread', 'butter', 'jam']:
+    client.post(urljoin(URL_PREFIX, 'products'), json={ 'name': name })
+  assert client.get(urljoin(URL_PREFIX, 'suggestions')).get_json() == []
+  buy(client, 'bread')
+  buy(client, 'jam')
+  client.put(urljoin(URL_PREFIX, 'products/bread'), json={ 'shopping_cart': True })
+  resp = client.get(urljoin(URL_PREFIX, 'suggestions'))
+  assert resp.status_code == 200
+  assert resp.get_json() == [{ 'name': 'jam', 'trips': 1 }]
@@ -0,0 +1,68 @@
+
+import pytest
+from urllib.parse import urljoin
+
+URL_PREFIX = 'api/v1/'
+
+
+@pytest.fixture(autouse=True)
+def trusted_header(app):
+  """The tenant header is set by a trusted proxy in these tests."""
+  app.config['TENANT_HEADER_TRUSTED'] = True
+
+
+def tenant_headers(tenant):
+  return { 'X-Tenant': tenant }
+
+def get_products(client, tenant, query=''):
+  return client.get(urljoin(URL_PREFIX, 'products' + query), headers=tenant_headers(tenant))
+
+def create_product(client, tenant, product):
+  return client.post(urljoin(URL_PREFIX, 'products'), json=product, headers=tenant_headers(tenant))
+
+
+"""
+GIVEN two tenants
+WHEN both tenants create a product with the same name
+THEN each tenant gets its own product with html code 201 (Created)
+"""
+def test_same_product_name_in_two_tenants(client):
+  assert create_product(client, 'alice', { 'name': 'bread', 'shopping_cart': True }).status_code == 201
+  assert create_product(client, 'bob', { 'name': 'bread' }).status_code == 201
+  assert create_product(client, 'bob', { 'name': 'bread' }).status_code == 400
+
+"""
+GIVEN two tenants with different products
+WHEN each tenant requests its products, its shopping cart or a product by name
+THEN only the products of the tenant are returned
+"""
+def test_products_isolated_by_tenant(client):
+  create_product(client, 'alice', { 'name': 'bread', 'shopping_cart': True })
+  create_product(client, 'bob', { 'name': 'butter', 'shopping_cart': True })
+  assert [p['name'] for p in get_products(client, 'alice').get_json()] == ['bread']
+  assert [p['name'] for p in get_products(client, 'bob', '?shop=true').get_json()] == ['butter']
+  assert get_products(client, 'bob', '/bread').status_code == 404
+  resp = client.delete(urljoin(URL_PREFIX, 'products/bread'), headers=tenant_headers('bob'))
+  assert resp.status_code == 404
+  assert len(get_products(client, 'alice').get_json()) == 1
+
+"""
+GIVEN a request with a tenant header containing invalid characters
+WHEN the request is sent to get the products
+THEN the response returns html code 400 (Bad Request)
+"""
+def test_invalid_tenant(client):
+  assert get_products(client, '../etc').status_code == 400
+
+"""
+GIVEN the tenant header is not trusted (no proxy setting it) and the authentication is disabled
+WHEN a request is sent with the tenant header of another tenant
+THEN the response returns html code 403 (Forbidden), and the requests without header use the default tenant
+"""
+def test_untrusted_tenant_header(app, client):
+  app.config['TENANT_HEADER_TRUSTED'] = False
+  assert create_product(client, 'alice', { 'name': 'bread' }).status_code == 403
+  assert get_products(client, 'alice').status_code == 403
+  assert client.post(urljoin(URL_PREFIX, 'products'), json={ 'name': 'bread' }).status_code == 201
+  app.config['TENANT_HEADER_TRUSTED'] = True
+  assert get_products(client, 'alice').get_json() == []
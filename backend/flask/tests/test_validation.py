@@ -0,0 +1,78 @@
+
+import pytest
+from flask import request
+from werkzeug.exceptions import BadRequest
+from myapp.validation import compile_validator
+
+PROPERTIES = {
+  'name': { 'type': 'string', 'x-error-message': "Field 'name' is required" },
+  'shopping_cart': { 'type': 'boolean', 'default': False, 'x-error-message': 'This value must be boolean' }
+}
+
+
+def validate(app, validator, json):
+  with app.test_request_context(json=json):
+    return validator(request)
+
+
+"""
+GIVEN a validator compiled from a schema with a required field and a defaulted field
+WHEN a payload without the defaulted field is validated
+THEN the values are converted and the missing field takes the default value
+"""
+def test_compiled_validator_converts_and_defaults(app):
+  validator = compile_validator(PROPERTIES, ['name'])
+  assert validate(app, validator, { 'name': 'bread' }) == { 'name': 'bread', 'shopping_cart': False }
+  assert validate(app, validator, { 'name': 'bread', 'shopping_cart': 'TRUE' })['shopping_cart'] == True
+
+"""
+GIVEN a validator compiled from a schema bundling the errors
+WHEN a payload with several invalid fields is validated
+THEN the request is aborted with 400 (Bad Request) and the error message of every field
+"""
+def test_compiled_validator_bundles_errors(app):
+  validator = compile_validator(PROPERTIES, ['name'])
+  with pytest.raises(BadRequest) as error:
+    validate(app, validator, { 'shopping_cart': 3 })
+  assert error.value.data['message'] == { 'name': "Field 'name' is required",
+                                          'shopping_cart': 'This value must be boolean' }
+
+"""
+GIVEN a partial validator (updates)
+WHEN an empty payload is validated
+THEN no field is required nor defaulted
+"""
+def test_partial_validator(app):
+  validator = compile_validator(PROPERTIES, ['name'], partial=True, exclude=['name'])
+  assert validate(app, validator, {}) == {}
+  assert validate(app, validator, { 'name': 'butter', 'shopping_cart': '0' }) == { 'shopping_cart': False }
+
+"""
+GIVEN a validator compiled from a schema with an enum and a range
+WHEN values outside of the enum or the range are validated
+THEN the request is aborted with 400 (Bad Request) and the error message of the fields
+"""
+def test_compiled_validator_constraints(app):
+  validator = compile_validator({
+    'period': { 'type': 'string', 'enum': ['day', 'week'], 'default': 'week', 'x-error-message': 'Invalid period' },
+    'buckets': { 'type': 'integer', 'minimum': 1, 'maximum': 10, 'x-error-message': 'Invalid buckets' }
+  })
+  assert validate(app, validator, { 'buckets': '10' }) == { 'period': 'week', 'buckets': 10 }
+  with pytest.raises(BadRequest) as error:
+    validate(app, validator, { 'period': 'month', 'buckets': 0 })
+  assert error.value.data['message'] == { 'period': 'Invalid period', 'buckets': 'Invalid buckets' }
+
+"""
+GIVEN a validator of the body of the requests
+WHEN the body is sent as JSON but is malformed or isn't an object
+THEN the request is aborted with 400 (Bad Request) instead of reading the form values
+"""
+def test_malformed_json_body(app):
+  validator = compile_validator(PROPERTIES, ['name'])
+  for body in ('{"name": "bread"', '["bread"]'):
+    with app.test_request_context('/?name=bread', data=body, content_type='application/json'):
+      with pytest.raises(BadRequest) as error:
+        validator(request)
+    assert error.value.data['message'] == 'The body of the request must be a JSON object'
+  with app.test_request_context(data={ 'name': 'bread' }):
+    assert validator(request)['name'] == 'bread'
@@ -0,0 +1,70 @@
+import pytest
+
+from urllib.parse import urljoin
+from myapp.extensions import warmup
+
+URL_PREFIX = 'api/v1/'
+
+
+"""
+GIVEN a worker that hasn't been warmed up
+WHEN the health endpoints are requested
+THEN the worker is live but not ready
+"""
+def test_worker_not_ready_before_warmup(client):
+  assert client.get(urljoin(URL_PREFIX, 'health/live')).status_code == 200
+  resp = client.get(urljoin(URL_PREFIX, 'health/ready'))
+  assert resp.status_code == 503
+  assert resp.get_json() == { 'status': 'warming up' }
+
+"""
+GIVEN an app served without gunicorn (ie. flask run), which doesn't warm the worker up
+WHEN the readiness endpoint is requested
+THEN the first request warms the worker up and it's ready
+"""
+def test_worker_warmed_up_by_first_request(app, client):
+  app.config['WARMUP_ON_FIRST_REQUEST'] = True
+  resp = client.get(urljoin(URL_PREFIX, 'health/ready'))
+  assert resp.status_code == 200
+  assert resp.get_json() == { 'status': 'ready' }
+
+"""
+GIVEN the snapshot of the shopping cart is enabled
+WHEN the worker is warmed up
+THEN the snapshot is built and the worker is ready
+"""
+def test_worker_ready_after_warmup(app, client, tmp_path):
+  app.config['CART_SNAPSHOT_ENABLED'] = True
+  app.config['CART_SNAPSHOT_PATH'] = str(tmp_path / 'cart.snapshot')
+  warmup.run(app)
+  assert (tmp_path / 'cart.snapshot.default').exists()
+  resp = client.get(urljoin(URL_PREFIX, 'health/ready'))
+  assert resp.status_code == 200
+  assert resp.get_json() == { 'status': 'ready' }
+
+"""
+GIVEN a warmed up worker
+WHEN one of its dependencies fails (ie. the shopping cart snapshot can't be read or built)
+THEN the worker is not ready anymore
+"""
+def test_worker_not_ready_when_dependency_fails(app, client, tmp_path):
+  app.config['CART_SNAPSHOT_ENABLED'] = True
+  app.config['CART_SNAPSHOT_PATH'] = str(tmp_path / 'cart.snapshot')
+  warmup.run(app)
+  assert client.get(urljoin(URL_PREFIX, 'health/ready')).status_code == 200
+  app.config['CART_SNAPSHOT_PATH'] = str(tmp_path / 'missing' / 'cart.snapshot')
+  resp = client.get(urljoin(URL_PREFIX, 'health/ready'))
+  assert resp.status_code == 503
+  assert resp.get_json() == { 'status': 'unavailable', 'check': 'cart_snapshot_readable' }
+
+"""
+GIVEN the production configuration without database URI
+WHEN the app is created
+THEN it refuses to start instead of using a separate in-memory database in each worker
+"""
+def test_prod_requires_database(monkeypatch):
+  from config import configs
+  from myapp import create_app
+  monkeypatch.setattr(configs['prod'], 'SQLALCHEMY_DATABASE_URI', None)
+  with pytest.raises(RuntimeError):
+    create_app('prod')
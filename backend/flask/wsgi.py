@@ -1,13 +1,15 @@
 from myapp import create_app
+from myapp.extensions import warmup
 import os
 
 # When setting up a production web server to point to your app, you will almost always configure it to point
 # to wsgi.py, which in turn imports and starts our entire app
 
-# Set OS environment variable to select the configuration file to load based on the deployment environment
-os.environ["APP_CONFIG_FILE"] = os.path.join(os.getcwd(), 'config/production.py')
-
-app = create_app()
+# Own custom environment variable selecting the configuration of the deployment environment (dev, test, prod,
+# sqlite), see config.py
+app = create_app(os.environ.get('APP_CONFIG_ENV', 'prod'))
 
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', port=8081)
\ No newline at end of file
+    # The development server has a single process, it's warmed up before serving
+    warmup.run(app)
+    app.run(host='0.0.0.0', port=8081)
@@ -72,10 +72,24 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # Online migrations (see myapp/online_migrations.py): each migration runs in its own transaction, so the
+    # migrations building indexes concurrently or backfilling in batches can commit outside of it, and on
+    # PostgreSQL the DDL statements give up on their locks after MIGRATIONS_LOCK_TIMEOUT milliseconds instead of
+    # blocking the queries queued behind them
+    app_config = current_app.config
+    configure_args = dict(current_app.extensions['migrate'].configure_args)
+    configure_args.setdefault('transaction_per_migration',
+                              app_config.get('MIGRATIONS_TRANSACTION_PER_MIGRATION', False))
+    connect_args = {}
+    if config.get_main_option('sqlalchemy.url').startswith('postgresql') and \
+            app_config.get('MIGRATIONS_LOCK_TIMEOUT'):
+        connect_args['options'] = '-c lock_timeout={:d}'.format(app_config['MIGRATIONS_LOCK_TIMEOUT'])
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section),
         prefix='sqlalchemy.',
         poolclass=pool.NullPool,
+        connect_args=connect_args,
     )
 
     with connectable.connect() as connection:
@@ -83,7 +97,7 @@ def run_migrations_online():
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
-            **current_app.extensions['migrate'].configure_args
+            **configure_args
         )
 
         with context.begin_transaction():
@@ -0,0 +1,29 @@
+"""create products table
+
+Revision ID: 5a1c3e7b9d20
+Revises: 
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a1c3e7b9d20'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'products',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('shopping_cart', sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('products')
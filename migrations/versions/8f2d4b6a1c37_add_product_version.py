@@ -0,0 +1,27 @@
+"""add version column to products for optimistic concurrency control
+
+Revision ID: 8f2d4b6a1c37
+Revises: 5a1c3e7b9d20
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f2d4b6a1c37'
+down_revision = '5a1c3e7b9d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows start at version 1, the server default keeps the column filled without rewriting them
+    # in a separate backfill
+    op.add_column('products', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('products') as batch_op:
+        batch_op.drop_column('version')
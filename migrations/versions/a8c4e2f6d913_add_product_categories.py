@@ -0,0 +1,67 @@
+"""add the categories of the products and their counters
+
+Revision ID: a8c4e2f6d913
+Revises: f3a9c6e1b702
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from myapp.online_migrations import create_index_concurrently, drop_index_concurrently, with_lock_timeout
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8c4e2f6d913'
+down_revision = 'f3a9c6e1b702'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'categories',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('tenant_id', sa.String(length=50), nullable=False),
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('aisle', sa.String(length=50), nullable=True),
+        sa.PrimaryKeyConstraint('id', name='pk_categories'),
+        sa.UniqueConstraint('tenant_id', 'name', name='uq_categories_name')
+    )
+    # One row per category, created with the category and updated with the writes of its products
+    op.create_table(
+        'category_counts',
+        sa.Column('tenant_id', sa.String(length=50), nullable=False),
+        sa.Column('category_id', sa.Integer(), nullable=False),
+        sa.Column('products', sa.Integer(), nullable=False),
+        sa.Column('in_cart', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('tenant_id', 'category_id', name='pk_category_counts'),
+        sa.ForeignKeyConstraint(['category_id'], ['categories.id'], name='fk_category_counts_category')
+    )
+
+    # The existing products have no category, so there is nothing to backfill and no counter to initialize
+    if op.get_bind().dialect.name != 'postgresql':
+        with op.batch_alter_table('products') as batch_op:
+            batch_op.add_column(sa.Column('category_id', sa.Integer(), nullable=True))
+            batch_op.create_foreign_key('fk_products_category', 'categories', ['category_id'], ['id'])
+    else:
+        # A nullable column without default only changes the catalog, it doesn't rewrite the table. Adding the
+        # foreign key scans the partitions to validate it (the column is empty), both wait for their lock for a
+        # short time only so the traffic doesn't queue behind them
+        with_lock_timeout(lambda: op.add_column('products', sa.Column('category_id', sa.Integer(), nullable=True)))
+        with_lock_timeout(lambda: op.create_foreign_key('fk_products_category', 'products', 'categories',
+                                                        ['category_id'], ['id']))
+    # Products of a category (/products?category=), built without blocking the writes
+    create_index_concurrently('ix_products_category', 'products', ['tenant_id', 'category_id'])
+
+
+def downgrade():
+    drop_index_concurrently('ix_products_category', 'products')
+    if op.get_bind().dialect.name != 'postgresql':
+        with op.batch_alter_table('products') as batch_op:
+            batch_op.drop_constraint('fk_products_category', type_='foreignkey')
+            batch_op.drop_column('category_id')
+    else:
+        with_lock_timeout(lambda: op.drop_constraint('fk_products_category', 'products', type_='foreignkey'))
+        with_lock_timeout(lambda: op.drop_column('products', 'category_id'))
+    op.drop_table('category_counts')
+    op.drop_table('categories')
@@ -0,0 +1,212 @@
+"""partition products by tenant
+
+Revision ID: c4e9a2f7b815
+Revises: 8f2d4b6a1c37
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+import logging
+import time
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+from myapp.online_migrations import config, with_lock_timeout
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e9a2f7b815'
+down_revision = '8f2d4b6a1c37'
+branch_labels = None
+depends_on = None
+
+
+logger = logging.getLogger('alembic.online')
+
+PRODUCT_COLUMNS = 'tenant_id, name, shopping_cart, version'
+
+# Copies a batch of products following the last name copied (the products table is keyed by name only)
+COPY_BATCH = sa.text("""
+    INSERT INTO products_partitioned ({0})
+    SELECT 'default', name, shopping_cart, version FROM products
+    WHERE CAST(:last AS VARCHAR) IS NULL OR name > :last
+    ORDER BY name LIMIT :batch_size
+    ON CONFLICT (tenant_id, name) DO NOTHING
+    RETURNING name
+""".format(PRODUCT_COLUMNS))
+
+# The writes made on the products during the copy are recorded by a trigger in a changelog (append only, so a
+# write committed while the changelog is applied is never lost)
+RECORD_CHANGES = [
+    """
+    CREATE TABLE products_changes (
+        id BIGSERIAL PRIMARY KEY,
+        name VARCHAR(50) NOT NULL
+    )
+    """,
+    """
+    CREATE FUNCTION products_record_change() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN
+            INSERT INTO products_changes (name) VALUES (OLD.name);
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            INSERT INTO products_changes (name) VALUES (NEW.name);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER products_record_change AFTER INSERT OR UPDATE OR DELETE ON products
+    FOR EACH ROW EXECUTE FUNCTION products_record_change()
+    """
+]
+# Left by a previous run of the migration that failed
+DROP_LEFTOVERS = [
+    'DROP TRIGGER IF EXISTS products_record_change ON products',
+    'DROP FUNCTION IF EXISTS products_record_change()',
+    'DROP TABLE IF EXISTS products_changes',
+    'DROP TABLE IF EXISTS products_partitioned'
+]
+
+# Applies a batch of the changelog: the products changed are copied again, or removed if they were deleted
+APPLY_CHANGES = sa.text("""
+    WITH changed AS (
+        DELETE FROM products_changes WHERE id IN (SELECT id FROM products_changes ORDER BY id LIMIT :batch_size)
+        RETURNING name
+    ), names AS (
+        SELECT DISTINCT name FROM changed
+    ), upserted AS (
+        INSERT INTO products_partitioned ({0})
+        SELECT 'default', p.name, p.shopping_cart, p.version FROM products p JOIN names n ON n.name = p.name
+        ON CONFLICT (tenant_id, name) DO UPDATE SET shopping_cart = EXCLUDED.shopping_cart,
+            version = EXCLUDED.version
+        RETURNING 1
+    ), deleted AS (
+        DELETE FROM products_partitioned d USING names n
+        WHERE d.tenant_id = 'default' AND d.name = n.name
+            AND NOT EXISTS (SELECT 1 FROM products p WHERE p.name = n.name)
+        RETURNING 1
+    )
+    SELECT count(*) FROM changed
+""".format(PRODUCT_COLUMNS))
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        # Other databases don't support declarative partitioning, the tenant is only added to the primary key (the
+        # table is recreated, the primary key of the products table is unnamed until then)
+        with op.batch_alter_table('products', recreate='always') as batch_op:
+            batch_op.add_column(sa.Column('tenant_id', sa.String(length=50), server_default='default',
+                                          nullable=False))
+            batch_op.create_primary_key('pk_products', ['tenant_id', 'name'])
+        return
+
+    # PostgreSQL declarative partitioning: the products are spread by the hash of the tenant over a fixed number
+    # of partitions. Each partition has its own (smaller) primary key index and is vacuumed separately, and the
+    # queries filtering by tenant only touch one partition. The primary key of a partitioned table must include
+    # the partition key.
+    partitions = current_app.config['TENANT_PARTITIONS']
+    for statement in DROP_LEFTOVERS:
+        op.execute(statement)
+    op.execute("""
+        CREATE TABLE products_partitioned (
+            tenant_id VARCHAR(50) NOT NULL DEFAULT 'default',
+            name VARCHAR(50) NOT NULL,
+            shopping_cart BOOLEAN NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1,
+            CONSTRAINT pk_products PRIMARY KEY (tenant_id, name)
+        ) PARTITION BY HASH (tenant_id)
+    """)
+    for remainder in range(partitions):
+        op.execute('CREATE TABLE products_p{0} PARTITION OF products_partitioned '
+                   'FOR VALUES WITH (MODULUS {1}, REMAINDER {0})'.format(remainder, partitions))
+
+    # The products are copied in batches, each committed on its own, while the service keeps reading and writing
+    # the products table: no batch holds its locks or its WAL for long. The writes made meanwhile are recorded in the
+    # changelog (the trigger is committed before the first batch) and applied in batches too, until only the last
+    # batch is left. Then only this delta is applied with the writes blocked, and the tables are swapped: the writes
+    # are blocked for a time proportional to the writes of the last batch, not to the size of the table.
+    for statement in RECORD_CHANGES:
+        op.execute(statement)
+    batch_size = config('MIGRATIONS_BACKFILL_BATCH_SIZE', 1000)
+    pause = config('MIGRATIONS_BACKFILL_PAUSE', 0.1)
+    copy_batches(batch_size, pause)
+    apply_changes(batch_size, pause)
+
+    def swap():
+        # EXCLUSIVE blocks the writes (it waits for the writes in progress, whose changes are then recorded), the
+        # reads go on until the tables are renamed. The statements run with the writes blocked are cancelled after
+        # MIGRATIONS_SWAP_TIMEOUT milliseconds, the migration then fails and can be run again.
+        started = time.perf_counter()
+        op.execute('SET LOCAL statement_timeout = {:d}'.format(config('MIGRATIONS_SWAP_TIMEOUT', 5000)))
+        op.execute('LOCK TABLE products IN EXCLUSIVE MODE')
+        bind = op.get_bind()
+        while bind.execute(APPLY_CHANGES, {'batch_size': batch_size}).scalar():
+            pass
+        op.execute('DROP TRIGGER products_record_change ON products')
+        op.rename_table('products', 'products_unpartitioned')
+        op.rename_table('products_partitioned', 'products')
+        op.execute('RESET statement_timeout')
+        logger.info('Products table swapped, writes blocked for {:.0f}ms'.format(
+            (time.perf_counter() - started) * 1000))
+    with_lock_timeout(swap)
+    op.drop_table('products_unpartitioned')
+    op.drop_table('products_changes')
+    op.execute('DROP FUNCTION products_record_change()')
+
+
+def copy_batches(batch_size, pause):
+    bind = op.get_bind()
+    total = bind.execute(sa.text('SELECT count(*) FROM products')).scalar()
+    copied = 0
+    last = None
+    started = time.perf_counter()
+    with op.get_context().autocommit_block():
+        while True:
+            names = [row[0] for row in bind.execute(COPY_BATCH, {'last': last, 'batch_size': batch_size})]
+            if not names:
+                break
+            copied += len(names)
+            last = max(names)
+            logger.info('Copy of products: {}/{} rows ({:.0f} rows/s)'.format(
+                copied, total, copied / max(time.perf_counter() - started, 1e-6)))
+            if len(names) < batch_size:
+                break
+            time.sleep(pause)
+
+
+def apply_changes(batch_size, pause):
+    bind = op.get_bind()
+    with op.get_context().autocommit_block():
+        while True:
+            applied = bind.execute(APPLY_CHANGES, {'batch_size': batch_size}).scalar()
+            logger.info('Changes of products applied: {} rows'.format(applied))
+            if applied < batch_size:
+                break
+            time.sleep(pause)
+
+
+def downgrade():
+    # Only the products of the default tenant are kept, the name alone is the primary key again
+    if op.get_bind().dialect.name != 'postgresql':
+        op.execute("DELETE FROM products WHERE tenant_id <> 'default'")
+        with op.batch_alter_table('products', recreate='always') as batch_op:
+            batch_op.drop_constraint('pk_products', type_='primary')
+            batch_op.drop_column('tenant_id')
+            batch_op.create_primary_key('pk_products', ['name'])
+        return
+
+    op.rename_table('products', 'products_partitioned')
+    op.execute('ALTER TABLE products_partitioned RENAME CONSTRAINT pk_products TO pk_products_partitioned')
+    op.create_table(
+        'products',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('shopping_cart', sa.Boolean(), nullable=False),
+        sa.Column('version', sa.Integer(), server_default='1', nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.execute("INSERT INTO products (name, shopping_cart, version) SELECT name, shopping_cart, version "
+               "FROM products_partitioned WHERE tenant_id = 'default'")
+    # Dropping the partitioned table drops its partitions
+    op.drop_table('products_partitioned')
@@ -0,0 +1,25 @@
+"""index the shopping cart of the products
+
+Revision ID: d7a3f1c9e624
+Revises: c4e9a2f7b815
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from myapp.online_migrations import create_index_concurrently, drop_index_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a3f1c9e624'
+down_revision = 'c4e9a2f7b815'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The products table is large, the index is built without blocking the writes (outside of the transaction of
+    # the migration on PostgreSQL)
+    create_index_concurrently('ix_products_shopping_cart', 'products', ['tenant_id', 'shopping_cart'])
+
+
+def downgrade():
+    drop_index_concurrently('ix_products_shopping_cart', 'products')
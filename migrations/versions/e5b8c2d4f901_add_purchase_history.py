@@ -0,0 +1,50 @@
+"""add the purchase history of the products
+
+Revision ID: e5b8c2d4f901
+Revises: d7a3f1c9e624
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b8c2d4f901'
+down_revision = 'd7a3f1c9e624'
+branch_labels = None
+depends_on = None
+
+
+ROLLUPS = ['purchases_daily', 'purchases_weekly']
+
+
+def upgrade():
+    op.create_table(
+        'purchase_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('tenant_id', sa.String(length=50), nullable=False),
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('purchased_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id', name='pk_purchase_events')
+    )
+    op.create_index('ix_purchase_events_purchased_at', 'purchase_events', ['purchased_at'])
+    # One row per tenant, product and bucket (first day of the day or week)
+    for table in ROLLUPS:
+        op.create_table(
+            table,
+            sa.Column('tenant_id', sa.String(length=50), nullable=False),
+            sa.Column('name', sa.String(length=50), nullable=False),
+            sa.Column('bucket', sa.Date(), nullable=False),
+            sa.Column('purchases', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('tenant_id', 'name', 'bucket', name='pk_{}'.format(table))
+        )
+        op.create_index('ix_{}_bucket'.format(table), table, ['tenant_id', 'bucket'])
+
+
+def downgrade():
+    for table in ROLLUPS:
+        op.drop_index('ix_{}_bucket'.format(table), table_name=table)
+        op.drop_table(table)
+    op.drop_index('ix_purchase_events_purchased_at', table_name='purchase_events')
+    op.drop_table('purchase_events')
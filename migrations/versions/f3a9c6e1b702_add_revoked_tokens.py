@@ -0,0 +1,32 @@
+"""add the revoked authentication tokens
+
+Revision ID: f3a9c6e1b702
+Revises: e5b8c2d4f901
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9c6e1b702'
+down_revision = 'e5b8c2d4f901'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Listed until their expiration, the workers load the ids of the tokens not expired yet
+    op.create_table(
+        'revoked_tokens',
+        sa.Column('jti', sa.String(length=32), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('jti', name='pk_revoked_tokens')
+    )
+    op.create_index('ix_revoked_tokens_expires_at', 'revoked_tokens', ['expires_at'])
+
+
+def downgrade():
+    op.drop_index('ix_revoked_tokens_expires_at', table_name='revoked_tokens')
+    op.drop_table('revoked_tokens')